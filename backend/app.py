@@ -6,15 +6,26 @@ from flask import Flask, request, jsonify, send_from_directory
 from flask_cors import CORS
 from flask_jwt_extended import JWTManager, create_access_token, jwt_required, get_jwt_identity, get_jwt
 from datetime import datetime, timedelta
+import os
 from config import Config
 from database import Database
 from user_service import UserService
 from email_service import EmailService
 from chatbot_service import ChatbotService
 from student_roster_service import StudentRosterService
-from face_service import FaceService
+from face_service import FaceService, model_warmup
+from checkin_cache import active_checkins, user_active_lists
+from checkin_writer import checkin_writer
+from checkin_scheduler import checkin_scheduler
+from evidence_store import evidence_store, find_original
+from face_verifier import face_verifier
+from face_worker import InferenceBusyError
 from message_service import MessageService
 from websocket_server import socketio, init_socketio
+from session_registry import socket_sessions
+from presence import contact_graph, presence_broadcaster
+from online_status import online_status
+from group_messaging import group_messages
 from models import db
 from group_chat_service import group_chat_bp
 from checkin_service import checkin_bp
@@ -478,11 +489,27 @@ def approve_teacher():
 
 @app.route('/api/health', methods=['GET'])
 def health_check():
-    """健康检查"""
+    """健康检查，开启模型预加载时预加载完成前（或预加载失败）返回 503"""
+    ready = model_warmup.ready or not Config.FACE_WARMUP
     return jsonify({
-        'status': 'healthy',
-        'timestamp': datetime.now().isoformat()
-    })
+        'status': 'healthy' if ready else ('failed' if model_warmup.state == 'failed' else 'warming'),
+        'ready': ready,
+        'timestamp': datetime.now().isoformat(),
+        'db_pool': Database.pool_stats(),
+        'face_batch': FaceService.batch_stats(),
+        'face_verifier': face_verifier.stats(),
+        'checkin_cache': active_checkins.stats(),
+        'active_list_cache': user_active_lists.stats(),
+        'checkin_writer': checkin_writer.stats(),
+        'checkin_scheduler': checkin_scheduler.stats(),
+        'evidence_store': evidence_store.stats(),
+        'websocket_sessions': socket_sessions.stats(),
+        'contact_graph': contact_graph.stats(),
+        'presence': presence_broadcaster.stats(),
+        'online_status': online_status.stats(),
+        'group_messages': group_messages.stats(),
+        'warmup': model_warmup.status()
+    }), 200 if ready else 503
 
 # 错误处理
 @app.errorhandler(404)
@@ -493,6 +520,12 @@ def not_found(error):
 def internal_error(error):
     return jsonify({'success': False, 'message': '服务器内部错误'}), 500
 
+@app.errorhandler(InferenceBusyError)
+def inference_busy(error):
+    response = jsonify({'success': False, 'message': str(error)})
+    response.headers['Retry-After'] = str(error.retry_after)
+    return response, 503
+
 # ==================== AI聊天机器人路由 ====================
 
 @app.route('/api/chatbot/sessions', methods=['GET'])
@@ -892,6 +925,8 @@ def register_face():
         else:
             return jsonify(result), 400
     
+    except InferenceBusyError:
+        raise
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)}), 500
 
@@ -958,6 +993,23 @@ def detect_head_pose():
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)}), 500
 
+@app.route('/api/face/liveness-frame', methods=['POST'])
+def detect_liveness_frame():
+    """单帧同时检测眨眼和头部姿态"""
+    try:
+        from face_service import LivenessDetector
+        data = request.get_json()
+        frame_data = data.get('frame')
+        
+        if not frame_data:
+            return jsonify({'success': False, 'message': '缺少图像数据'}), 400
+        
+        result = LivenessDetector.analyze_frame(frame_data)
+        return jsonify(result)
+    
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
 @app.route('/api/auth/face-login', methods=['POST'])
 def face_login():
     """人脸登录（支持活体检测）"""
@@ -1042,6 +1094,8 @@ def face_login():
             }
         })
     
+    except InferenceBusyError:
+        raise
     except Exception as e:
         print(f"人脸登录异常: {str(e)}")
         import traceback
@@ -1169,10 +1223,18 @@ def serve_message_file(filename):
 # 静态文件服务（签到人脸截图）
 @app.route('/uploads/checkin_faces/<path:filename>')
 def serve_checkin_face(filename):
-    return send_from_directory('uploads/checkin_faces', filename)
+    # 缩略图还在后台生成（或生成失败）时临时返回原图，不允许缓存
+    fallback = False
+    if filename.startswith('thumbs/') and not os.path.exists(os.path.join(app.root_path, 'uploads/checkin_faces', filename)):
+        original = find_original(filename[len('thumbs/'):].rsplit('.', 1)[0])
+        if original:
+            filename, fallback = original, True
+    response = send_from_directory('uploads/checkin_faces', filename)
+    # 文件名由内容决定（旧截图带时间戳），内容不会变化，可以长期缓存
+    response.headers['Cache-Control'] = 'no-cache' if fallback else 'public, max-age=31536000, immutable'
+    return response
 
 if __name__ == '__main__':
-    import os
     import ssl
     
     if not os.path.exists(Config.UPLOAD_FOLDER):
@@ -1185,6 +1247,20 @@ if __name__ == '__main__':
     # 初始化 WebSocket
     init_socketio(app)
     
+    # 上次异常退出时残留的在线状态改为离线
+    try:
+        online_status.recover()
+    except Exception as e:
+        print(f"[在线状态] 恢复失败: {e}")
+    
+    # 签到到期自动结束（启动时从数据库加载进行中的签到）
+    if Config.CHECKIN_SCHEDULER:
+        checkin_scheduler.start()
+    
+    # 预加载人脸模型（后台进行，完成前 /api/health 报告未就绪）
+    if Config.FACE_WARMUP:
+        model_warmup.start()
+    
     # 检查是否存在 SSL 证书
     ssl_cert = 'cert.pem'
     ssl_key = 'key.pem'
@@ -1193,12 +1269,12 @@ if __name__ == '__main__':
     print("=" * 50)
     print("服务器启动中...")
     if use_ssl:
-        print(f"HTTPS API: https://0.0.0.0:5000")
-        print(f"WebSocket: wss://0.0.0.0:5000/socket.io")
+        print(f"HTTPS API: https://0.0.0.0:{Config.SERVER_PORT}")
+        print(f"WebSocket: wss://0.0.0.0:{Config.SERVER_PORT}/socket.io")
         print("(使用自签名证书)")
     else:
-        print(f"HTTP API: http://0.0.0.0:5000")
-        print(f"WebSocket: ws://0.0.0.0:5000/socket.io")
+        print(f"HTTP API: http://0.0.0.0:{Config.SERVER_PORT}")
+        print(f"WebSocket: ws://0.0.0.0:{Config.SERVER_PORT}/socket.io")
     print("=" * 50)
     
     # 使用 socketio.run 代替 app.run
@@ -1210,7 +1286,7 @@ if __name__ == '__main__':
         socketio.run(
             app, 
             host='0.0.0.0', 
-            port=5000, 
+            port=Config.SERVER_PORT, 
             debug=False,
             log_output=True,
             ssl_context=ssl_context
@@ -1219,7 +1295,7 @@ if __name__ == '__main__':
         socketio.run(
             app, 
             host='0.0.0.0', 
-            port=5000, 
+            port=Config.SERVER_PORT, 
             debug=False,
             log_output=True
         )
@@ -0,0 +1,170 @@
+"""
+考勤汇总表维护
+教师统计出勤率原先要分页拉取 checkin_records 在前端累加。这里维护两张汇总表：
+
+- checkin_attendance_stats: 每个 (群组, 学生) 的 checked / late / absent 次数
+- checkin_totals: 每个签到的 checked / late / absent 人数
+
+签到记录写入时（checkin_writer）在同一事务内增量更新，有重复记录时改为按受影响的键重新统计；
+签到结束补写缺勤记录时（checkin_scheduler）按记录重新统计结束的签到。
+汇总表更新失败只打印日志，不影响签到记录本身，可执行 init_attendance_rollup.py 重建。
+"""
+from checkin_cache import active_checkins
+
+
+def _in(values):
+    return ', '.join(['%s'] * len(values))
+
+
+def apply_written(cursor, records, inserted):
+    """
+    签到记录写入后更新汇总（与写入在同一事务中）
+
+    Args:
+        records: 本次写入的记录 [{checkin_id, user_id, status, checkin_time, ...}]
+        inserted: 实际插入的行数（重复记录不计）
+    """
+    if not records:
+        return
+    try:
+        if inserted == len(records):
+            _increment(cursor, records)
+        else:
+            recompute(cursor, {r['checkin_id'] for r in records}, {r['user_id'] for r in records})
+    except Exception as e:
+        print(f'[考勤汇总] 更新失败: {e}')
+
+
+def _increment(cursor, records):
+    """所有记录都已插入：按记录累加"""
+    group_ids = {}
+    for checkin_id in {r['checkin_id'] for r in records}:
+        checkin = active_checkins.get(checkin_id)
+        group_ids[checkin_id] = checkin['group_id'] if checkin else None
+
+    students, totals = {}, {}
+    for r in records:
+        column = {'checked': 0, 'late': 1, 'absent': 2}.get(r['status'])
+        if column is None:
+            continue
+        total = totals.setdefault(r['checkin_id'], [0, 0, 0])
+        total[column] += 1
+        group_id = group_ids[r['checkin_id']]
+        if group_id is None:
+            continue
+        student = students.setdefault((group_id, r['user_id']), [0, 0, 0, None])
+        student[column] += 1
+        if column != 2 and (student[3] is None or r['checkin_time'] > student[3]):
+            student[3] = r['checkin_time']
+
+    if students:
+        cursor.execute(f"""
+            INSERT INTO checkin_attendance_stats
+                (group_id, user_id, checked_count, late_count, absent_count, last_checkin_at)
+            VALUES {', '.join(['(%s, %s, %s, %s, %s, %s)'] * len(students))}
+            ON DUPLICATE KEY UPDATE
+                checked_count = checked_count + VALUES(checked_count),
+                late_count = late_count + VALUES(late_count),
+                absent_count = absent_count + VALUES(absent_count),
+                last_checkin_at = GREATEST(COALESCE(last_checkin_at, VALUES(last_checkin_at)),
+                                           COALESCE(VALUES(last_checkin_at), last_checkin_at))
+        """, [v for key, counts in students.items() for v in (*key, *counts)])
+    if totals:
+        cursor.execute(f"""
+            INSERT INTO checkin_totals (checkin_id, group_id, checked_count, late_count, absent_count)
+            VALUES {', '.join(['(%s, %s, %s, %s, %s)'] * len(totals))}
+            ON DUPLICATE KEY UPDATE
+                checked_count = checked_count + VALUES(checked_count),
+                late_count = late_count + VALUES(late_count),
+                absent_count = absent_count + VALUES(absent_count)
+        """, [v for checkin_id, counts in totals.items() for v in (checkin_id, group_ids[checkin_id], *counts)])
+
+
+def recompute(cursor, checkin_ids, user_ids=None):
+    """
+    按 checkin_records 重新统计受影响的签到和 (群组, 学生)
+
+    user_ids 为 None 时重新统计这些签到所在群组的全部学生。
+    """
+    checkin_ids = sorted(checkin_ids)
+    cursor.execute(f"""
+        INSERT INTO checkin_totals (checkin_id, group_id, checked_count, late_count, absent_count, closed)
+        SELECT c.id, c.group_id,
+               COALESCE(SUM(cr.status = 'checked'), 0), COALESCE(SUM(cr.status = 'late'), 0),
+               COALESCE(SUM(cr.status = 'absent'), 0), c.status = 'ended'
+        FROM checkins c
+        LEFT JOIN checkin_records cr ON cr.checkin_id = c.id
+        WHERE c.id IN ({_in(checkin_ids)})
+        GROUP BY c.id
+        ON DUPLICATE KEY UPDATE
+            checked_count = VALUES(checked_count), late_count = VALUES(late_count),
+            absent_count = VALUES(absent_count), closed = VALUES(closed)
+    """, checkin_ids)
+
+    cursor.execute(f"SELECT DISTINCT group_id FROM checkins WHERE id IN ({_in(checkin_ids)}) AND group_id IS NOT NULL",
+                   checkin_ids)
+    group_ids = [row['group_id'] for row in cursor.fetchall()]
+    if not group_ids:
+        return
+    params = list(group_ids)
+    user_filter = ''
+    if user_ids is not None:
+        user_filter = f'AND cr.user_id IN ({_in(user_ids)})'
+        params += sorted(user_ids)
+    cursor.execute(f"""
+        INSERT INTO checkin_attendance_stats
+            (group_id, user_id, checked_count, late_count, absent_count, last_checkin_at)
+        SELECT c.group_id, cr.user_id,
+               SUM(cr.status = 'checked'), SUM(cr.status = 'late'), SUM(cr.status = 'absent'),
+               MAX(IF(cr.status <> 'absent', cr.checkin_time, NULL))
+        FROM checkin_records cr
+        JOIN checkins c ON c.id = cr.checkin_id
+        WHERE c.group_id IN ({_in(group_ids)}) {user_filter}
+        GROUP BY c.group_id, cr.user_id
+        ON DUPLICATE KEY UPDATE
+            checked_count = VALUES(checked_count), late_count = VALUES(late_count),
+            absent_count = VALUES(absent_count), last_checkin_at = VALUES(last_checkin_at)
+    """, params)
+
+
+def apply_closed(cursor, checkin_ids):
+    """
+    签到结束后更新汇总（与补写缺勤记录在同一事务中）
+
+    结束前 /location/revalidate 可能已把部分记录改为缺勤并重新统计过，
+    不能按缺勤记录逐条加一，这里按记录重新统计这些签到及其群组的学生。
+    """
+    if not checkin_ids:
+        return
+    try:
+        recompute(cursor, checkin_ids)
+    except Exception as e:
+        print(f'[考勤汇总] 更新失败: {e}')
+
+
+def rebuild(cursor):
+    """按全部签到记录重建汇总表"""
+    cursor.execute("DELETE FROM checkin_totals")
+    cursor.execute("DELETE FROM checkin_attendance_stats")
+    cursor.execute("""
+        INSERT INTO checkin_totals (checkin_id, group_id, checked_count, late_count, absent_count, closed)
+        SELECT c.id, c.group_id,
+               COALESCE(SUM(cr.status = 'checked'), 0), COALESCE(SUM(cr.status = 'late'), 0),
+               COALESCE(SUM(cr.status = 'absent'), 0), c.status = 'ended'
+        FROM checkins c
+        LEFT JOIN checkin_records cr ON cr.checkin_id = c.id
+        GROUP BY c.id
+    """)
+    totals = cursor.rowcount
+    cursor.execute("""
+        INSERT INTO checkin_attendance_stats
+            (group_id, user_id, checked_count, late_count, absent_count, last_checkin_at)
+        SELECT c.group_id, cr.user_id,
+               SUM(cr.status = 'checked'), SUM(cr.status = 'late'), SUM(cr.status = 'absent'),
+               MAX(IF(cr.status <> 'absent', cr.checkin_time, NULL))
+        FROM checkin_records cr
+        JOIN checkins c ON c.id = cr.checkin_id
+        WHERE c.group_id IS NOT NULL
+        GROUP BY c.group_id, cr.user_id
+    """)
+    return totals, cursor.rowcount
@@ -0,0 +1,135 @@
+"""
+进行中签到列表基准测试
+在 .env 配置的数据库中临时创建 G 个群组、每个群组 C 个进行中签到（默认 100 x 20），
+对比原来的 N+1 查询、单条集合查询和按用户缓存三种方式的耗时，结束后删除测试数据。
+
+用法:
+    python benchmark_active_checkins.py
+    python benchmark_active_checkins.py --groups 100 --checkins 20 --members 30 --repeat 20
+"""
+import time
+import argparse
+from datetime import datetime, timedelta
+from database import Database
+from checkin_cache import UserActiveListCache
+from checkin_service import fetch_active_checkins
+
+
+def legacy_active_checkins(cursor, user_id):
+    """原实现：相关子查询统计人数 + 逐个签到查询本人状态"""
+    cursor.execute("""
+        SELECT c.*, g.name as group_name, u.real_name as creator_name,
+               (SELECT COUNT(*) FROM checkin_records WHERE checkin_id = c.id) as checked_count
+        FROM checkins c
+        JOIN chat_groups g ON c.group_id = g.id
+        JOIN group_members gm ON g.id = gm.group_id AND gm.user_id = %s
+        LEFT JOIN users u ON c.creator_id = u.user_id
+        WHERE c.status = 'active' AND c.end_time > NOW()
+        ORDER BY c.created_at DESC
+    """, (user_id,))
+    checkins = cursor.fetchall()
+    for c in checkins:
+        cursor.execute("""
+            SELECT status FROM checkin_records
+            WHERE checkin_id = %s AND user_id = %s
+        """, (c['id'], user_id))
+        record = cursor.fetchone()
+        c['my_status'] = record['status'] if record else None
+    return checkins
+
+
+def populate(creator_id, user_ids, groups, checkins_per_group):
+    """创建测试群组和签到，每个签到约一半成员已签到，返回群组 id 列表"""
+    conn = Database.get_connection()
+    group_ids = []
+    try:
+        with conn.cursor() as cursor:
+            end_time = datetime.now() + timedelta(hours=1)
+            for g in range(groups):
+                cursor.execute("INSERT INTO chat_groups (name, owner_id) VALUES (%s, %s)",
+                               (f'基准测试群{g}', creator_id))
+                group_id = cursor.lastrowid
+                group_ids.append(group_id)
+                cursor.executemany("INSERT INTO group_members (group_id, user_id, role) VALUES (%s, %s, 'member')",
+                                   [(group_id, uid) for uid in user_ids])
+                for c in range(checkins_per_group):
+                    cursor.execute("""
+                        INSERT INTO checkins (group_id, creator_id, title, type, checkin_code, duration, end_time, status)
+                        VALUES (%s, %s, %s, 'qrcode', %s, 60, %s, 'active')
+                    """, (group_id, creator_id, f'基准测试签到{c}', f'BM{g:03d}{c:03d}', end_time))
+                    checkin_id = cursor.lastrowid
+                    checked = user_ids[(g + c) % 2::2]
+                    cursor.executemany(
+                        "INSERT INTO checkin_records (checkin_id, user_id, status) VALUES (%s, %s, 'checked')",
+                        [(checkin_id, uid) for uid in checked]
+                    )
+        conn.commit()
+    finally:
+        conn.close()
+    return group_ids
+
+
+def cleanup(group_ids):
+    if not group_ids:
+        return
+    placeholders = ', '.join(['%s'] * len(group_ids))
+    Database.execute_query(f"DELETE FROM checkins WHERE group_id IN ({placeholders})", tuple(group_ids), commit=True)
+    Database.execute_query(f"DELETE FROM chat_groups WHERE id IN ({placeholders})", tuple(group_ids), commit=True)
+
+
+def timed(fn, repeat):
+    result = None
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = fn()
+    return (time.perf_counter() - start) / repeat * 1000, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='进行中签到列表基准测试')
+    parser.add_argument('--groups', type=int, default=100)
+    parser.add_argument('--checkins', type=int, default=20, help='每个群组的进行中签到数')
+    parser.add_argument('--members', type=int, default=30, help='每个群组的成员数')
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    rows = Database.execute_query("SELECT user_id FROM users ORDER BY user_id LIMIT %s",
+                                  (args.members + 1,), fetch_all=True)
+    creator_id, user_ids = rows[0]['user_id'], [r['user_id'] for r in rows[1:]]
+    student_id = user_ids[0]
+
+    print(f"创建 {args.groups} 个群组 x {args.checkins} 个进行中签到，每群 {len(user_ids)} 名成员 ...")
+    group_ids = populate(creator_id, user_ids, args.groups, args.checkins)
+    try:
+        cache = UserActiveListCache(ttl=5)
+        conn = Database.get_connection()
+        try:
+            with conn.cursor() as cursor:
+                def cached():
+                    checkins = cache.get(student_id)
+                    if checkins is None:
+                        checkins = fetch_active_checkins(cursor, student_id)
+                        cache.put(student_id, checkins)
+                    return checkins
+
+                legacy_ms, legacy = timed(lambda: legacy_active_checkins(cursor, student_id), args.repeat)
+                single_ms, single = timed(lambda: fetch_active_checkins(cursor, student_id), args.repeat)
+                cached_ms, _ = timed(cached, args.repeat)
+        finally:
+            conn.close()
+
+        # 两种查询结果必须一致
+        key = lambda c: (c['id'], c['checked_count'], c['my_status'])
+        assert sorted(map(key, legacy)) == sorted(map(key, single)), '查询结果不一致'
+
+        print(f"返回签到 {len(single)} 条，每种方式重复 {args.repeat} 次")
+        print(f"{'方式':<12} {'平均(ms)':>10} {'查询数':>8}")
+        print(f"{'N+1':<12} {legacy_ms:>10.2f} {len(legacy) + 1:>8}")
+        print(f"{'单条查询':<12} {single_ms:>10.2f} {1:>8}")
+        print(f"{'单条+缓存':<12} {cached_ms:>10.3f} {'-':>8}   命中率 {cache.stats()['hit_rate']:.0%}")
+    finally:
+        cleanup(group_ids)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+"""
+特征提取微批处理基准测试
+对比逐张 DeepFace.represent 与按批前向计算的吞吐量（需要安装 DeepFace）
+
+用法:
+    python benchmark_embedding_batch.py                     # 使用随机图片（跳过人脸检测）
+    python benchmark_embedding_batch.py --images ./faces    # 使用目录中的人脸照片
+    python benchmark_embedding_batch.py --count 128 --batch 8 16 32
+"""
+import os
+import time
+import argparse
+import numpy as np
+from face_worker import run_represent, run_represent_batch
+
+MODEL_NAME = 'Facenet'
+
+
+def load_images(folder, count):
+    from PIL import Image
+    files = sorted(f for f in os.listdir(folder) if f.lower().endswith(('.jpg', '.jpeg', '.png')))
+    if not files:
+        raise SystemExit(f'{folder} 中没有图片')
+    images = []
+    for i in range(count):
+        img = Image.open(os.path.join(folder, files[i % len(files)])).convert('RGB')
+        images.append(np.array(img))
+    return images
+
+
+def bench_sequential(images, detector):
+    start = time.perf_counter()
+    for img in images:
+        try:
+            run_represent(img, MODEL_NAME, detector, enforce_detection=False)
+        except Exception:
+            pass
+    return time.perf_counter() - start
+
+
+def bench_batched(images, detector, batch_size):
+    start = time.perf_counter()
+    for i in range(0, len(images), batch_size):
+        run_represent_batch(images[i:i + batch_size], MODEL_NAME, detector, enforce_detection=False)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description='特征提取微批处理基准测试')
+    parser.add_argument('--images', help='人脸照片目录，不指定时使用随机图片')
+    parser.add_argument('--count', type=int, default=64)
+    parser.add_argument('--batch', type=int, nargs='+', default=[4, 8, 16, 32])
+    parser.add_argument('--detector', default=None, help='默认: 指定目录时 retinaface，否则 skip')
+    args = parser.parse_args()
+
+    if args.images:
+        images = load_images(args.images, args.count)
+        detector = args.detector or 'retinaface'
+    else:
+        rng = np.random.default_rng(0)
+        images = [rng.integers(0, 255, (160, 160, 3), dtype=np.uint8) for _ in range(args.count)]
+        detector = args.detector or 'skip'
+
+    # 预热：加载模型权重、构建计算图
+    run_represent(images[0], MODEL_NAME, detector, enforce_detection=False)
+    run_represent_batch(images[:2], MODEL_NAME, detector, enforce_detection=False)
+
+    sequential = bench_sequential(images, detector)
+    print(f"图片数 {len(images)}，检测器 {detector}")
+    print(f"{'批大小':>6} {'耗时(s)':>10} {'吞吐(张/s)':>12} {'加速比':>8}")
+    print(f"{1:>6} {sequential:>10.2f} {len(images) / sequential:>12.1f} {1.0:>8.2f}")
+    for batch_size in args.batch:
+        elapsed = bench_batched(images, detector, batch_size)
+        print(f"{batch_size:>6} {elapsed:>10.2f} {len(images) / elapsed:>12.1f} {sequential / elapsed:>8.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+"""
+人脸验证路径基准测试
+对比原来签到接口中的比对方式（每次请求解析数据库中的特征 + cosine_distance）与
+FaceVerifier（特征常驻人脸索引）的耗时，并输出 FaceVerifier 各阶段平均耗时。
+
+不需要数据库和模型：特征提取用注入的假函数（可用 --extract-ms 模拟推理耗时），
+图片以已解码的数组传入，已注册特征放在内存中的 FaceIndex。
+
+用法:
+    python benchmark_face_verifier.py
+    python benchmark_face_verifier.py --users 10000 --repeat 2000 --extract-ms 5
+"""
+import time
+import argparse
+import numpy as np
+from embedding_codec import encode_embedding, decode_embedding
+from face_index import FaceIndex
+from face_verifier import FaceVerifier
+
+THRESHOLD = 0.32
+
+
+class ArrayVerifier(FaceVerifier):
+    """输入已是解码后的数组，跳过图片解码"""
+
+    def decode(self, image):
+        return image
+
+
+def cosine_distance(embedding1, embedding2):
+    similarity = np.dot(embedding1, embedding2) / (np.linalg.norm(embedding1) * np.linalg.norm(embedding2))
+    return 1 - similarity
+
+
+def main():
+    parser = argparse.ArgumentParser(description='人脸验证路径基准测试')
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--repeat', type=int, default=1000)
+    parser.add_argument('--extract-ms', type=float, default=0, help='模拟的特征提取耗时（毫秒）')
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    embeddings = rng.standard_normal((args.users, 128)).astype(np.float32)
+    stored_rows = [encode_embedding(e) for e in embeddings]  # 数据库中的存储格式
+    user_ids = rng.integers(0, args.users, args.repeat)
+    queries = {int(uid): embeddings[uid] + rng.standard_normal(128).astype(np.float32) * 0.05
+               for uid in set(user_ids.tolist())}
+
+    def extract(img):
+        if args.extract_ms:
+            time.sleep(args.extract_ms / 1000)
+        return [{'embedding': queries[int(img[0])]}]
+
+    index = FaceIndex(dim=128, sync_interval=3600)
+    index.load(np.arange(args.users), embeddings)
+    verifier = ArrayVerifier(extract=extract, index=index, threshold=THRESHOLD)
+    images = [np.array([uid]) for uid in user_ids]
+
+    # 原实现：特征提取后解析该用户的存储特征并计算距离
+    start = time.perf_counter()
+    legacy_matched = 0
+    for uid, img in zip(user_ids, images):
+        embedding = np.array(extract(img)[0]['embedding'])
+        stored = decode_embedding(stored_rows[uid])
+        legacy_matched += cosine_distance(embedding, stored) < THRESHOLD
+    legacy_ms = (time.perf_counter() - start) / args.repeat * 1000
+
+    start = time.perf_counter()
+    matched = sum(verifier.verify(int(uid), img)['matched'] for uid, img in zip(user_ids, images))
+    verifier_ms = (time.perf_counter() - start) / args.repeat * 1000
+
+    assert matched == legacy_matched == args.repeat, '验证结果不一致'
+
+    start = time.perf_counter()
+    for img in images[:100]:
+        verifier.identify(img)
+    identify_ms = (time.perf_counter() - start) / min(100, args.repeat) * 1000
+
+    print(f"已注册 {args.users} 人，1:1 验证 {args.repeat} 次，模拟提取耗时 {args.extract_ms}ms")
+    print(f"{'方式':<16} {'平均(ms)':>10}")
+    print(f"{'原实现 1:1':<16} {legacy_ms:>10.3f}")
+    print(f"{'FaceVerifier 1:1':<16} {verifier_ms:>10.3f}")
+    print(f"{'FaceVerifier 1:N':<16} {identify_ms:>10.3f}")
+    print(f"各阶段平均耗时(ms): {verifier.stats()['avg_ms']}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,124 @@
+"""
+群消息发送基准测试
+在 .env 配置的数据库中临时创建一个群组和 M 名成员，成员轮流发送 N 条消息（默认 30 x 500），
+对比原来每步单独调用 Database.execute_query 的发送方式和 GroupMessageEngine.send 的
+单条耗时、每条消息的查询数和借出连接数，结束后删除测试数据。
+
+用法:
+    python benchmark_group_messages.py
+    python benchmark_group_messages.py --members 50 --messages 1000
+"""
+import time
+import argparse
+from database import Database
+from group_messaging import GroupMessageEngine, GroupMembershipCache, SenderProfileCache
+
+
+class DatabaseCounter:
+    """统计借出的连接数和执行的语句数"""
+
+    def __init__(self):
+        self.connections = 0
+        self.queries = 0
+        self._get_connection = Database.get_connection
+        self._execute_query = Database.execute_query
+
+    def __enter__(self):
+        counter = self
+
+        def get_connection():
+            counter.connections += 1
+            return counter._get_connection()
+
+        def execute_query(*args, **kwargs):
+            counter.queries += 1
+            return counter._execute_query(*args, **kwargs)
+
+        Database.get_connection = staticmethod(get_connection)
+        Database.execute_query = staticmethod(execute_query)
+        return self
+
+    def __exit__(self, *exc):
+        Database.get_connection = staticmethod(self._get_connection)
+        Database.execute_query = staticmethod(self._execute_query)
+
+
+def legacy_send(group_id, sender_id, content):
+    """原实现：身份、插入、发送者、created_at 各一次 execute_query"""
+    member = Database.execute_query(
+        "SELECT role, is_muted FROM group_members WHERE group_id = %s AND user_id = %s",
+        (group_id, sender_id), fetch_one=True
+    )
+    assert member and not member['is_muted']
+    message_id = Database.execute_query("""
+        INSERT INTO group_messages (group_id, sender_id, message_type, content)
+        VALUES (%s, %s, %s, %s)
+    """, (group_id, sender_id, 'text', content), commit=True)
+    sender = Database.execute_query("SELECT real_name, photo_url FROM users WHERE user_id = %s",
+                                    (sender_id,), fetch_one=True)
+    msg = Database.execute_query("SELECT created_at FROM group_messages WHERE id = %s",
+                                 (message_id,), fetch_one=True)
+    return {'id': message_id, 'sender_name': sender['real_name'], 'created_at': msg['created_at'].isoformat()}
+
+
+def populate(owner_id, user_ids):
+    conn = Database.get_connection()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("INSERT INTO chat_groups (name, owner_id) VALUES (%s, %s)", ('基准测试群', owner_id))
+            group_id = cursor.lastrowid
+            cursor.executemany("INSERT INTO group_members (group_id, user_id, role) VALUES (%s, %s, 'member')",
+                               [(group_id, uid) for uid in user_ids])
+        conn.commit()
+    finally:
+        conn.close()
+    return group_id
+
+
+def cleanup(group_id):
+    Database.execute_query("DELETE FROM group_messages WHERE group_id = %s", (group_id,), commit=True)
+    Database.execute_query("DELETE FROM group_members WHERE group_id = %s", (group_id,), commit=True)
+    Database.execute_query("DELETE FROM chat_groups WHERE id = %s", (group_id,), commit=True)
+
+
+def run(send, senders, messages):
+    """返回 (平均耗时 ms, 每条借出连接数, 每条 execute_query 调用数)"""
+    with DatabaseCounter() as counter:
+        start = time.perf_counter()
+        for n in range(messages):
+            send(senders[n % len(senders)], f'基准测试消息{n}')
+        elapsed = time.perf_counter() - start
+    return elapsed / messages * 1000, counter.connections / messages, counter.queries / messages
+
+
+def main():
+    parser = argparse.ArgumentParser(description='群消息发送基准测试')
+    parser.add_argument('--members', type=int, default=30)
+    parser.add_argument('--messages', type=int, default=500)
+    args = parser.parse_args()
+
+    rows = Database.execute_query("SELECT user_id FROM users ORDER BY user_id LIMIT %s",
+                                  (args.members + 1,), fetch_all=True)
+    owner_id, user_ids = rows[0]['user_id'], [r['user_id'] for r in rows[1:]]
+
+    print(f"创建群组（{len(user_ids)} 名成员），每种方式发送 {args.messages} 条消息 ...")
+    group_id = populate(owner_id, user_ids)
+    try:
+        Database.get_pool()  # 连接池预先创建，不计入第一条消息
+        engine = GroupMessageEngine(GroupMembershipCache(ttl=60), SenderProfileCache(ttl=300))
+
+        legacy = run(lambda uid, text: legacy_send(group_id, uid, text), user_ids, args.messages)
+        current = run(lambda uid, text: engine.send(group_id, uid, 'text', text), user_ids, args.messages)
+        stats = engine.stats()
+
+        print(f"{'方式':<16} {'平均(ms)':>10} {'连接/条':>8} {'语句/条':>8}")
+        print(f"{'逐步 execute_query':<16} {legacy[0]:>10.2f} {legacy[1]:>8.2f} {legacy[2]:>8.2f}")
+        print(f"{'单事务+缓存':<16} {current[0]:>10.2f} {current[1]:>8.2f} {stats['queries_per_message']:>8.2f}"
+              f"   身份缓存命中率 {stats['membership_cache']['hit_rate']:.0%}")
+        print(f"单条耗时降低 {(1 - current[0] / legacy[0]):.0%}")
+    finally:
+        cleanup(group_id)
+
+
+if __name__ == '__main__':
+    main()
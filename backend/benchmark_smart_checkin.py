@@ -0,0 +1,67 @@
+"""
+合照点到匹配基准测试
+对比逐人脸 x 逐成员解析 JSON 的嵌套循环与 face_matching 的矩阵匹配
+
+用法: python benchmark_smart_checkin.py
+"""
+import json
+import time
+import numpy as np
+from face_matching import match_faces
+
+THRESHOLD = 0.32
+
+
+def cosine_distance(embedding1, embedding2):
+    similarity = np.dot(embedding1, embedding2) / (np.linalg.norm(embedding1) * np.linalg.norm(embedding2))
+    return 1 - similarity
+
+
+def bench_loop(faces, members):
+    """旧实现：内层循环每次解析成员特征"""
+    start = time.perf_counter()
+    matched = []
+    for face in faces:
+        face_vec = np.array(face)
+        best_match, best_distance = None, float('inf')
+        for user_id, stored in members:
+            if user_id in matched:
+                continue
+            distance = cosine_distance(face_vec, np.array(json.loads(stored)))
+            if distance < THRESHOLD and distance < best_distance:
+                best_distance, best_match = distance, user_id
+        if best_match is not None:
+            matched.append(best_match)
+    return (time.perf_counter() - start) * 1000, len(matched)
+
+
+def bench_matrix(faces, members, method):
+    start = time.perf_counter()
+    user_ids = [user_id for user_id, _ in members]
+    matrix = np.array([json.loads(stored) for _, stored in members], dtype=np.float32)
+    results = match_faces(faces, user_ids, matrix, THRESHOLD, method=method)
+    elapsed = (time.perf_counter() - start) * 1000
+    return elapsed, sum(1 for r in results if r['user_id'] is not None)
+
+
+def main():
+    rng = np.random.default_rng(0)
+    # 预热（scipy 导入）
+    match_faces(rng.normal(size=(2, 128)), [1, 2], rng.normal(size=(2, 128)), THRESHOLD)
+    print(f"{'人脸':>6} {'成员':>6} {'嵌套循环(ms)':>14} {'hungarian(ms)':>15} {'greedy(ms)':>12} {'匹配数':>14}")
+    for face_count, member_count in ((30, 60), (80, 150), (150, 300)):
+        member_vecs = rng.normal(size=(member_count, 128)).astype(np.float32)
+        members = [(i + 1, json.dumps(v.tolist())) for i, v in enumerate(member_vecs)]
+        # 合照中的人脸 = 部分成员的特征加噪声
+        present = rng.choice(member_count, face_count, replace=False)
+        faces = (member_vecs[present] + rng.normal(scale=0.3, size=(face_count, 128))).tolist()
+
+        loop_ms, loop_n = bench_loop(faces, members)
+        hungarian_ms, hungarian_n = bench_matrix(faces, members, 'hungarian')
+        greedy_ms, greedy_n = bench_matrix(faces, members, 'greedy')
+        print(f"{face_count:>6} {member_count:>6} {loop_ms:>14.1f} {hungarian_ms:>15.2f} {greedy_ms:>12.2f}"
+              f" {f'{loop_n}/{hungarian_n}/{greedy_n}':>14}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+"""
+分块检测基准测试
+把一张人脸照片按不同尺寸粘贴到大画布上合成阶梯教室合照，
+对比整图检测与分块检测的耗时和召回率（需要安装 DeepFace）
+
+用法:
+    python benchmark_tiled_detection.py --face ./face.jpg
+    python benchmark_tiled_detection.py --face ./face.jpg --size 6000 4000 --faces 150 --tile 1024 768 --overlap 0.2
+"""
+import time
+import argparse
+import numpy as np
+from face_service import decode_image
+from face_tiling import detect_tiled
+from face_worker import run_detect
+
+DETECTOR_BACKEND = 'retinaface'
+
+
+def synthesize(face, width, height, count, min_size, max_size, rng):
+    """在灰色画布上以网格排布粘贴人脸，越靠后（上方）人脸越小，返回图片和真实人脸框"""
+    import cv2
+    canvas = np.full((height, width, 3), 128, dtype=np.uint8)
+    canvas += rng.integers(0, 20, canvas.shape, dtype=np.uint8)
+    cols = int(np.ceil(np.sqrt(count * width / height)))
+    rows = int(np.ceil(count / cols))
+    cell_w, cell_h = width // cols, height // rows
+    boxes = []
+    for i in range(count):
+        r, c = divmod(i, cols)
+        # 第一行最小，最后一行最大
+        size = int(min_size + (max_size - min_size) * r / max(rows - 1, 1))
+        size = min(size, cell_w, cell_h)
+        scaled = cv2.resize(face, (size, int(size * face.shape[0] / face.shape[1])), interpolation=cv2.INTER_AREA)
+        sh, sw = scaled.shape[:2]
+        if sh > cell_h:
+            continue
+        x = c * cell_w + int(rng.integers(0, cell_w - sw + 1))
+        y = r * cell_h + int(rng.integers(0, cell_h - sh + 1))
+        canvas[y:y + sh, x:x + sw] = scaled
+        boxes.append((x, y, x + sw, y + sh))
+    return canvas, boxes
+
+
+def recall(truth, detected):
+    """真实人脸中心落在某个检测框内即视为召回"""
+    found = 0
+    for x0, y0, x1, y1 in truth:
+        cx, cy = (x0 + x1) / 2, (y0 + y1) / 2
+        if any(f['x'] <= cx <= f['x'] + f['w'] and f['y'] <= cy <= f['y'] + f['h'] for f in detected):
+            found += 1
+    return found / max(len(truth), 1)
+
+
+def detect(img):
+    return run_detect(img, DETECTOR_BACKEND)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='分块检测基准测试')
+    parser.add_argument('--face', required=True, help='单人脸照片')
+    parser.add_argument('--size', type=int, nargs=2, default=[4000, 3000], metavar=('W', 'H'))
+    parser.add_argument('--faces', type=int, default=100)
+    parser.add_argument('--min-face', type=int, default=24, help='最后一排人脸宽度（像素）')
+    parser.add_argument('--max-face', type=int, default=120, help='第一排人脸宽度（像素）')
+    parser.add_argument('--tile', type=int, nargs='+', default=[1024, 768])
+    parser.add_argument('--overlap', type=float, default=0.2)
+    args = parser.parse_args()
+
+    with open(args.face, 'rb') as f:
+        face = decode_image(f.read())
+    rng = np.random.default_rng(0)
+    img, truth = synthesize(face, args.size[0], args.size[1], args.faces, args.min_face, args.max_face, rng)
+
+    # 预热：加载检测模型
+    detect(img[:256, :256])
+
+    print(f"图片 {args.size[0]}x{args.size[1]}，人脸 {len(truth)} 张")
+    print(f"{'模式':<16} {'耗时(s)':>10} {'检测数':>8} {'召回率':>8}")
+    start = time.perf_counter()
+    faces = detect(img)
+    elapsed = time.perf_counter() - start
+    print(f"{'整图':<16} {elapsed:>10.2f} {len(faces):>8} {recall(truth, faces):>8.1%}")
+
+    for tile in args.tile:
+        start = time.perf_counter()
+        faces = detect_tiled(img, detect, tile, args.overlap, concurrency=1)
+        elapsed = time.perf_counter() - start
+        label = f'分块 {tile}/{args.overlap:.0%}'
+        print(f"{label:<16} {elapsed:>10.2f} {len(faces):>8} {recall(truth, faces):>8.1%}")
+
+
+if __name__ == '__main__':
+    main()
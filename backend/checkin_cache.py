@@ -0,0 +1,194 @@
+"""
+进行中签到缓存
+签到开始后短时间内大量学生提交签到，每个请求都按 id 或签到码查询同一行 checkins。
+这里在进程内缓存进行中的签到：发布时写入，结束时失效，到达 end_time 自动过期。
+签到码解析、类型校验和迟到判定都可以直接使用缓存中的数据。
+"""
+import threading
+from datetime import datetime, timedelta
+from database import Database
+from config import Config
+
+
+def late_cutoff(checkin):
+    """迟到分界时间：超过签到时长一半即为迟到"""
+    if not checkin.get('end_time') or not checkin.get('created_at'):
+        return None
+    return checkin['created_at'] + (checkin['end_time'] - checkin['created_at']) / 2
+
+
+def checkin_status(checkin, now=None):
+    """根据签到时间判断 checked / late"""
+    cutoff = checkin.get('late_after') or late_cutoff(checkin)
+    if cutoff and (now or datetime.now()) > cutoff:
+        return 'late'
+    return 'checked'
+
+
+class ActiveCheckinCache:
+    """
+    进行中签到缓存
+
+    条目在 end_time 到达时过期；另设 ttl 上限，多进程部署时其他进程结束签到后最多 ttl 秒内失效。
+    缓存返回的是副本，调用方可以随意修改。
+    """
+
+    def __init__(self, ttl=None):
+        self.ttl = Config.CHECKIN_CACHE_TTL if ttl is None else ttl
+        self._lock = threading.Lock()
+        self._by_id = {}  # checkin_id -> (checkin, expires_at)
+        self._by_code = {}  # checkin_code -> checkin_id
+        self._hits = 0
+        self._misses = 0
+
+    def put(self, checkin):
+        """缓存一条进行中的签到，已结束的签到不缓存"""
+        now = datetime.now()
+        end_time = checkin.get('end_time')
+        if checkin.get('status') != 'active' or (end_time and end_time <= now):
+            self.invalidate(checkin['id'])
+            return
+        expires_at = now + timedelta(seconds=self.ttl)
+        if end_time and end_time < expires_at:
+            expires_at = end_time
+        entry = dict(checkin)
+        entry['late_after'] = late_cutoff(entry)
+        with self._lock:
+            self._by_id[entry['id']] = (entry, expires_at)
+            if entry.get('checkin_code'):
+                self._by_code[entry['checkin_code']] = entry['id']
+
+    def invalidate(self, checkin_id):
+        with self._lock:
+            cached = self._by_id.pop(checkin_id, None)
+            if cached and self._by_code.get(cached[0].get('checkin_code')) == checkin_id:
+                del self._by_code[cached[0]['checkin_code']]
+
+    def _lookup(self, checkin_id):
+        """命中返回副本，未命中或已过期返回 None"""
+        with self._lock:
+            cached = self._by_id.get(checkin_id)
+            if cached and datetime.now() < cached[1]:
+                self._hits += 1
+                return dict(cached[0])
+            self._misses += 1
+        if cached:
+            self.invalidate(checkin_id)
+        return None
+
+    def get(self, checkin_id):
+        """按 id 获取签到，未命中时查询数据库（已结束的签到也会返回，但不缓存）"""
+        try:
+            checkin_id = int(checkin_id)
+        except (TypeError, ValueError):
+            return None
+        checkin = self._lookup(checkin_id)
+        if checkin:
+            return checkin
+        checkin = Database.execute_query("SELECT * FROM checkins WHERE id = %s", (checkin_id,), fetch_one=True)
+        if checkin:
+            self.put(checkin)
+        return checkin
+
+    def get_by_code(self, checkin_code):
+        """按签到码获取进行中的签到"""
+        with self._lock:
+            checkin_id = self._by_code.get(checkin_code)
+        if checkin_id is not None:
+            checkin = self._lookup(checkin_id)
+            if checkin:
+                return checkin
+        else:
+            with self._lock:
+                self._misses += 1
+        checkin = Database.execute_query(
+            "SELECT * FROM checkins WHERE checkin_code = %s AND status = 'active'",
+            (checkin_code,), fetch_one=True
+        )
+        if checkin:
+            self.put(checkin)
+        return checkin
+
+    def refresh(self, checkin_id):
+        """从数据库重新加载一条签到"""
+        self.invalidate(checkin_id)
+        checkin = Database.execute_query("SELECT * FROM checkins WHERE id = %s", (checkin_id,), fetch_one=True)
+        if checkin:
+            self.put(checkin)
+        return checkin
+
+    def stats(self):
+        with self._lock:
+            total = self._hits + self._misses
+            return {
+                'size': len(self._by_id),
+                'hits': self._hits,
+                'misses': self._misses,
+                'hit_rate': round(self._hits / total, 4) if total else 0
+            }
+
+
+class UserActiveListCache:
+    """
+    学生端"进行中签到"列表缓存（按用户）
+
+    首页每次打开都会请求该列表，这里缓存几秒；用户签到后、签到发布或结束时失效。
+    条目不会超过列表中最早的 end_time，过期签到不会继续显示。
+    """
+
+    def __init__(self, ttl=None, max_users=10000):
+        self.ttl = Config.CHECKIN_ACTIVE_LIST_TTL if ttl is None else ttl
+        self.max_users = max_users
+        self._lock = threading.Lock()
+        self._entries = {}  # user_id -> (checkins, expires_at)
+        self._hits = 0
+        self._misses = 0
+
+    def get(self, user_id):
+        with self._lock:
+            cached = self._entries.get(user_id)
+            if cached and datetime.now() < cached[1]:
+                self._hits += 1
+                return cached[0]
+            self._misses += 1
+            if cached:
+                del self._entries[user_id]
+        return None
+
+    def put(self, user_id, checkins):
+        if self.ttl <= 0:
+            return
+        expires_at = datetime.now() + timedelta(seconds=self.ttl)
+        end_times = [c['end_time'] for c in checkins if c.get('end_time')]
+        if end_times:
+            expires_at = min(expires_at, min(end_times))
+        with self._lock:
+            if len(self._entries) >= self.max_users:
+                now = datetime.now()
+                for uid in [uid for uid, (_, exp) in self._entries.items() if exp <= now]:
+                    del self._entries[uid]
+                if len(self._entries) >= self.max_users:
+                    self._entries.clear()
+            self._entries[user_id] = (checkins, expires_at)
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            total = self._hits + self._misses
+            return {
+                'size': len(self._entries),
+                'hits': self._hits,
+                'misses': self._misses,
+                'hit_rate': round(self._hits / total, 4) if total else 0
+            }
+
+
+active_checkins = ActiveCheckinCache()
+user_active_lists = UserActiveListCache()
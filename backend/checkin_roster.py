@@ -0,0 +1,251 @@
+"""
+签到实时名单
+教师端在 checkin_<id> 房间中先收到一次完整快照，之后每批签到记录写入后由写入的进程推送增量，
+客户端按 user_id 合并记录，计数和版本号（checkins.records_version）以增量中服务端查出的为准，
+版本号不大于当前版本的增量（多进程部署时可能乱序到达）只合并记录，不覆盖计数。
+
+多进程部署时（配置 SOCKETIO_MESSAGE_QUEUE）学生的签到可能写入其他进程，本进程的名单无法得知这些记录，
+因此增量不依赖本进程是否加载了名单，订阅时的快照每次从数据库重新加载。
+"""
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from database import Database
+from evidence_store import thumb_url
+from config import Config
+
+
+def room_name(checkin_id):
+    return f'checkin_{checkin_id}'
+
+
+def _serialize(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if value is not None and not isinstance(value, (str, int, float, bool)):
+        return float(value)  # DECIMAL
+    return value
+
+
+def _entry(record, member):
+    """签到记录转换为推送给客户端的格式"""
+    entry = {key: _serialize(value) for key, value in record.items()}
+    entry.setdefault('real_name', member.get('real_name'))
+    entry.setdefault('photo_url', member.get('photo_url'))
+    entry['face_thumb_url'] = thumb_url(entry.get('face_image_url'))
+    return entry
+
+
+class CheckinRoster:
+    """单个签到的名单和计数"""
+
+    def __init__(self, checkin_id):
+        self.checkin_id = checkin_id
+        self.members = {}  # user_id -> {user_id, real_name, photo_url}
+        self.checked = OrderedDict()  # user_id -> 签到记录（按签到顺序）
+        self.late_count = 0
+        self.version = 0
+        self.loaded = threading.Event()
+        self._pending = []  # 加载期间到达的记录
+        self._lock = threading.Lock()
+
+    def load(self):
+        """从数据库加载名单（与 /records 查询一致）"""
+        checkin = Database.execute_query("""
+            SELECT c.id, c.records_version, g.id as group_id FROM checkins c
+            LEFT JOIN chat_groups g ON c.group_id = g.id
+            WHERE c.id = %s
+        """, (self.checkin_id,), fetch_one=True)
+        if not checkin:
+            return False
+
+        if checkin['group_id']:
+            members = Database.execute_query("""
+                SELECT gm.user_id, u.real_name, u.photo_url
+                FROM group_members gm
+                JOIN users u ON gm.user_id = u.user_id
+                WHERE gm.group_id = %s AND gm.role = 'member'
+            """, (checkin['group_id'],), fetch_all=True) or []
+        else:
+            members = []
+        records = Database.execute_query("""
+            SELECT cr.*, u.real_name, u.photo_url
+            FROM checkin_records cr
+            JOIN users u ON cr.user_id = u.user_id
+            WHERE cr.checkin_id = %s AND cr.status <> 'absent'
+            ORDER BY cr.checkin_time
+        """, (self.checkin_id,), fetch_all=True) or []
+
+        with self._lock:
+            self.members = {m['user_id']: m for m in members}
+            self.version = max(self.version, checkin['records_version'])
+            for record in records:
+                self._apply(record)
+            pending, self._pending = self._pending, []
+            for record in pending:
+                self._apply(record)
+            self.loaded.set()
+        return True
+
+    def _apply(self, record):
+        """应用一条签到记录（需持有锁），重复记录返回 None"""
+        user_id = record['user_id']
+        if user_id in self.checked:
+            return None
+        entry = _entry(record, self.members.get(user_id, {}))
+        self.checked[user_id] = entry
+        if entry.get('status') == 'late':
+            self.late_count += 1
+        self.version = max(self.version, record.get('version') or 0)
+        return entry
+
+    def apply(self, record):
+        """应用新写入的签到记录，加载完成前暂存"""
+        with self._lock:
+            if not self.loaded.is_set():
+                self._pending.append(record)
+                return
+            self._apply(record)
+
+    def counts(self):
+        unchecked = sum(1 for uid in self.members if uid not in self.checked)
+        return {
+            'checked_count': len(self.checked),
+            'late_count': self.late_count,
+            'unchecked_count': unchecked,
+            'total': len(self.checked) + unchecked,
+            'version': self.version
+        }
+
+    def snapshot(self):
+        """完整名单，格式与 /records 接口一致"""
+        with self._lock:
+            return dict(
+                self.counts(),
+                checkin_id=self.checkin_id,
+                checked=list(self.checked.values()),
+                unchecked=[m for uid, m in self.members.items() if uid not in self.checked]
+            )
+
+
+class RosterHub:
+    """
+    进行中签到的名单集合
+
+    教师订阅时按需加载，签到记录写入数据库后由 checkin_writer 调用 records_written 推送增量。
+    只保留最近使用的 max_rosters 个名单；cache 为 False（多进程部署）时不缓存名单，每次订阅重新加载。
+    """
+
+    def __init__(self, max_rosters=256, cache=None):
+        self.max_rosters = max_rosters
+        self.cache = not Config.SOCKETIO_MESSAGE_QUEUE if cache is None else cache
+        self._rosters = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, checkin_id):
+        """获取（必要时加载）签到名单，签到不存在返回 None"""
+        if not self.cache:
+            roster = CheckinRoster(checkin_id)
+            return roster if roster.load() else None
+        with self._lock:
+            roster = self._rosters.get(checkin_id)
+            created = roster is None
+            if created:
+                # 先登记再加载，加载期间写入的记录会暂存到 _pending
+                roster = self._rosters[checkin_id] = CheckinRoster(checkin_id)
+                while len(self._rosters) > self.max_rosters:
+                    self._rosters.popitem(last=False)
+            else:
+                self._rosters.move_to_end(checkin_id)
+        if created:
+            try:
+                found = roster.load()
+            except Exception:
+                self.drop(checkin_id)
+                raise
+            if not found:
+                self.drop(checkin_id)
+                return None
+        else:
+            roster.loaded.wait(timeout=10)
+        return roster
+
+    def drop(self, checkin_id):
+        with self._lock:
+            self._rosters.pop(checkin_id, None)
+
+    def records_written(self, records):
+        """
+        签到记录写入后调用，向订阅中的教师推送增量
+
+        每个签到一条 checkin_delta：records 为本批实际插入或替换的记录（由 checkin_writer 过滤掉重复记录），
+        计数和版本号在提交后从数据库查出，其他进程写入的记录也计算在内；不要求本进程加载过该签到的名单。
+        """
+        if not records:
+            return
+        with self._lock:
+            rosters = {r['checkin_id']: self._rosters.get(r['checkin_id']) for r in records}
+
+        # 本进程名单中没有的学生（其他进程写入或未关联群组的签到）的姓名头像一次查出
+        def member_of(record):
+            roster = rosters[record['checkin_id']]
+            return roster.members.get(record['user_id']) if roster else None
+
+        unknown = {r['user_id'] for r in records if member_of(r) is None}
+        users = {}
+        if unknown:
+            placeholders = ', '.join(['%s'] * len(unknown))
+            rows = Database.execute_query(
+                f"SELECT user_id, real_name, photo_url FROM users WHERE user_id IN ({placeholders})",
+                tuple(unknown), fetch_all=True
+            ) or []
+            users = {row['user_id']: row for row in rows}
+
+        deltas = {}
+        for record in records:
+            member = member_of(record) or users.get(record['user_id']) or {}
+            record = dict(record, real_name=member.get('real_name'), photo_url=member.get('photo_url'))
+            roster = rosters[record['checkin_id']]
+            if roster:
+                roster.apply(record)
+            deltas.setdefault(record['checkin_id'], []).append(_entry(record, member))
+
+        counts = self._counts(list(deltas))
+        from websocket_server import socketio
+        for checkin_id, entries in deltas.items():
+            if checkin_id not in counts:
+                continue
+            socketio.emit('checkin_delta', dict(counts[checkin_id], checkin_id=checkin_id, type='checked_in',
+                                                records=entries),
+                          room=room_name(checkin_id))
+
+    @staticmethod
+    def _counts(checkin_ids):
+        """签到的计数和版本号（与 CheckinRoster.counts 口径一致），一条语句查出，计数与版本号对应同一时刻"""
+        placeholders = ', '.join(['%s'] * len(checkin_ids))
+        rows = Database.execute_query(f"""
+            SELECT c.id, c.records_version AS version,
+                   (SELECT COUNT(*) FROM checkin_records cr
+                    WHERE cr.checkin_id = c.id AND cr.status <> 'absent') AS checked_count,
+                   (SELECT COUNT(*) FROM checkin_records cr
+                    WHERE cr.checkin_id = c.id AND cr.status = 'late') AS late_count,
+                   (SELECT COUNT(*) FROM group_members gm
+                    WHERE gm.group_id = c.group_id AND gm.role = 'member'
+                      AND NOT EXISTS (SELECT 1 FROM checkin_records cr
+                                      WHERE cr.checkin_id = c.id AND cr.user_id = gm.user_id
+                                        AND cr.status <> 'absent')) AS unchecked_count
+            FROM checkins c WHERE c.id IN ({placeholders})
+        """, tuple(checkin_ids), fetch_all=True) or []
+        return {
+            row['id']: {
+                'checked_count': int(row['checked_count']),
+                'late_count': int(row['late_count']),
+                'unchecked_count': int(row['unchecked_count']),
+                'total': int(row['checked_count']) + int(row['unchecked_count']),
+                'version': row['version']
+            }
+            for row in rows
+        }
+
+
+roster_hub = RosterHub()
@@ -0,0 +1,236 @@
+"""
+签到生命周期调度
+签到过期原先只在读取时判断（datetime.now() > end_time），不手动结束的签到永远停留在 active，
+get_active_checkins 等按 idx_status 的查询会扫到越来越多过期行。
+这里在进程内按 end_time 维护一个小顶堆，到期后批量结束签到，
+并用一条 INSERT ... SELECT 为未签到的群成员补写缺勤记录，然后向群聊房间推送 checkin_ended。
+启动时和每隔一段时间从数据库重新加载进行中的签到，重启或其他进程创建的签到不会遗漏。
+"""
+import time
+import heapq
+import threading
+from datetime import datetime, timedelta
+from database import Database
+import attendance_rollup
+from checkin_cache import active_checkins, user_active_lists
+from checkin_roster import roster_hub, room_name
+from checkin_writer import checkin_writer
+from config import Config
+
+
+class CheckinScheduler:
+    """
+    签到到期调度器
+
+    - grace: 到期后再等待的秒数，让各进程缓冲区中截止前提交的签到记录先落库
+    - sweep: 重新扫描数据库中进行中签到的间隔（秒）
+    """
+
+    # 结束签到失败后的重试间隔（秒）
+    RETRY_SECONDS = 30
+
+    def __init__(self, grace=None, sweep=None):
+        self.grace = timedelta(seconds=Config.CHECKIN_CLOSE_GRACE if grace is None else grace)
+        self.sweep = Config.CHECKIN_SCHEDULER_SWEEP if sweep is None else sweep
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._heap = []  # (due_at, checkin_id)
+        self._scheduled = {}  # checkin_id -> due_at，堆中时间不一致的条目已过时
+        self._thread = None
+
+        self._closed = 0
+        self._absent = 0
+        self._errors = 0
+
+    # ==================== 调度 ====================
+
+    def schedule(self, checkin_id, end_time):
+        """登记签到的结束时间，重复登记以最后一次为准"""
+        if end_time is None:
+            return
+        self._push(int(checkin_id), end_time + self.grace)
+
+    def _push(self, checkin_id, due_at):
+        with self._lock:
+            if self._scheduled.get(checkin_id) == due_at:
+                return
+            self._scheduled[checkin_id] = due_at
+            heapq.heappush(self._heap, (due_at, checkin_id))
+            earliest = self._heap[0][1] == checkin_id
+        if earliest:
+            self._wake.set()
+
+    def _pop_due(self):
+        """取出所有已到期的签到 id"""
+        now = datetime.now()
+        due = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                due_at, checkin_id = heapq.heappop(self._heap)
+                if self._scheduled.get(checkin_id) == due_at:
+                    del self._scheduled[checkin_id]
+                    due.append(checkin_id)
+        return due
+
+    def rehydrate(self):
+        """从数据库加载进行中的签到（走 idx_status 索引），已过期的会在下一轮立即结束"""
+        rows = Database.execute_query(
+            "SELECT id, end_time FROM checkins WHERE status = 'active'", fetch_all=True
+        ) or []
+        for row in rows:
+            self.schedule(row['id'], row['end_time'])
+        return len(rows)
+
+    # ==================== 结束签到 ====================
+
+    def close(self, checkin_ids, end_now=False):
+        """
+        结束一批签到并补写缺勤记录，已结束的签到会被跳过
+
+        Args:
+            end_now: 手动提前结束时把 end_time 改为当前时间
+        Returns:
+            list: 实际结束的签到 [{checkin_id, group_id, checked_count, absent_count}]
+        """
+        ids = sorted({int(checkin_id) for checkin_id in checkin_ids})
+        if not ids:
+            return []
+        with self._lock:
+            for checkin_id in ids:
+                self._scheduled.pop(checkin_id, None)
+
+        # 截止前提交、仍在本进程缓冲区中的签到记录先落库；
+        # 其他进程缓冲区中的记录稍后写入时会替换补写的缺勤记录（见 CheckinRecordWriter._write）
+        checkin_writer.flush()
+
+        placeholders = ', '.join(['%s'] * len(ids))
+        conn = Database.get_connection()
+        try:
+            with conn.cursor() as cursor:
+                # 锁定仍在进行中的签到，多进程同时到期时只有一个进程会真正结束它们
+                cursor.execute(f"""
+                    SELECT id, group_id, title FROM checkins
+                    WHERE id IN ({placeholders}) AND status = 'active'
+                    FOR UPDATE
+                """, ids)
+                closing = cursor.fetchall()
+                if not closing:
+                    conn.rollback()
+                    return []
+                closing_ids = [row['id'] for row in closing]
+                placeholders = ', '.join(['%s'] * len(closing_ids))
+
+                end_time = ', end_time = NOW()' if end_now else ''
+                cursor.execute(f"UPDATE checkins SET status = 'ended'{end_time} WHERE id IN ({placeholders})",
+                               closing_ids)
+                # 未签到的群成员一次写入缺勤记录，已签到的由唯一键忽略
+                cursor.execute(f"""
+                    INSERT IGNORE INTO checkin_records (checkin_id, user_id, status, checkin_time)
+                    SELECT c.id, gm.user_id, 'absent', c.end_time
+                    FROM checkins c
+                    JOIN group_members gm ON gm.group_id = c.group_id AND gm.role = 'member'
+                    WHERE c.id IN ({placeholders})
+                """, closing_ids)
+                absent = cursor.rowcount
+                attendance_rollup.apply_closed(cursor, closing_ids)
+                cursor.execute(f"""
+                    SELECT checkin_id, SUM(status <> 'absent') AS checked_count,
+                           SUM(status = 'absent') AS absent_count
+                    FROM checkin_records WHERE checkin_id IN ({placeholders})
+                    GROUP BY checkin_id
+                """, closing_ids)
+                counts = {row['checkin_id']: row for row in cursor.fetchall()}
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+        with self._lock:
+            self._closed += len(closing)
+            self._absent += max(absent, 0)
+
+        user_active_lists.clear()
+        ended = []
+        for row in closing:
+            checkin_id = row['id']
+            active_checkins.invalidate(checkin_id)
+            checkin_writer.forget(checkin_id)
+            count = counts.get(checkin_id, {})
+            ended.append({
+                'checkin_id': checkin_id,
+                'group_id': row['group_id'],
+                'title': row['title'],
+                'checked_count': int(count.get('checked_count') or 0),
+                'absent_count': int(count.get('absent_count') or 0)
+            })
+        self._notify(ended)
+        for item in ended:
+            roster_hub.drop(item['checkin_id'])
+        return ended
+
+    def _notify(self, ended):
+        from websocket_server import socketio
+        for item in ended:
+            data = dict(item, ended_at=datetime.now().isoformat())
+            if item['group_id']:
+                socketio.emit('checkin_ended', data, room=f"group_{item['group_id']}")
+            socketio.emit('checkin_ended', data, room=room_name(item['checkin_id']))
+
+    # ==================== 后台线程 ====================
+
+    def start(self):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, daemon=True)
+                    self._thread.start()
+
+    def _run(self):
+        next_sweep = 0
+        while True:
+            if time.monotonic() >= next_sweep:
+                try:
+                    count = self.rehydrate()
+                    if not next_sweep:
+                        print(f'[签到调度] 已加载 {count} 个进行中的签到')
+                except Exception as e:
+                    print(f'[签到调度] 加载进行中签到失败: {e}')
+                next_sweep = time.monotonic() + self.sweep
+
+            due = self._pop_due()
+            if due:
+                try:
+                    ended = self.close(due)
+                    if ended:
+                        print(f"[签到调度] 自动结束签到 {[item['checkin_id'] for item in ended]}")
+                except Exception as e:
+                    with self._lock:
+                        self._errors += 1
+                    print(f'[签到调度] 结束签到失败，{self.RETRY_SECONDS} 秒后重试: {e}')
+                    retry_at = datetime.now() + timedelta(seconds=self.RETRY_SECONDS)
+                    for checkin_id in due:
+                        self._push(checkin_id, retry_at)
+
+            # 等到最早的签到到期或下一次扫描，新登记更早的签到时提前唤醒
+            timeout = max(next_sweep - time.monotonic(), 0)
+            with self._lock:
+                if self._heap:
+                    timeout = min(timeout, (self._heap[0][0] - datetime.now()).total_seconds())
+            self._wake.wait(max(timeout, 0))
+            self._wake.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'running': self._thread is not None,
+                'scheduled': len(self._scheduled),
+                'next_due': min(self._scheduled.values()).isoformat() if self._scheduled else None,
+                'closed': self._closed,
+                'absent_records': self._absent,
+                'errors': self._errors
+            }
+
+
+checkin_scheduler = CheckinScheduler()
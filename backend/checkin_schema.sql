@@ -12,10 +12,12 @@ CREATE TABLE IF NOT EXISTS checkins (
     location_lat DECIMAL(10, 8),
     location_lng DECIMAL(11, 8),
     location_range INT DEFAULT 100,
+    location_zones TEXT COMMENT '签到允许区域（JSON，圆形/多边形），为空时使用上面的圆心和半径',
     question TEXT,
     answer VARCHAR(200),
     gesture_number INT DEFAULT NULL COMMENT '手势签到指定的数字(1-5)',
     status ENUM('active', 'ended') DEFAULT 'active',
+    records_version INT NOT NULL DEFAULT 0 COMMENT '签到记录变更版本号，写入签到记录的事务中加一',
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     FOREIGN KEY (group_id) REFERENCES chat_groups(id) ON DELETE SET NULL,
     FOREIGN KEY (creator_id) REFERENCES users(user_id),
@@ -36,13 +38,42 @@ CREATE TABLE IF NOT EXISTS checkin_records (
     location_lng DECIMAL(11, 8),
     face_image_url VARCHAR(500),
     face_similarity DECIMAL(5, 2),
+    version INT NOT NULL DEFAULT 0 COMMENT '最后一次写入时签到的 records_version，/records?since= 的游标',
     FOREIGN KEY (checkin_id) REFERENCES checkins(id) ON DELETE CASCADE,
     FOREIGN KEY (user_id) REFERENCES users(user_id),
     UNIQUE KEY uk_checkin_user (checkin_id, user_id),
     INDEX idx_checkin (checkin_id),
+    INDEX idx_checkin_version (checkin_id, version),
     INDEX idx_user (user_id)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
 
+-- 考勤汇总：每个 (群组, 学生) 的签到/迟到/缺勤次数，由签到写入和结束签到时增量维护
+CREATE TABLE IF NOT EXISTS checkin_attendance_stats (
+    group_id INT NOT NULL,
+    user_id INT NOT NULL,
+    checked_count INT NOT NULL DEFAULT 0,
+    late_count INT NOT NULL DEFAULT 0,
+    absent_count INT NOT NULL DEFAULT 0,
+    last_checkin_at DATETIME,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    PRIMARY KEY (group_id, user_id),
+    INDEX idx_user (user_id)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+-- 考勤汇总：每个签到的签到/迟到/缺勤人数
+CREATE TABLE IF NOT EXISTS checkin_totals (
+    checkin_id INT PRIMARY KEY,
+    group_id INT,
+    checked_count INT NOT NULL DEFAULT 0,
+    late_count INT NOT NULL DEFAULT 0,
+    absent_count INT NOT NULL DEFAULT 0,
+    closed TINYINT(1) NOT NULL DEFAULT 0,
+    FOREIGN KEY (checkin_id) REFERENCES checkins(id) ON DELETE CASCADE,
+    INDEX idx_group (group_id)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
 -- 如果表已存在，添加新字段
 -- ALTER TABLE checkin_records ADD COLUMN face_image_url VARCHAR(500) AFTER location_lng;
 -- ALTER TABLE checkin_records ADD COLUMN face_similarity DECIMAL(5, 2) AFTER face_image_url;
+-- ALTER TABLE checkins ADD COLUMN records_version INT NOT NULL DEFAULT 0;
+-- ALTER TABLE checkin_records ADD COLUMN version INT NOT NULL DEFAULT 0, ADD INDEX idx_checkin_version (checkin_id, version);
@@ -1,13 +1,24 @@
 # -*- coding: utf-8 -*-
 """签到服务"""
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, current_app
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from database import Database
+from embedding_codec import decode_embedding
+from face_matching import match_faces
+from face_worker import InferenceBusyError
+from face_verifier import face_verifier, read_image_bytes
+from checkin_cache import active_checkins, user_active_lists, checkin_status
+from checkin_writer import checkin_writer, bump_records_version
+from checkin_scheduler import checkin_scheduler
+from evidence_store import evidence_store, thumb_url
+import geofence
+import attendance_rollup
+from checkin_roster import roster_hub
 from config import Config
 from pymysql.cursors import DictCursor
+import json
 import uuid
 import hashlib
-import json
 import numpy as np
 from datetime import datetime, timedelta
 
@@ -26,6 +37,13 @@ def generate_checkin_code():
     """生成唯一签到码"""
     return hashlib.md5(f"{uuid.uuid4()}{datetime.now().timestamp()}".encode()).hexdigest()[:8].upper()
 
+def verification_error(verification):
+    """人脸验证未通过时的响应体，相似度不足时附带相似度"""
+    body = {'success': False, 'message': verification.get('message') or '人脸识别失败'}
+    if verification.get('similarity') is not None:
+        body['similarity'] = verification['similarity']
+    return body
+
 
 @checkin_bp.route('/create', methods=['POST'])
 @jwt_required()
@@ -57,16 +75,27 @@ def create_checkin():
         location_lat = data.get('location_lat')  # 位置签到的纬度
         location_lng = data.get('location_lng')  # 位置签到的经度
         location_range = data.get('location_range', 50)  # 允许范围（米）
+        location_zones = data.get('location_zones')  # 多个允许区域（圆形/多边形），可选
         
         # 手势签到必须指定数字
         if checkin_type == 'gesture':
             if not gesture_number or gesture_number not in [1, 2, 3, 4, 5]:
                 return jsonify({'success': False, 'message': '手势签到必须指定1-5的数字'}), 400
         
-        # 位置签到必须指定位置
+        # 位置签到必须指定位置（圆心或签到区域）
         if checkin_type == 'location':
-            if location_lat is None or location_lng is None:
+            if location_zones:
+                try:
+                    zones = geofence.parse_zones(location_zones)
+                except (ValueError, KeyError, TypeError) as e:
+                    return jsonify({'success': False, 'message': f'签到区域格式不正确: {e}'}), 400
+                location_zones = json.dumps(zones)
+                if location_lat is None or location_lng is None:
+                    location_lat, location_lng = geofence.zone_center(zones[0])
+            elif location_lat is None or location_lng is None:
                 return jsonify({'success': False, 'message': '位置签到必须指定签到位置'}), 400
+        else:
+            location_zones = None
         
         # 生成签到码
         checkin_code = generate_checkin_code()
@@ -78,13 +107,15 @@ def create_checkin():
         cursor.execute("""
             INSERT INTO checkins (group_id, creator_id, title, type, checkin_code, 
                                   duration, end_time, description, gesture_number, 
-                                  location_lat, location_lng, location_range, status)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, 'active')
+                                  location_lat, location_lng, location_range, location_zones, status)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, 'active')
         """, (group_id, user_id, title, checkin_type, checkin_code, 
               duration, end_time, description, gesture_number,
-              location_lat, location_lng, location_range))
+              location_lat, location_lng, location_range, location_zones))
         
         checkin_id = cursor.lastrowid
+        cursor.execute("SELECT * FROM checkins WHERE id = %s", (checkin_id,))
+        created = cursor.fetchone()
         
         # 如果关联了群组，发送群消息通知
         if group_id:
@@ -94,6 +125,9 @@ def create_checkin():
             """, (group_id, user_id, f'{title}（限时{duration}分钟）', checkin_id))
         
         conn.commit()
+        active_checkins.put(created)
+        user_active_lists.clear()
+        checkin_scheduler.schedule(checkin_id, end_time)
         
         return jsonify({
             'success': True,
@@ -186,27 +220,18 @@ def do_checkin():
     user_id = get_current_user_id()
     data = request.json
     
-    conn = get_db_connection()
-    cursor = get_cursor(conn)
-    
     try:
         checkin_id = data.get('checkin_id')
         checkin_code = data.get('checkin_code', '').upper().strip()
         
         # 如果只有签到码，通过签到码查找签到
         if checkin_code and not checkin_id:
-            cursor.execute("""
-                SELECT * FROM checkins WHERE checkin_code = %s AND status = 'active'
-            """, (checkin_code,))
-            checkin = cursor.fetchone()
+            checkin = active_checkins.get_by_code(checkin_code)
             if checkin:
                 checkin_id = checkin['id']
         else:
             # 获取签到信息
-            cursor.execute("""
-                SELECT * FROM checkins WHERE id = %s
-            """, (checkin_id,))
-            checkin = cursor.fetchone()
+            checkin = active_checkins.get(checkin_id)
         
         if not checkin:
             return jsonify({'success': False, 'message': '签到不存在'}), 404
@@ -220,31 +245,15 @@ def do_checkin():
             return jsonify({'success': False, 'message': '签到已结束'}), 400
         
         # 检查是否已签到
-        cursor.execute("""
-            SELECT id FROM checkin_records WHERE checkin_id = %s AND user_id = %s
-        """, (checkin_id, user_id))
-        if cursor.fetchone():
+        if checkin_writer.has_checked_in(checkin['id'], user_id):
             return jsonify({'success': False, 'message': '您已签到过了'}), 400
         
-        # 获取用户信息
-        cursor.execute("SELECT real_name FROM users WHERE user_id = %s", (user_id,))
-        user = cursor.fetchone()
-        
         # 判断是否迟到（超过一半时间）
-        status = 'checked'
-        if checkin['end_time'] and checkin['created_at']:
-            total_seconds = (checkin['end_time'] - checkin['created_at']).total_seconds()
-            elapsed_seconds = (datetime.now() - checkin['created_at']).total_seconds()
-            if elapsed_seconds > total_seconds * 0.5:
-                status = 'late'
+        status = checkin_status(checkin)
         
         # 记录签到
-        cursor.execute("""
-            INSERT INTO checkin_records (checkin_id, user_id, status, checkin_time)
-            VALUES (%s, %s, %s, NOW())
-        """, (checkin_id, user_id, status))
-        
-        conn.commit()
+        if not checkin_writer.submit(checkin['id'], user_id, status):
+            return jsonify({'success': False, 'message': '您已签到过了'}), 400
         
         return jsonify({
             'success': True,
@@ -252,24 +261,30 @@ def do_checkin():
             'message': '签到成功' if status == 'checked' else '签到成功（迟到）'
         })
     except Exception as e:
-        conn.rollback()
         return jsonify({'success': False, 'message': str(e)}), 500
-    finally:
-        cursor.close()
-        conn.close()
 
 
 @checkin_bp.route('/<int:checkin_id>/records', methods=['GET'])
 @jwt_required()
 def get_checkin_records(checkin_id):
-    """获取签到记录（已签到/未签到）"""
+    """
+    获取签到记录（已签到/未签到）
+
+    ?since=<cursor> 时只返回 cursor 之后新增或变更的签到记录和当前计数，不返回未签到列表；
+    客户端按新记录的 user_id 合并，并从本地未签到列表中移除。cursor 为签到记录的最大 version：
+    每次写入或修改签到记录都在同一事务中把签到的 records_version 加一（持有签到行锁，按版本号顺序提交），
+    晚提交的记录和替换缺勤记录的签到不会落在游标之前。位置复核改为缺勤的记录不在增量中，
+    本地已签到数与 checked_count 不一致时应去掉 since 重新获取完整列表。
+    响应带 ETag，数据未变化时返回 304。
+    """
+    since = request.args.get('since', type=int)
     conn = get_db_connection()
     cursor = get_cursor(conn)
     
     try:
         # 获取签到信息
         cursor.execute("""
-            SELECT c.*, g.id as group_id FROM checkins c
+            SELECT c.id, g.id as group_id FROM checkins c
             LEFT JOIN chat_groups g ON c.group_id = g.id
             WHERE c.id = %s
         """, (checkin_id,))
@@ -278,37 +293,69 @@ def get_checkin_records(checkin_id):
         if not checkin:
             return jsonify({'success': False, 'message': '签到不存在'}), 404
         
-        # 获取已签到的人
+        # 计数和游标（cursor 为签到记录的最大 version）
         cursor.execute("""
-            SELECT cr.*, u.real_name, u.photo_url, cr.face_image_url, cr.face_similarity
-            FROM checkin_records cr
-            JOIN users u ON cr.user_id = u.user_id
-            WHERE cr.checkin_id = %s
-            ORDER BY cr.checkin_time
+            SELECT COALESCE(SUM(status <> 'absent'), 0) AS checked_count,
+                   COALESCE(SUM(status = 'late'), 0) AS late_count,
+                   COALESCE(MAX(version), 0) AS cursor
+            FROM checkin_records WHERE checkin_id = %s
         """, (checkin_id,))
-        checked_list = cursor.fetchall()
-        checked_user_ids = [r['user_id'] for r in checked_list]
+        counts = cursor.fetchone()
         
-        # 获取群成员（未签到的）
-        unchecked_list = []
+        # 未签到 = 群成员 反连接 签到记录（签到结束后补写的缺勤记录也算未签到）
+        unchecked_sql = """
+            FROM group_members gm
+            JOIN users u ON gm.user_id = u.user_id
+            LEFT JOIN checkin_records cr ON cr.checkin_id = %s AND cr.user_id = gm.user_id
+                                        AND cr.status <> 'absent'
+            WHERE gm.group_id = %s AND gm.role = 'member' AND cr.id IS NULL
+        """
+        unchecked_count = 0
         if checkin['group_id']:
-            cursor.execute("""
-                SELECT gm.user_id, u.real_name, u.photo_url
-                FROM group_members gm
-                JOIN users u ON gm.user_id = u.user_id
-                WHERE gm.group_id = %s AND gm.role = 'member'
-            """, (checkin['group_id'],))
-            all_members = cursor.fetchall()
-            unchecked_list = [m for m in all_members if m['user_id'] not in checked_user_ids]
+            cursor.execute("SELECT COUNT(*) AS n " + unchecked_sql, (checkin_id, checkin['group_id']))
+            unchecked_count = cursor.fetchone()['n']
         
-        return jsonify({
+        checked_count = int(counts['checked_count'])
+        etag = f'"{checkin_id}-{since or 0}-{counts["cursor"]}-{checked_count}-{unchecked_count}"'
+        if request.if_none_match.contains(etag.strip('"')):
+            response = current_app.response_class(status=304)
+            response.headers['ETag'] = etag
+            return response
+        
+        # 已签到记录（增量模式只取游标之后的）
+        cursor.execute("""
+            SELECT cr.*, u.real_name, u.photo_url
+            FROM checkin_records cr
+            JOIN users u ON cr.user_id = u.user_id
+            WHERE cr.checkin_id = %s AND cr.version > %s AND cr.status <> 'absent'
+            ORDER BY cr.version, cr.id
+        """, (checkin_id, -1 if since is None else since))
+        checked_list = cursor.fetchall()
+        # 列表默认展示缩略图，点击预览时再加载原图
+        for record in checked_list:
+            record['face_thumb_url'] = thumb_url(record['face_image_url'])
+        
+        result = {
             'success': True,
             'checked': checked_list,
-            'unchecked': unchecked_list,
-            'checked_count': len(checked_list),
-            'unchecked_count': len(unchecked_list),
-            'total': len(checked_list) + len(unchecked_list)
-        })
+            'checked_count': checked_count,
+            'late_count': int(counts['late_count']),
+            'unchecked_count': unchecked_count,
+            'total': checked_count + unchecked_count,
+            'cursor': counts['cursor']
+        }
+        if since is None:
+            unchecked_list = []
+            if checkin['group_id']:
+                cursor.execute("SELECT gm.user_id, u.real_name, u.photo_url " + unchecked_sql,
+                               (checkin_id, checkin['group_id']))
+                unchecked_list = cursor.fetchall()
+            result['unchecked'] = unchecked_list
+        
+        response = jsonify(result)
+        response.headers['ETag'] = etag
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)}), 500
     finally:
@@ -316,37 +363,51 @@ def get_checkin_records(checkin_id):
         conn.close()
 
 
+def fetch_active_checkins(cursor, user_id):
+    """
+    用户可参与的进行中签到，附带本人签到状态和已签到人数
+
+    一条查询完成：本人记录用 LEFT JOIN，已签到人数按这些签到分组统计一次，
+    不再逐行执行子查询和逐个签到查询本人状态。
+    """
+    cursor.execute("""
+        SELECT c.*, g.name as group_name, u.real_name as creator_name,
+               COALESCE(cnt.checked_count, 0) as checked_count,
+               mine.status as my_status
+        FROM checkins c
+        JOIN group_members gm ON gm.group_id = c.group_id AND gm.user_id = %s
+        JOIN chat_groups g ON c.group_id = g.id
+        LEFT JOIN users u ON c.creator_id = u.user_id
+        LEFT JOIN checkin_records mine ON mine.checkin_id = c.id AND mine.user_id = %s
+        LEFT JOIN (
+            SELECT cr.checkin_id, COUNT(*) as checked_count
+            FROM checkins ac
+            JOIN group_members agm ON agm.group_id = ac.group_id AND agm.user_id = %s
+            JOIN checkin_records cr ON cr.checkin_id = ac.id
+            WHERE ac.status = 'active' AND ac.end_time > NOW()
+            GROUP BY cr.checkin_id
+        ) cnt ON cnt.checkin_id = c.id
+        WHERE c.status = 'active' AND c.end_time > NOW()
+        ORDER BY c.created_at DESC
+    """, (user_id, user_id, user_id))
+    return cursor.fetchall()
+
+
 @checkin_bp.route('/active', methods=['GET'])
 @jwt_required()
 def get_active_checkins():
     """获取当前用户可参与的进行中签到"""
     user_id = get_current_user_id()
+    checkins = user_active_lists.get(user_id)
+    if checkins is not None:
+        return jsonify({'success': True, 'checkins': checkins})
+    
     conn = get_db_connection()
     cursor = get_cursor(conn)
     
     try:
-        # 获取用户所在群组的进行中签到
-        cursor.execute("""
-            SELECT c.*, g.name as group_name, u.real_name as creator_name,
-                   (SELECT COUNT(*) FROM checkin_records WHERE checkin_id = c.id) as checked_count
-            FROM checkins c
-            JOIN chat_groups g ON c.group_id = g.id
-            JOIN group_members gm ON g.id = gm.group_id AND gm.user_id = %s
-            LEFT JOIN users u ON c.creator_id = u.user_id
-            WHERE c.status = 'active' AND c.end_time > NOW()
-            ORDER BY c.created_at DESC
-        """, (user_id,))
-        checkins = cursor.fetchall()
-        
-        # 检查用户是否已签到
-        for c in checkins:
-            cursor.execute("""
-                SELECT status FROM checkin_records 
-                WHERE checkin_id = %s AND user_id = %s
-            """, (c['id'], user_id))
-            record = cursor.fetchone()
-            c['my_status'] = record['status'] if record else None
-        
+        checkins = fetch_active_checkins(cursor, user_id)
+        user_active_lists.put(user_id, checkins)
         return jsonify({'success': True, 'checkins': checkins})
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)}), 500
@@ -366,7 +427,8 @@ def get_my_created_checkins():
     try:
         cursor.execute("""
             SELECT c.*, g.name as group_name,
-                   (SELECT COUNT(*) FROM checkin_records WHERE checkin_id = c.id) as checked_count,
+                   (SELECT COUNT(*) FROM checkin_records
+                    WHERE checkin_id = c.id AND status <> 'absent') as checked_count,
                    (SELECT COUNT(*) FROM group_members WHERE group_id = c.group_id AND role = 'member') as total_count
             FROM checkins c
             LEFT JOIN chat_groups g ON c.group_id = g.id
@@ -408,6 +470,8 @@ def get_my_checkin_history():
             LIMIT 50
         """, (user_id,))
         records = cursor.fetchall()
+        for record in records:
+            record['face_thumb_url'] = thumb_url(record['face_image_url'])
         
         return jsonify({'success': True, 'records': records})
     except Exception as e:
@@ -417,6 +481,99 @@ def get_my_checkin_history():
         conn.close()
 
 
+def attendance_rate(stats):
+    """出勤率 = (签到 + 迟到) / (签到 + 迟到 + 缺勤)，没有记录时为 None"""
+    attended = stats['checked_count'] + stats['late_count']
+    total = attended + stats['absent_count']
+    return round(attended / total, 4) if total else None
+
+
+@checkin_bp.route('/stats/group/<int:group_id>', methods=['GET'])
+@jwt_required()
+def get_group_attendance(group_id):
+    """群组考勤统计：每个学生的出勤率和每次签到的人数（读取汇总表）"""
+    user_id = get_current_user_id()
+    conn = get_db_connection()
+    cursor = get_cursor(conn)
+    
+    try:
+        cursor.execute("SELECT role FROM group_members WHERE group_id = %s AND user_id = %s", (group_id, user_id))
+        member = cursor.fetchone()
+        if not member or member['role'] not in ('owner', 'admin'):
+            return jsonify({'success': False, 'message': '只有群主或管理员可以查看考勤统计'}), 403
+        
+        cursor.execute("""
+            SELECT gm.user_id, u.real_name, u.photo_url,
+                   COALESCE(s.checked_count, 0) as checked_count,
+                   COALESCE(s.late_count, 0) as late_count,
+                   COALESCE(s.absent_count, 0) as absent_count,
+                   s.last_checkin_at
+            FROM group_members gm
+            JOIN users u ON gm.user_id = u.user_id
+            LEFT JOIN checkin_attendance_stats s ON s.group_id = gm.group_id AND s.user_id = gm.user_id
+            WHERE gm.group_id = %s AND gm.role = 'member'
+            ORDER BY u.real_name
+        """, (group_id,))
+        students = cursor.fetchall()
+        for student in students:
+            student['attendance_rate'] = attendance_rate(student)
+        
+        cursor.execute("""
+            SELECT t.checkin_id, t.checked_count, t.late_count, t.absent_count, t.closed,
+                   c.title, c.type, c.created_at
+            FROM checkin_totals t
+            JOIN checkins c ON t.checkin_id = c.id
+            WHERE t.group_id = %s
+            ORDER BY c.created_at DESC
+        """, (group_id,))
+        checkins = cursor.fetchall()
+        
+        summary = {
+            'checkin_count': len(checkins),
+            'ended_count': sum(1 for c in checkins if c['closed']),
+            'checked_count': sum(c['checked_count'] for c in checkins),
+            'late_count': sum(c['late_count'] for c in checkins),
+            'absent_count': sum(c['absent_count'] for c in checkins)
+        }
+        summary['attendance_rate'] = attendance_rate(summary)
+        
+        return jsonify({'success': True, 'summary': summary, 'students': students, 'checkins': checkins})
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+    finally:
+        cursor.close()
+        conn.close()
+
+
+@checkin_bp.route('/stats/me', methods=['GET'])
+@jwt_required()
+def get_my_attendance():
+    """我的考勤统计（按群组）"""
+    user_id = get_current_user_id()
+    conn = get_db_connection()
+    cursor = get_cursor(conn)
+    
+    try:
+        cursor.execute("""
+            SELECT s.group_id, g.name as group_name, s.checked_count, s.late_count,
+                   s.absent_count, s.last_checkin_at
+            FROM checkin_attendance_stats s
+            JOIN chat_groups g ON s.group_id = g.id
+            WHERE s.user_id = %s
+            ORDER BY s.last_checkin_at DESC
+        """, (user_id,))
+        groups = cursor.fetchall()
+        for group in groups:
+            group['attendance_rate'] = attendance_rate(group)
+        
+        return jsonify({'success': True, 'groups': groups})
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+    finally:
+        cursor.close()
+        conn.close()
+
+
 @checkin_bp.route('/<int:checkin_id>/end', methods=['POST'])
 @jwt_required()
 def end_checkin(checkin_id):
@@ -435,11 +592,8 @@ def end_checkin(checkin_id):
         if checkin['creator_id'] != user_id:
             return jsonify({'success': False, 'message': '只有创建者可以结束签到'}), 403
         
-        cursor.execute("""
-            UPDATE checkins SET status = 'ended', end_time = NOW() WHERE id = %s
-        """, (checkin_id,))
-        
-        conn.commit()
+        # 与到期自动结束相同：补写缺勤记录并通知群聊
+        checkin_scheduler.close([checkin_id], end_now=True)
         return jsonify({'success': True, 'message': '签到已结束'})
     except Exception as e:
         conn.rollback()
@@ -456,9 +610,6 @@ def face_checkin():
     user_id = get_current_user_id()
     data = request.json
     
-    conn = get_db_connection()
-    cursor = get_cursor(conn)
-    
     try:
         checkin_id = data.get('checkin_id')
         face_image = data.get('face_image')  # base64 图片
@@ -468,10 +619,7 @@ def face_checkin():
             return jsonify({'success': False, 'message': '缺少必要参数'}), 400
         
         # 获取签到信息
-        cursor.execute("""
-            SELECT * FROM checkins WHERE id = %s
-        """, (checkin_id,))
-        checkin = cursor.fetchone()
+        checkin = active_checkins.get(checkin_id)
         
         if not checkin:
             return jsonify({'success': False, 'message': '签到不存在'}), 404
@@ -485,24 +633,9 @@ def face_checkin():
             return jsonify({'success': False, 'message': '签到已结束'}), 400
         
         # 检查是否已签到
-        cursor.execute("""
-            SELECT id FROM checkin_records WHERE checkin_id = %s AND user_id = %s
-        """, (checkin_id, user_id))
-        if cursor.fetchone():
+        if checkin_writer.has_checked_in(checkin['id'], user_id):
             return jsonify({'success': False, 'message': '您已签到过了'}), 400
         
-        # 导入人脸服务
-        from face_service import FaceService
-        
-        # 获取用户已注册的人脸信息
-        cursor.execute("""
-            SELECT face_embedding FROM user_faces WHERE user_id = %s
-        """, (user_id,))
-        user_face = cursor.fetchone()
-        
-        if not user_face:
-            return jsonify({'success': False, 'message': '您尚未录入人脸信息，请先在个人中心录入人脸'}), 400
-        
         # 验证活体检测
         if not liveness_data.get('blink_detected'):
             return jsonify({'success': False, 'message': '活体检测失败：未检测到眨眼动作'}), 400
@@ -510,74 +643,27 @@ def face_checkin():
         if not liveness_data.get('head_turn_detected'):
             return jsonify({'success': False, 'message': '活体检测失败：未检测到转头动作'}), 400
         
-        # 提取上传图片的人脸特征
-        result = FaceService.extract_embedding_from_base64(face_image)
-        if not result['success']:
-            return jsonify({'success': False, 'message': result.get('message', '人脸识别失败')}), 400
-        
-        verify_embedding = np.array(result['embedding'])
-        stored_embedding = np.array(json.loads(user_face['face_embedding']))
-        
-        # 计算相似度
-        distance = FaceService.cosine_distance(verify_embedding, stored_embedding)
-        similarity = (1 - distance) * 100
-        
-        # 验证是否匹配（阈值 0.32）
-        if distance >= FaceService.THRESHOLD:
-            return jsonify({
-                'success': False, 
-                'message': f'人脸验证失败，相似度不足（{similarity:.1f}%）',
-                'similarity': round(similarity, 2)
-            }), 400
+        # 人脸 1:1 验证（图片只解码一次，验证和保存截图共用）
+        image_data = read_image_bytes(face_image)
+        verification = face_verifier.verify(user_id, image_data)
+        if not verification['matched']:
+            return jsonify(verification_error(verification)), 400
+        similarity = verification['similarity']
         
         # 判断是否迟到
-        status = 'checked'
-        if checkin['end_time'] and checkin['created_at']:
-            total_seconds = (checkin['end_time'] - checkin['created_at']).total_seconds()
-            elapsed_seconds = (datetime.now() - checkin['created_at']).total_seconds()
-            if elapsed_seconds > total_seconds * 0.5:
-                status = 'late'
-        
-        # 保存人脸截图
-        import os
-        import base64
+        status = checkin_status(checkin)
+        
+        # 保存人脸截图（后台写入原图和缩略图）
         face_image_url = None
         try:
-            # 创建目录（使用绝对路径）
-            import pathlib
-            base_dir = pathlib.Path(__file__).parent.absolute()
-            upload_dir = base_dir / 'uploads' / 'checkin_faces'
-            upload_dir.mkdir(parents=True, exist_ok=True)
-            
-            print(f'[人脸签到] 保存目录: {upload_dir}')
-            
-            # 解码并保存图片
-            if ',' in face_image:
-                face_image_data = face_image.split(',')[1]
-            else:
-                face_image_data = face_image
-            
-            img_data = base64.b64decode(face_image_data)
-            filename = f"checkin_{checkin_id}_{user_id}_{datetime.now().strftime('%Y%m%d%H%M%S')}.jpg"
-            filepath = upload_dir / filename
-            
-            with open(filepath, 'wb') as f:
-                f.write(img_data)
-            
-            face_image_url = f'/uploads/checkin_faces/{filename}'
-            print(f'[人脸签到] 截图保存成功: {filepath}')
+            face_image_url = evidence_store.save(image_data)
         except Exception as img_err:
             print(f'[人脸签到] 保存人脸截图失败: {img_err}')
-            import traceback
-            traceback.print_exc()
         
         # 记录签到（包含人脸截图和相似度）
-        cursor.execute("""
-            INSERT INTO checkin_records (checkin_id, user_id, status, checkin_time, face_image_url, face_similarity)
-            VALUES (%s, %s, %s, NOW(), %s, %s)
-        """, (checkin_id, user_id, status, face_image_url, round(similarity, 2)))
-        
-        conn.commit()
+        if not checkin_writer.submit(checkin['id'], user_id, status,
+                                     face_image_url=face_image_url, face_similarity=round(similarity, 2)):
+            return jsonify({'success': False, 'message': '您已签到过了'}), 400
         
         return jsonify({
             'success': True,
@@ -586,14 +672,12 @@ def face_checkin():
             'face_image_url': face_image_url,
             'message': f'人脸签到成功（相似度: {similarity:.1f}%）' if status == 'checked' else f'人脸签到成功（迟到，相似度: {similarity:.1f}%）'
         })
+    except InferenceBusyError:
+        raise
     except Exception as e:
-        conn.rollback()
         import traceback
         traceback.print_exc()
         return jsonify({'success': False, 'message': str(e)}), 500
-    finally:
-        cursor.close()
-        conn.close()
 
 
 @checkin_bp.route('/gesture', methods=['POST'])
@@ -603,9 +687,6 @@ def gesture_checkin():
     user_id = get_current_user_id()
     data = request.json
     
-    conn = get_db_connection()
-    cursor = get_cursor(conn)
-    
     try:
         checkin_id = data.get('checkin_id')
         face_image = data.get('face_image')  # base64 图片
@@ -619,10 +700,7 @@ def gesture_checkin():
             return jsonify({'success': False, 'message': '未检测到手势'}), 400
         
         # 获取签到信息
-        cursor.execute("""
-            SELECT * FROM checkins WHERE id = %s
-        """, (checkin_id,))
-        checkin = cursor.fetchone()
+        checkin = active_checkins.get(checkin_id)
         
         if not checkin:
             return jsonify({'success': False, 'message': '签到不存在'}), 404
@@ -636,10 +714,7 @@ def gesture_checkin():
             return jsonify({'success': False, 'message': '签到已结束'}), 400
         
         # 检查是否已签到
-        cursor.execute("""
-            SELECT id FROM checkin_records WHERE checkin_id = %s AND user_id = %s
-        """, (checkin_id, user_id))
-        if cursor.fetchone():
+        if checkin_writer.has_checked_in(checkin['id'], user_id):
             return jsonify({'success': False, 'message': '您已签到过了'}), 400
         
         # 验证手势数字
@@ -650,79 +725,27 @@ def gesture_checkin():
                 'message': f'手势错误，请比出数字 {required_gesture}'
             }), 400
         
-        # 导入人脸服务
-        from face_service import FaceService
-        
-        # 获取用户已注册的人脸信息
-        cursor.execute("""
-            SELECT face_embedding FROM user_faces WHERE user_id = %s
-        """, (user_id,))
-        user_face = cursor.fetchone()
-        
-        if not user_face:
-            return jsonify({'success': False, 'message': '您尚未录入人脸信息，请先在个人中心录入人脸'}), 400
-        
-        # 提取上传图片的人脸特征
-        result = FaceService.extract_embedding_from_base64(face_image)
-        if not result['success']:
-            return jsonify({'success': False, 'message': result.get('message', '人脸识别失败')}), 400
-        
-        verify_embedding = np.array(result['embedding'])
-        stored_embedding = np.array(json.loads(user_face['face_embedding']))
-        
-        # 计算相似度
-        distance = FaceService.cosine_distance(verify_embedding, stored_embedding)
-        similarity = (1 - distance) * 100
-        
-        # 验证是否匹配（阈值 0.32）
-        if distance >= FaceService.THRESHOLD:
-            return jsonify({
-                'success': False, 
-                'message': f'人脸验证失败，相似度不足（{similarity:.1f}%）',
-                'similarity': round(similarity, 2)
-            }), 400
+        # 人脸 1:1 验证（图片只解码一次，验证和保存截图共用）
+        image_data = read_image_bytes(face_image)
+        verification = face_verifier.verify(user_id, image_data)
+        if not verification['matched']:
+            return jsonify(verification_error(verification)), 400
+        similarity = verification['similarity']
         
         # 判断是否迟到
-        status = 'checked'
-        if checkin['end_time'] and checkin['created_at']:
-            total_seconds = (checkin['end_time'] - checkin['created_at']).total_seconds()
-            elapsed_seconds = (datetime.now() - checkin['created_at']).total_seconds()
-            if elapsed_seconds > total_seconds * 0.5:
-                status = 'late'
-        
-        # 保存人脸截图
-        import os
-        import base64
+        status = checkin_status(checkin)
+        
+        # 保存截图（后台写入原图和缩略图）
         face_image_url = None
         try:
-            import pathlib
-            base_dir = pathlib.Path(__file__).parent.absolute()
-            upload_dir = base_dir / 'uploads' / 'checkin_faces'
-            upload_dir.mkdir(parents=True, exist_ok=True)
-            
-            if ',' in face_image:
-                face_image_data = face_image.split(',')[1]
-            else:
-                face_image_data = face_image
-            
-            img_data = base64.b64decode(face_image_data)
-            filename = f"gesture_{checkin_id}_{user_id}_{datetime.now().strftime('%Y%m%d%H%M%S')}.jpg"
-            filepath = upload_dir / filename
-            
-            with open(filepath, 'wb') as f:
-                f.write(img_data)
-            
-            face_image_url = f'/uploads/checkin_faces/{filename}'
+            face_image_url = evidence_store.save(image_data)
         except Exception as img_err:
             print(f'[手势签到] 保存截图失败: {img_err}')
         
         # 记录签到
-        cursor.execute("""
-            INSERT INTO checkin_records (checkin_id, user_id, status, checkin_time, face_image_url, face_similarity)
-            VALUES (%s, %s, %s, NOW(), %s, %s)
-        """, (checkin_id, user_id, status, face_image_url, round(similarity, 2)))
-        
-        conn.commit()
+        if not checkin_writer.submit(checkin['id'], user_id, status,
+                                     face_image_url=face_image_url, face_similarity=round(similarity, 2)):
+            return jsonify({'success': False, 'message': '您已签到过了'}), 400
         
         return jsonify({
             'success': True,
@@ -732,14 +755,12 @@ def gesture_checkin():
             'face_image_url': face_image_url,
             'message': f'手势签到成功（手势: {detected_gesture}，相似度: {similarity:.1f}%）'
         })
+    except InferenceBusyError:
+        raise
     except Exception as e:
-        conn.rollback()
         import traceback
         traceback.print_exc()
         return jsonify({'success': False, 'message': str(e)}), 500
-    finally:
-        cursor.close()
-        conn.close()
 
 
 @checkin_bp.route('/location', methods=['POST'])
@@ -749,9 +770,6 @@ def location_checkin():
     user_id = get_current_user_id()
     data = request.json
     
-    conn = get_db_connection()
-    cursor = get_cursor(conn)
-    
     try:
         checkin_id = data.get('checkin_id')
         user_lat = data.get('latitude')
@@ -761,10 +779,7 @@ def location_checkin():
             return jsonify({'success': False, 'message': '缺少必要参数'}), 400
         
         # 获取签到信息
-        cursor.execute("""
-            SELECT * FROM checkins WHERE id = %s
-        """, (checkin_id,))
-        checkin = cursor.fetchone()
+        checkin = active_checkins.get(checkin_id)
         
         if not checkin:
             return jsonify({'success': False, 'message': '签到不存在'}), 404
@@ -778,56 +793,30 @@ def location_checkin():
             return jsonify({'success': False, 'message': '签到已结束'}), 400
         
         # 检查是否已签到
-        cursor.execute("""
-            SELECT id FROM checkin_records WHERE checkin_id = %s AND user_id = %s
-        """, (checkin_id, user_id))
-        if cursor.fetchone():
+        if checkin_writer.has_checked_in(checkin['id'], user_id):
             return jsonify({'success': False, 'message': '您已签到过了'}), 400
         
-        # 计算距离
-        target_lat = float(checkin['location_lat']) if checkin['location_lat'] else None
-        target_lng = float(checkin['location_lng']) if checkin['location_lng'] else None
-        
-        if target_lat is None or target_lng is None:
+        # 按签到区域（圆形/多边形，可以有多个）校验位置
+        fence = geofence.for_checkin(checkin)
+        if not fence.zones:
             return jsonify({'success': False, 'message': '签到位置未设置'}), 400
         
-        # 使用 Haversine 公式计算距离
-        import math
-        R = 6371000  # 地球半径（米）
-        
-        lat1, lat2 = math.radians(float(user_lat)), math.radians(target_lat)
-        delta_lat = math.radians(target_lat - float(user_lat))
-        delta_lng = math.radians(target_lng - float(user_lng))
-        
-        a = math.sin(delta_lat/2)**2 + math.cos(lat1) * math.cos(lat2) * math.sin(delta_lng/2)**2
-        c = 2 * math.atan2(math.sqrt(a), math.sqrt(1-a))
-        distance = R * c
-        
-        # 获取允许的范围（默认50米）
-        allowed_range = checkin.get('location_range') or 50
-        
-        if distance > allowed_range:
-            return jsonify({
-                'success': False,
-                'message': f'距离签到点太远（{distance:.0f}米），需在{allowed_range}米范围内',
-                'distance': round(distance, 1)
-            }), 400
+        inside, distance, zone_index = fence.check(float(user_lat), float(user_lng))
+        if not inside:
+            zone = fence.describe(zone_index)
+            if zone['type'] == 'circle':
+                message = f"距离签到点太远（{distance:.0f}米），需在{zone['radius']:.0f}米范围内"
+            else:
+                message = f'不在签到区域内（距离约{distance:.0f}米）'
+            return jsonify({'success': False, 'message': message, 'distance': round(distance, 1)}), 400
         
         # 判断是否迟到
-        status = 'checked'
-        if checkin['end_time'] and checkin['created_at']:
-            total_seconds = (checkin['end_time'] - checkin['created_at']).total_seconds()
-            elapsed_seconds = (datetime.now() - checkin['created_at']).total_seconds()
-            if elapsed_seconds > total_seconds * 0.5:
-                status = 'late'
+        status = checkin_status(checkin)
         
         # 记录签到
-        cursor.execute("""
-            INSERT INTO checkin_records (checkin_id, user_id, status, checkin_time, location_lat, location_lng)
-            VALUES (%s, %s, %s, NOW(), %s, %s)
-        """, (checkin_id, user_id, status, user_lat, user_lng))
-        
-        conn.commit()
+        if not checkin_writer.submit(checkin['id'], user_id, status,
+                                     location_lat=user_lat, location_lng=user_lng):
+            return jsonify({'success': False, 'message': '您已签到过了'}), 400
         
         return jsonify({
             'success': True,
@@ -836,10 +825,133 @@ def location_checkin():
             'message': f'位置签到成功（距离: {distance:.0f}米）' if status == 'checked' else f'位置签到成功（迟到，距离: {distance:.0f}米）'
         })
     except Exception as e:
-        conn.rollback()
         import traceback
         traceback.print_exc()
         return jsonify({'success': False, 'message': str(e)}), 500
+
+
+@checkin_bp.route('/<int:checkin_id>/location/revalidate', methods=['POST'])
+@jwt_required()
+def revalidate_location_records(checkin_id):
+    """
+    批量重新校验位置签到记录
+
+    可选参数 location_lat / location_lng / location_range / location_zones 先修正签到位置；
+    apply 为 true 时把不在区域内的记录改为缺勤、重新落在区域内的缺勤记录恢复为签到/迟到，
+    否则只返回校验结果。
+    """
+    user_id = get_current_user_id()
+    data = request.json or {}
+    conn = get_db_connection()
+    cursor = get_cursor(conn)
+    
+    try:
+        cursor.execute("SELECT * FROM checkins WHERE id = %s FOR UPDATE", (checkin_id,))
+        checkin = cursor.fetchone()
+        
+        if not checkin:
+            return jsonify({'success': False, 'message': '签到不存在'}), 404
+        
+        if checkin['creator_id'] != user_id:
+            return jsonify({'success': False, 'message': '只有创建者可以重新校验签到位置'}), 403
+        
+        if checkin['type'] != 'location':
+            return jsonify({'success': False, 'message': '该签到不是位置签到'}), 400
+        
+        # 修正签到位置
+        corrected = any(key in data for key in ('location_lat', 'location_lng', 'location_range', 'location_zones'))
+        if corrected:
+            for key in ('location_lat', 'location_lng', 'location_range'):
+                if key in data:
+                    checkin[key] = data[key]
+            if 'location_zones' in data:
+                checkin['location_zones'] = None
+                if data['location_zones']:
+                    try:
+                        checkin['location_zones'] = json.dumps(geofence.parse_zones(data['location_zones']))
+                    except (ValueError, KeyError, TypeError) as e:
+                        return jsonify({'success': False, 'message': f'签到区域格式不正确: {e}'}), 400
+            cursor.execute("""
+                UPDATE checkins SET location_lat = %s, location_lng = %s, location_range = %s, location_zones = %s
+                WHERE id = %s
+            """, (checkin['location_lat'], checkin['location_lng'], checkin['location_range'],
+                  checkin['location_zones'], checkin_id))
+        
+        fence = geofence.Geofence(geofence.zones_for_checkin(checkin))
+        if not fence.zones:
+            conn.rollback()
+            return jsonify({'success': False, 'message': '签到位置未设置'}), 400
+        
+        cursor.execute("""
+            SELECT cr.id, cr.user_id, cr.status, cr.checkin_time, cr.location_lat, cr.location_lng, u.real_name
+            FROM checkin_records cr
+            JOIN users u ON cr.user_id = u.user_id
+            WHERE cr.checkin_id = %s AND cr.location_lat IS NOT NULL AND cr.location_lng IS NOT NULL
+        """, (checkin_id,))
+        records = cursor.fetchall()
+        
+        inside, distance, _ = fence.check_many([float(r['location_lat']) for r in records],
+                                               [float(r['location_lng']) for r in records])
+        
+        # 位置校验结果与当前状态不一致的记录
+        updates = {}
+        results = []
+        for record, ok, dist in zip(records, inside, distance):
+            status = record['status']
+            if not ok and status != 'absent':
+                status = 'absent'
+            elif ok and status == 'absent':
+                status = checkin_status(checkin, now=record['checkin_time'])
+            if status != record['status']:
+                updates.setdefault(status, []).append(record['id'])
+            results.append({
+                'record_id': record['id'],
+                'user_id': record['user_id'],
+                'real_name': record['real_name'],
+                'inside': bool(ok),
+                'distance': round(float(dist), 1),
+                'status': record['status'],
+                'new_status': status
+            })
+        
+        apply = bool(data.get('apply'))
+        if apply:
+            version = bump_records_version(cursor, [checkin_id]).get(checkin_id, 0) if updates else 0
+            for status, ids in updates.items():
+                placeholders = ', '.join(['%s'] * len(ids))
+                cursor.execute(f"UPDATE checkin_records SET status = %s, version = %s WHERE id IN ({placeholders})",
+                               [status, version, *ids])
+            if updates:
+                try:
+                    attendance_rollup.recompute(cursor, [checkin_id])
+                except Exception as e:
+                    print(f'[考勤汇总] 更新失败: {e}')
+        
+        if corrected or (apply and updates):
+            conn.commit()
+        else:
+            conn.rollback()
+        
+        if corrected:
+            active_checkins.refresh(checkin_id)
+        if apply and updates:
+            for result in results:
+                if result['status'] != result['new_status']:
+                    user_active_lists.invalidate(result['user_id'])
+            roster_hub.drop(checkin_id)
+        
+        return jsonify({
+            'success': True,
+            'applied': apply,
+            'total': len(results),
+            'inside': int(inside.sum()),
+            'outside': len(results) - int(inside.sum()),
+            'changed': sum(len(ids) for ids in updates.values()),
+            'records': results
+        })
+    except Exception as e:
+        conn.rollback()
+        return jsonify({'success': False, 'message': str(e)}), 500
     finally:
         cursor.close()
         conn.close()
@@ -852,9 +964,6 @@ def smart_checkin():
     user_id = get_current_user_id()
     data = request.json
     
-    conn = get_db_connection()
-    cursor = get_cursor(conn)
-    
     try:
         checkin_id = data.get('checkin_id')
         class_photo = data.get('class_photo')  # base64 图片
@@ -862,37 +971,46 @@ def smart_checkin():
         if not checkin_id or not class_photo:
             return jsonify({'success': False, 'message': '缺少必要参数'}), 400
         
-        # 获取签到信息
-        cursor.execute("""
-            SELECT c.*, g.id as group_id FROM checkins c
-            LEFT JOIN chat_groups g ON c.group_id = g.id
-            WHERE c.id = %s
-        """, (checkin_id,))
-        checkin = cursor.fetchone()
-        
-        if not checkin:
-            return jsonify({'success': False, 'message': '签到不存在'}), 404
-        
-        # 验证是否是创建者
-        if checkin['creator_id'] != user_id:
-            return jsonify({'success': False, 'message': '只有创建者可以使用智能点到'}), 403
-        
-        # 检查签到类型
-        if checkin['type'] != 'photo':
-            return jsonify({'success': False, 'message': '该签到不支持智能点到'}), 400
+        # 签到信息和群组成员一次查出，人脸推理和写入签到记录（批量模式下等待写入线程借出连接）前归还连接
+        conn = get_db_connection()
+        cursor = get_cursor(conn)
+        try:
+            cursor.execute("""
+                SELECT c.*, g.id as group_id FROM checkins c
+                LEFT JOIN chat_groups g ON c.group_id = g.id
+                WHERE c.id = %s
+            """, (checkin_id,))
+            checkin = cursor.fetchone()
+            
+            if not checkin:
+                return jsonify({'success': False, 'message': '签到不存在'}), 404
+            
+            # 验证是否是创建者
+            if checkin['creator_id'] != user_id:
+                return jsonify({'success': False, 'message': '只有创建者可以使用智能点到'}), 403
+            
+            # 检查签到类型
+            if checkin['type'] != 'photo':
+                return jsonify({'success': False, 'message': '该签到不支持智能点到'}), 400
+            
+            # 获取群组所有成员的人脸信息
+            cursor.execute("""
+                SELECT gm.user_id, u.real_name, uf.face_embedding
+                FROM group_members gm
+                JOIN users u ON gm.user_id = u.user_id
+                LEFT JOIN user_faces uf ON gm.user_id = uf.user_id
+                WHERE gm.group_id = %s AND gm.role = 'member'
+            """, (checkin['group_id'],))
+            members = cursor.fetchall()
+        finally:
+            cursor.close()
+            conn.close()
         
         # 导入人脸服务
-        from face_service import FaceService
-        import base64
-        import cv2
-        import numpy as np
+        from face_service import FaceService, decode_image
         
         # 解码图片
-        if ',' in class_photo:
-            class_photo = class_photo.split(',')[1]
-        img_data = base64.b64decode(class_photo)
-        nparr = np.frombuffer(img_data, np.uint8)
-        img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+        img = decode_image(class_photo)
         
         if img is None:
             return jsonify({'success': False, 'message': '图片解码失败'}), 400
@@ -909,77 +1027,47 @@ def smart_checkin():
         
         print(f'[智能点到] 检测到 {len(detected_faces)} 张人脸')
         
-        # 获取群组所有成员的人脸信息
-        cursor.execute("""
-            SELECT gm.user_id, u.real_name, uf.face_embedding
-            FROM group_members gm
-            JOIN users u ON gm.user_id = u.user_id
-            LEFT JOIN user_faces uf ON gm.user_id = uf.user_id
-            WHERE gm.group_id = %s AND gm.role = 'member'
-        """, (checkin['group_id'],))
-        members = cursor.fetchall()
-        
         # 过滤出有人脸信息的成员
         members_with_face = [m for m in members if m['face_embedding']]
         print(f'[智能点到] 群组有 {len(members)} 名成员，其中 {len(members_with_face)} 人有人脸信息')
         
-        # 获取已签到的用户
-        cursor.execute("""
-            SELECT user_id FROM checkin_records WHERE checkin_id = %s
-        """, (checkin_id,))
-        checked_users = set(r['user_id'] for r in cursor.fetchall())
+        # 获取已签到的用户（包含尚未写入数据库的记录）
+        checked_users = checkin_writer.checked_users(checkin['id'])
+        
+        # 匹配人脸：成员特征只解析一次，整体计算距离矩阵后全局分配
+        candidates = [m for m in members_with_face if m['user_id'] not in checked_users]
+        names = {m['user_id']: m['real_name'] for m in candidates}
+        member_matrix = np.array([decode_embedding(m['face_embedding']) for m in candidates], dtype=np.float32)
+        face_results = match_faces(
+            detected_faces,
+            [m['user_id'] for m in candidates],
+            member_matrix,
+            FaceService.THRESHOLD,
+            method=Config.SMART_CHECKIN_MATCH_METHOD
+        )
         
-        # 匹配人脸
         matched_users = []
-        for face_embedding in detected_faces:
-            face_vec = np.array(face_embedding)
-            
-            best_match = None
-            best_distance = float('inf')
-            
-            for member in members_with_face:
-                if member['user_id'] in checked_users:
-                    continue  # 已签到的跳过
-                
-                stored_vec = np.array(json.loads(member['face_embedding']))
-                distance = FaceService.cosine_distance(face_vec, stored_vec)
-                
-                if distance < FaceService.THRESHOLD and distance < best_distance:
-                    best_distance = distance
-                    best_match = member
-            
-            if best_match and best_match['user_id'] not in [m['user_id'] for m in matched_users]:
-                similarity = (1 - best_distance) * 100
+        for face in face_results:
+            face['real_name'] = names.get(face['user_id'])
+            if face['user_id'] is not None:
                 matched_users.append({
-                    'user_id': best_match['user_id'],
-                    'real_name': best_match['real_name'],
-                    'similarity': round(similarity, 1)
+                    'user_id': face['user_id'],
+                    'real_name': face['real_name'],
+                    'similarity': face['similarity'],
+                    'margin': face['margin']
                 })
-                checked_users.add(best_match['user_id'])
         
         print(f'[智能点到] 匹配到 {len(matched_users)} 名学生')
         
-        # 批量签到
-        checkin_count = 0
-        for user in matched_users:
-            try:
-                # 判断是否迟到
-                status = 'checked'
-                if checkin['end_time'] and checkin['created_at']:
-                    total_seconds = (checkin['end_time'] - checkin['created_at']).total_seconds()
-                    elapsed_seconds = (datetime.now() - checkin['created_at']).total_seconds()
-                    if elapsed_seconds > total_seconds * 0.5:
-                        status = 'late'
-                
-                cursor.execute("""
-                    INSERT INTO checkin_records (checkin_id, user_id, status, checkin_time, face_similarity)
-                    VALUES (%s, %s, %s, NOW(), %s)
-                """, (checkin_id, user['user_id'], status, user['similarity']))
-                checkin_count += 1
-            except Exception as e:
-                print(f'[智能点到] 签到失败 user_id={user["user_id"]}: {e}')
-        
-        conn.commit()
+        # 批量签到（合并为多行 INSERT）
+        status = checkin_status(checkin)
+        accepted = checkin_writer.submit_many([{
+            'checkin_id': checkin['id'],
+            'user_id': user['user_id'],
+            'status': status,
+            'face_similarity': user['similarity']
+        } for user in matched_users])
+        checkin_count = sum(accepted)
         
         return jsonify({
             'success': True,
@@ -987,13 +1075,12 @@ def smart_checkin():
             'detected_count': len(detected_faces),
             'matched_count': len(matched_users),
             'checkin_count': checkin_count,
-            'matched_users': matched_users
+            'matched_users': matched_users,
+            'faces': face_results
         })
+    except InferenceBusyError:
+        raise
     except Exception as e:
-        conn.rollback()
         import traceback
         traceback.print_exc()
         return jsonify({'success': False, 'message': str(e)}), 500
-    finally:
-        cursor.close()
-        conn.close()
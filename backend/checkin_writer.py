@@ -0,0 +1,317 @@
+"""
+签到记录批量写入
+签到高峰时每个学生都单独查询"是否已签到"并提交一次单行 INSERT。
+这里在内存中按签到去重（uk_checkin_user 唯一键仍是最终依据），
+记录先进入缓冲区，每隔几毫秒或攒够 N 条合并为一条多行 INSERT 写入。
+
+写入模式（CHECKIN_WRITE_MODE）：
+- sync:  每条记录立即单独写入并提交，与原实现一致
+- batch: 合并写入，请求等待所在批次提交后再返回（默认，延迟增加不超过一个刷新间隔）
+- async: 合并写入，进入缓冲区即返回；进程崩溃时缓冲区中未写入的记录会丢失
+"""
+import time
+import atexit
+import threading
+from datetime import datetime
+from database import Database
+import attendance_rollup
+from checkin_cache import user_active_lists
+from checkin_roster import roster_hub
+from config import Config
+
+COLUMNS = ('checkin_id', 'user_id', 'status', 'checkin_time',
+           'face_image_url', 'face_similarity', 'location_lat', 'location_lng')
+
+
+def bump_records_version(cursor, checkin_ids):
+    """
+    签到记录变更前调用（与变更在同一事务中），返回 {checkin_id: 新版本号}
+
+    UPDATE 持有签到行锁直到提交，同一签到的写入按版本号顺序提交，
+    读到版本号 v 的客户端之后不会再出现版本号不大于 v 的新记录。
+    """
+    checkin_ids = sorted(set(checkin_ids))
+    placeholders = ', '.join(['%s'] * len(checkin_ids))
+    cursor.execute(f"UPDATE checkins SET records_version = records_version + 1 WHERE id IN ({placeholders})",
+                   checkin_ids)
+    cursor.execute(f"SELECT id, records_version FROM checkins WHERE id IN ({placeholders})", checkin_ids)
+    return {row['id']: row['records_version'] for row in cursor.fetchall()}
+
+
+class CheckinWriteError(Exception):
+    """签到记录写入失败"""
+    pass
+
+
+class _PendingRecord:
+    __slots__ = ('values', 'event', 'error')
+
+    def __init__(self, values):
+        self.values = values
+        self.event = threading.Event()
+        self.error = None
+
+
+class CheckinRecordWriter:
+    """
+    签到记录写入器
+
+    - mode: sync / batch / async
+    - interval_ms: 刷新间隔（毫秒）
+    - max_rows: 缓冲区达到该条数立即刷新
+    """
+
+    # 内存去重集合闲置超过该时间（秒）后释放，下次使用时重新从数据库加载
+    SEEN_IDLE_SECONDS = 3600
+
+    def __init__(self, mode=None, interval_ms=None, max_rows=None):
+        self.mode = mode or Config.CHECKIN_WRITE_MODE
+        self.interval = (Config.CHECKIN_WRITE_INTERVAL_MS if interval_ms is None else interval_ms) / 1000.0
+        self.max_rows = max_rows or Config.CHECKIN_WRITE_MAX_ROWS
+
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._has_data = threading.Event()
+        self._full = threading.Event()
+        self._buffer = []
+        self._seen = {}  # checkin_id -> 已签到 user_id 集合
+        self._seen_used = {}  # checkin_id -> 最近使用时间
+        self._thread = None
+
+        self._submitted = 0
+        self._duplicates = 0
+        self._flushes = 0
+        self._flushed_rows = 0
+        self._errors = 0
+
+    # ==================== 去重 ====================
+
+    def _seen_users(self, checkin_id):
+        """返回签到的已签到用户集合，首次使用时从数据库加载"""
+        seen = self._seen.get(checkin_id)
+        if seen is None:
+            with self._load_lock:
+                seen = self._seen.get(checkin_id)
+                if seen is None:
+                    rows = Database.execute_query(
+                        "SELECT user_id FROM checkin_records WHERE checkin_id = %s",
+                        (checkin_id,), fetch_all=True
+                    ) or []
+                    seen = {row['user_id'] for row in rows}
+                    with self._lock:
+                        # 加载期间已提交的记录也要保留
+                        seen |= self._seen.get(checkin_id, set())
+                        self._seen[checkin_id] = seen
+        self._seen_used[checkin_id] = time.monotonic()
+        return seen
+
+    def has_checked_in(self, checkin_id, user_id):
+        return int(user_id) in self._seen_users(int(checkin_id))
+
+    def checked_users(self, checkin_id):
+        """已签到用户集合的副本（包含尚未写入数据库的记录）"""
+        seen = self._seen_users(int(checkin_id))
+        with self._lock:
+            return set(seen)
+
+    def forget(self, checkin_id):
+        """丢弃某个签到的去重集合（例如记录被外部修改后）"""
+        with self._lock:
+            self._seen.pop(int(checkin_id), None)
+            self._seen_used.pop(int(checkin_id), None)
+
+    # ==================== 写入 ====================
+
+    def submit(self, checkin_id, user_id, status, checkin_time=None, **fields):
+        """
+        提交一条签到记录
+
+        Returns:
+            bool: False 表示该用户已签到过
+        Raises:
+            CheckinWriteError: sync / batch 模式下写入失败
+        """
+        record = dict(fields, checkin_id=checkin_id, user_id=user_id, status=status, checkin_time=checkin_time)
+        return self.submit_many([record])[0]
+
+    def submit_many(self, records):
+        """
+        提交多条签到记录（字段同 COLUMNS），返回与 records 对应的是否接受列表
+
+        batch 模式下等待所有记录所在批次提交，任一条写入失败时抛出 CheckinWriteError。
+        """
+        accepted, pendings = [], []
+        for record in records:
+            checkin_id, user_id = int(record['checkin_id']), int(record['user_id'])
+            seen = self._seen_users(checkin_id)
+            with self._lock:
+                if user_id in seen:
+                    self._duplicates += 1
+                    accepted.append(False)
+                    continue
+                seen.add(user_id)
+                self._submitted += 1
+            accepted.append(True)
+            values = dict(record, checkin_id=checkin_id, user_id=user_id,
+                          checkin_time=record.get('checkin_time') or datetime.now())
+            pendings.append(_PendingRecord(tuple(values.get(column) for column in COLUMNS)))
+
+        if not pendings:
+            return accepted
+        if self.mode == 'sync':
+            self._write(pendings)
+        else:
+            self._ensure_thread()
+            with self._lock:
+                self._buffer.extend(pendings)
+                self._has_data.set()
+                if len(self._buffer) >= self.max_rows:
+                    self._full.set()
+            if self.mode == 'async':
+                return accepted
+            for pending in pendings:
+                pending.event.wait()
+
+        for pending in pendings:
+            if pending.error is not None:
+                raise CheckinWriteError(f'签到记录写入失败: {pending.error}')
+        return accepted
+
+    def _write(self, batch):
+        """
+        多行 INSERT 写入一批记录
+
+        只有唯一键重复的记录被吸收（ON DUPLICATE KEY UPDATE id = id，受影响行数为 0）；
+        外键、数据等错误不会像 INSERT IGNORE 那样变成警告，而是让整批失败并逐条重试。
+        有重复记录时，截止前提交的记录替换结束签到时补写的缺勤记录：
+        多进程部署时结束签到只能写入本进程缓冲区，其他进程中已向学生返回成功的记录可能晚于缺勤记录落库。
+        """
+        placeholders = ', '.join(['(' + ', '.join(['%s'] * (len(COLUMNS) + 1)) + ')'] * len(batch))
+        sql = (f"INSERT INTO checkin_records ({', '.join(COLUMNS)}, version) VALUES {placeholders} "
+               f"ON DUPLICATE KEY UPDATE id = id")
+        try:
+            conn = Database.get_connection()
+            try:
+                with conn.cursor() as cursor:
+                    versions = bump_records_version(cursor, [pending.values[0] for pending in batch])
+                    cursor.execute(sql, [value for pending in batch
+                                         for value in (*pending.values, versions.get(pending.values[0], 0))])
+                    inserted = cursor.rowcount
+                    records = [dict(zip(COLUMNS, pending.values), version=versions.get(pending.values[0], 0))
+                               for pending in batch]
+                    written = records
+                    if inserted < len(batch):
+                        self._replace_absent(cursor, batch, versions)
+                        written = self._written(cursor, records, versions)
+                    attendance_rollup.apply_written(cursor, records, inserted)
+                conn.commit()
+            finally:
+                conn.close()
+        except Exception as e:
+            if len(batch) > 1:
+                # 逐条重试，避免个别无效记录（如签到已被删除）拖累整批
+                print(f'[签到写入] 批量写入 {len(batch)} 条失败，逐条重试: {e}')
+                for pending in batch:
+                    self._write([pending])
+                return
+            with self._lock:
+                self._errors += 1
+                for pending in batch:
+                    pending.error = e
+                    # 写入失败的用户允许重新签到
+                    self._seen.get(pending.values[0], set()).discard(pending.values[1])
+            print(f'[签到写入] 写入 {len(batch)} 条失败: {e}')
+        else:
+            with self._lock:
+                self._flushes += 1
+                self._flushed_rows += len(batch)
+            for pending in batch:
+                user_active_lists.invalidate(pending.values[1])
+            try:
+                roster_hub.records_written(written)
+            except Exception as e:
+                print(f'[签到写入] 推送实时名单失败: {e}')
+        for pending in batch:
+            pending.event.set()
+
+    @staticmethod
+    def _replace_absent(cursor, batch, versions):
+        """
+        用签到记录替换补写的缺勤记录（只在批次中有重复记录时执行）
+
+        补写的缺勤记录没有人脸和位置、签到时间等于截止时间；位置复核改为缺勤的记录带有位置，不会被替换。
+        """
+        assignments = ', '.join(f'cr.{column} = %s' for column in COLUMNS[2:])
+        cursor.executemany(f"""
+            UPDATE checkin_records cr
+            JOIN checkins c ON c.id = cr.checkin_id
+            SET {assignments}, cr.version = %s
+            WHERE cr.checkin_id = %s AND cr.user_id = %s
+              AND cr.status = 'absent' AND cr.checkin_time = c.end_time
+              AND cr.face_image_url IS NULL AND cr.location_lat IS NULL
+              AND %s <= c.end_time
+        """, [(*pending.values[2:], versions.get(pending.values[0], 0), *pending.values[:2], pending.values[3])
+              for pending in batch])
+
+    @staticmethod
+    def _written(cursor, records, versions):
+        """有重复记录时，找出本批实际插入或替换的记录（版本号等于本批的版本号，被吸收的重复记录保留旧版本号）"""
+        conditions = ' OR '.join(['(checkin_id = %s AND version = %s)'] * len(versions))
+        cursor.execute(f"SELECT checkin_id, user_id FROM checkin_records WHERE {conditions}",
+                       [value for item in versions.items() for value in item])
+        keys = {(row['checkin_id'], row['user_id']) for row in cursor.fetchall()}
+        return [r for r in records if (r['checkin_id'], r['user_id']) in keys]
+
+    def flush(self):
+        """立即写入缓冲区中的全部记录，返回时之前提交的记录均已落库（或已失败）"""
+        with self._flush_lock:
+            with self._lock:
+                batch, self._buffer = self._buffer, []
+            for i in range(0, len(batch), self.max_rows):
+                self._write(batch[i:i + self.max_rows])
+
+    def _ensure_thread(self):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, daemon=True)
+                    self._thread.start()
+
+    def _run(self):
+        while True:
+            # 空闲时一直等待；有数据后最多再等一个刷新间隔，缓冲区满则立即刷新
+            self._has_data.wait()
+            self._full.wait(self.interval)
+            self._has_data.clear()
+            self._full.clear()
+            try:
+                self.flush()
+                self._evict_idle()
+            except Exception as e:
+                print(f'[签到写入] 刷新异常: {e}')
+
+    def _evict_idle(self):
+        deadline = time.monotonic() - self.SEEN_IDLE_SECONDS
+        with self._lock:
+            for checkin_id in [cid for cid, used in self._seen_used.items() if used < deadline]:
+                self._seen.pop(checkin_id, None)
+                self._seen_used.pop(checkin_id, None)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'mode': self.mode,
+                'buffered': len(self._buffer),
+                'submitted': self._submitted,
+                'duplicates': self._duplicates,
+                'flushes': self._flushes,
+                'flushed_rows': self._flushed_rows,
+                'avg_rows_per_flush': round(self._flushed_rows / self._flushes, 2) if self._flushes else 0,
+                'errors': self._errors,
+                'tracked_checkins': len(self._seen)
+            }
+
+
+checkin_writer = CheckinRecordWriter()
+atexit.register(checkin_writer.flush)
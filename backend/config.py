@@ -23,7 +23,13 @@ class Config:
         'charset': 'utf8mb4',
         'cursorclass': 'DictCursor'
     }
-    
+
+    # 数据库连接池配置
+    DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 20))
+    DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', 10))
+    DB_POOL_MAX_IDLE = int(os.getenv('DB_POOL_MAX_IDLE', 300))
+    DB_POOL_PING_INTERVAL = int(os.getenv('DB_POOL_PING_INTERVAL', 30))
+
     # SQLAlchemy 数据库 URI
     @staticmethod
     def get_database_uri():
@@ -44,6 +50,71 @@ class Config:
     MAX_CONTENT_LENGTH = int(os.getenv('MAX_CONTENT_LENGTH', 16 * 1024 * 1024))
     ALLOWED_EXTENSIONS = set(os.getenv('ALLOWED_EXTENSIONS', 'jpg,jpeg,png,gif').split(','))
     
+    # 人脸索引配置
+    FACE_INDEX_SYNC_INTERVAL = int(os.getenv('FACE_INDEX_SYNC_INTERVAL', 30))  # 增量同步间隔（秒）
+    FACE_INDEX_TOP_K = int(os.getenv('FACE_INDEX_TOP_K', 5))  # 1:N 比对每次到数据库校验账号状态的候选者数
+    # 特征向量写入格式: json / float32 / float16（读取始终兼容两种格式，执行 migrate_face_embeddings.py 后再切换）
+    FACE_EMBEDDING_STORAGE = os.getenv('FACE_EMBEDDING_STORAGE', 'json')
+
+    # 活体检测 FaceMesh 实例池大小
+    FACE_MESH_POOL_SIZE = int(os.getenv('FACE_MESH_POOL_SIZE', 4))
+
+    # 人脸推理进程池（0 表示在 Web 进程内推理）
+    FACE_WORKERS = int(os.getenv('FACE_WORKERS', 2))
+    FACE_WORKER_QUEUE = int(os.getenv('FACE_WORKER_QUEUE', 16))  # 等待推理的请求上限
+    FACE_WORKER_TIMEOUT = float(os.getenv('FACE_WORKER_TIMEOUT', 30))  # 单次推理超时（秒）
+    FACE_WORKER_RETRY_AFTER = int(os.getenv('FACE_WORKER_RETRY_AFTER', 3))  # 503 响应的 Retry-After（秒）
+    # 启动时预加载人脸模型，预加载完成前 /api/health 返回 503
+    FACE_WARMUP = os.getenv('FACE_WARMUP', 'false').lower() == 'true'
+    FACE_WARMUP_TIMEOUT = float(os.getenv('FACE_WARMUP_TIMEOUT', 180))
+    # 合照点到的人脸分配方式: hungarian（全局最优）/ greedy（按分数贪心）
+    SMART_CHECKIN_MATCH_METHOD = os.getenv('SMART_CHECKIN_MATCH_METHOD', 'hungarian')
+    # 合照分块检测：长边超过 FACE_TILE_SIZE 的图片切成重叠分块分别检测
+    FACE_TILED_DETECTION = os.getenv('FACE_TILED_DETECTION', 'true').lower() == 'true'
+    FACE_TILE_SIZE = int(os.getenv('FACE_TILE_SIZE', 1024))
+    FACE_TILE_OVERLAP = float(os.getenv('FACE_TILE_OVERLAP', 0.2))
+    FACE_TILE_NMS_IOU = float(os.getenv('FACE_TILE_NMS_IOU', 0.4))
+    # 签到特征提取微批处理（窗口为 0 表示逐张提取）
+    FACE_BATCH_WINDOW_MS = float(os.getenv('FACE_BATCH_WINDOW_MS', 20))
+    FACE_BATCH_MAX_SIZE = int(os.getenv('FACE_BATCH_MAX_SIZE', 16))
+
+    # 进行中签到缓存的最长有效期（秒），多进程部署时其他进程结束签到后最多延迟这么久失效
+    CHECKIN_CACHE_TTL = int(os.getenv('CHECKIN_CACHE_TTL', 60))
+    # 学生端进行中签到列表的按用户缓存时间（秒），0 表示不缓存
+    CHECKIN_ACTIVE_LIST_TTL = float(os.getenv('CHECKIN_ACTIVE_LIST_TTL', 5))
+    # 签到记录写入: sync（逐条提交）/ batch（合并写入，提交后返回）/ async（合并写入，立即返回）
+    CHECKIN_WRITE_MODE = os.getenv('CHECKIN_WRITE_MODE', 'batch')
+    CHECKIN_WRITE_INTERVAL_MS = float(os.getenv('CHECKIN_WRITE_INTERVAL_MS', 5))
+    CHECKIN_WRITE_MAX_ROWS = int(os.getenv('CHECKIN_WRITE_MAX_ROWS', 200))
+    # 签到截图：后台写入原图并生成 WebP 缩略图（长边像素 / 质量 / 等待写入上限）
+    EVIDENCE_THUMB_SIZE = int(os.getenv('EVIDENCE_THUMB_SIZE', 160))
+    EVIDENCE_THUMB_QUALITY = int(os.getenv('EVIDENCE_THUMB_QUALITY', 70))
+    EVIDENCE_QUEUE_SIZE = int(os.getenv('EVIDENCE_QUEUE_SIZE', 256))
+    # 签到到期自动结束并补写缺勤记录；GRACE 为到期后的等待秒数（需大于其他进程签到写入的刷新间隔）
+    CHECKIN_SCHEDULER = os.getenv('CHECKIN_SCHEDULER', 'true').lower() == 'true'
+    CHECKIN_CLOSE_GRACE = float(os.getenv('CHECKIN_CLOSE_GRACE', 2))
+    CHECKIN_SCHEDULER_SWEEP = int(os.getenv('CHECKIN_SCHEDULER_SWEEP', 300))  # 重新扫描数据库的间隔（秒）
+
+    # 多进程部署：Socket.IO 消息队列（如 redis://127.0.0.1:6379/0），为空时单进程运行
+    SOCKETIO_MESSAGE_QUEUE = os.getenv('SOCKETIO_MESSAGE_QUEUE', '')
+    SOCKETIO_CHANNEL = os.getenv('SOCKETIO_CHANNEL', 'flask-socketio')
+    # 在线状态和通话状态的共享存储（Redis），默认与消息队列相同
+    SHARED_STATE_URL = os.getenv('SHARED_STATE_URL', SOCKETIO_MESSAGE_QUEUE if SOCKETIO_MESSAGE_QUEUE.startswith('redis') else '')
+    SHARED_STATE_PREFIX = os.getenv('SHARED_STATE_PREFIX', 'ws')
+    SOCKETIO_HEARTBEAT = float(os.getenv('SOCKETIO_HEARTBEAT', 10))  # 进程心跳间隔（秒）
+    SERVER_PORT = int(os.getenv('SERVER_PORT', 5000))
+    # 在线状态广播：联系人缓存有效期（秒）/ 缓存用户数上限 / 防抖窗口（秒，0 表示立即广播）
+    CONTACT_GRAPH_TTL = int(os.getenv('CONTACT_GRAPH_TTL', 300))
+    CONTACT_GRAPH_MAX_USERS = int(os.getenv('CONTACT_GRAPH_MAX_USERS', 50000))
+    PRESENCE_DEBOUNCE = float(os.getenv('PRESENCE_DEBOUNCE', 2))
+    # user_online_status 写回间隔（秒），0 表示每次变化立即写入
+    ONLINE_STATUS_FLUSH_INTERVAL = float(os.getenv('ONLINE_STATUS_FLUSH_INTERVAL', 2))
+    # 多进程部署时内存中的最后在线时间的有效期（秒），过期后重新从数据库读取其他进程写入的状态
+    ONLINE_STATUS_CACHE_TTL = float(os.getenv('ONLINE_STATUS_CACHE_TTL', 30))
+    # 群消息发送：成员身份缓存 / 发送者信息缓存有效期（秒），发送者姓名头像修改后最多延迟这么久显示
+    GROUP_MEMBER_CACHE_TTL = int(os.getenv('GROUP_MEMBER_CACHE_TTL', 60))
+    SENDER_PROFILE_CACHE_TTL = int(os.getenv('SENDER_PROFILE_CACHE_TTL', 300))
+
     # AI聊天机器人配置
     AI_API_KEY = os.getenv('AI_API_KEY', '')
     AI_MODEL = os.getenv('AI_MODEL', 'deepseek-v3.2-exp')
@@ -1,13 +1,189 @@
+import time
+import threading
+from collections import deque
 import pymysql
 from pymysql.cursors import DictCursor
 from config import Config
 
+
+class PoolTimeoutError(Exception):
+    """等待连接池空闲连接超时"""
+    pass
+
+
+class PooledConnection:
+    """连接池中借出的连接，close() 时归还到连接池而不是真正关闭"""
+
+    def __init__(self, pool, raw):
+        self._pool = pool
+        self._raw = raw
+        self._released = False
+
+    def __getattr__(self, name):
+        return getattr(self._raw, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def close(self):
+        """归还连接"""
+        if not self._released:
+            self._released = True
+            self._pool.release(self._raw)
+
+    def discard(self):
+        """连接已损坏，直接销毁而不归还"""
+        if not self._released:
+            self._released = True
+            self._pool.release(self._raw, discard=True)
+
+
+class ConnectionPool:
+    """
+    MySQL 连接池
+
+    app.py 在启动时执行了 gevent monkey.patch_all()，threading 中的锁和信号量
+    会被替换为协程安全的实现，因此等待空闲连接时只会挂起当前协程。
+    """
+
+    def __init__(self, creator, max_size=20, timeout=10, max_idle=300, ping_interval=30):
+        """
+        Args:
+            creator: 创建原始连接的函数
+            max_size: 最大连接数（空闲 + 借出）
+            timeout: 获取连接的最长等待时间（秒）
+            max_idle: 空闲超过该时间（秒）的连接会被销毁
+            ping_interval: 空闲超过该时间（秒）的连接在借出前先 ping 检查
+        """
+        self._creator = creator
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self.ping_interval = ping_interval
+
+        self._idle = deque()  # [(conn, last_used)]
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_size)
+
+        self._in_use = 0
+        self._created = 0
+        self._destroyed = 0
+        self._checkouts = 0
+        self._timeouts = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    def acquire(self):
+        """借出一个连接，返回 PooledConnection"""
+        start = time.monotonic()
+        if not self._slots.acquire(timeout=self.timeout):
+            with self._lock:
+                self._timeouts += 1
+            raise PoolTimeoutError(f'获取数据库连接超时（{self.timeout}秒）')
+        waited = time.monotonic() - start
+
+        try:
+            raw = self._take_idle()
+            if raw is None:
+                raw = self._creator()
+                with self._lock:
+                    self._created += 1
+        except Exception:
+            self._slots.release()
+            raise
+
+        with self._lock:
+            self._in_use += 1
+            self._checkouts += 1
+            self._wait_total += waited
+            self._wait_max = max(self._wait_max, waited)
+        return PooledConnection(self, raw)
+
+    def release(self, raw, discard=False):
+        """归还连接；未提交的事务一律回滚，避免下一个使用者读到旧快照"""
+        if not discard:
+            try:
+                raw.rollback()
+            except Exception:
+                discard = True
+
+        with self._lock:
+            self._in_use -= 1
+            if not discard:
+                self._idle.append((raw, time.monotonic()))
+        if discard:
+            self._destroy(raw)
+        self._slots.release()
+
+    def _take_idle(self):
+        """取出最近使用的健康空闲连接，顺带淘汰过期连接"""
+        while True:
+            now = time.monotonic()
+            expired = []
+            with self._lock:
+                # 队首是最久未使用的连接
+                while self._idle and now - self._idle[0][1] > self.max_idle:
+                    expired.append(self._idle.popleft()[0])
+                item = self._idle.pop() if self._idle else None
+            for conn in expired:
+                self._destroy(conn)
+
+            if item is None:
+                return None
+
+            raw, last_used = item
+            if now - last_used <= self.ping_interval:
+                return raw
+            try:
+                raw.ping(reconnect=False)
+                return raw
+            except Exception:
+                self._destroy(raw)
+
+    def _destroy(self, raw):
+        try:
+            raw.close()
+        except Exception:
+            pass
+        with self._lock:
+            self._destroyed += 1
+
+    def close_idle(self):
+        """关闭所有空闲连接"""
+        with self._lock:
+            idle = [conn for conn, _ in self._idle]
+            self._idle.clear()
+        for conn in idle:
+            self._destroy(conn)
+
+    def stats(self):
+        """连接池指标"""
+        with self._lock:
+            return {
+                'max_size': self.max_size,
+                'in_use': self._in_use,
+                'idle': len(self._idle),
+                'created': self._created,
+                'destroyed': self._destroyed,
+                'checkouts': self._checkouts,
+                'timeouts': self._timeouts,
+                'wait_avg_ms': round(self._wait_total * 1000 / self._checkouts, 3) if self._checkouts else 0,
+                'wait_max_ms': round(self._wait_max * 1000, 3)
+            }
+
+
 class Database:
     """数据库连接类"""
-    
+
+    _pool = None
+    _pool_lock = threading.Lock()
+
     @staticmethod
-    def get_connection():
-        """获取数据库连接"""
+    def create_connection():
+        """创建一个不经过连接池的新连接"""
         return pymysql.connect(
             host=Config.DB_CONFIG['host'],
             port=Config.DB_CONFIG['port'],
@@ -17,19 +193,44 @@ class Database:
             charset=Config.DB_CONFIG['charset'],
             cursorclass=DictCursor
         )
-    
+
+    @staticmethod
+    def get_pool():
+        """获取全局连接池（首次调用时创建）"""
+        if Database._pool is None:
+            with Database._pool_lock:
+                if Database._pool is None:
+                    Database._pool = ConnectionPool(
+                        Database.create_connection,
+                        max_size=Config.DB_POOL_SIZE,
+                        timeout=Config.DB_POOL_TIMEOUT,
+                        max_idle=Config.DB_POOL_MAX_IDLE,
+                        ping_interval=Config.DB_POOL_PING_INTERVAL
+                    )
+        return Database._pool
+
+    @staticmethod
+    def get_connection():
+        """从连接池借出连接，用完调用 close() 归还"""
+        return Database.get_pool().acquire()
+
+    @staticmethod
+    def pool_stats():
+        """连接池指标"""
+        return Database.get_pool().stats()
+
     @staticmethod
     def execute_query(query, params=None, fetch_one=False, fetch_all=False, commit=False):
         """
         执行SQL查询
-        
+
         Args:
             query: SQL查询语句
             params: 查询参数
             fetch_one: 是否返回单条结果
             fetch_all: 是否返回所有结果
             commit: 是否提交事务
-        
+
         Returns:
             查询结果或影响的行数
         """
@@ -38,7 +239,7 @@ class Database:
             connection = Database.get_connection()
             with connection.cursor() as cursor:
                 cursor.execute(query, params or ())
-                
+
                 if fetch_one:
                     result = cursor.fetchone()
                 elif fetch_all:
@@ -48,7 +249,7 @@ class Database:
                     result = cursor.lastrowid if cursor.lastrowid else cursor.rowcount
                 else:
                     result = cursor.rowcount
-                
+
                 return result
         except Exception as e:
             if connection and commit:
@@ -0,0 +1,299 @@
+"""
+本地消息总线（开发和测试用的 Redis 替身）
+实现多进程部署用到的 Redis 协议子集，不需要安装 Redis 即可在本机运行多个后端进程：
+
+- 发布订阅: PUBLISH / SUBSCRIBE / UNSUBSCRIBE（Socket.IO 消息队列）
+- 集合、哈希、带过期时间的字符串、SCAN、MULTI / EXEC（在线状态和通话状态）
+
+只实现 RESP2，连接地址需带 protocol=2（redis-py 新版本默认使用 RESP3）。
+数据只保存在内存中，不做持久化，也不实现过期键的主动清理（访问时检查）。生产环境请使用 Redis。
+
+用法:
+    python dev_broker.py --port 6390
+    SOCKETIO_MESSAGE_QUEUE='redis://127.0.0.1:6390/0?protocol=2' SERVER_PORT=5001 python app.py
+"""
+import time
+import fnmatch
+import argparse
+import threading
+import socketserver
+
+
+class RespError(Exception):
+    pass
+
+
+def encode(value):
+    """按 RESP2 编码响应"""
+    if value is None:
+        return b'$-1\r\n'
+    if isinstance(value, RespError):
+        return f'-ERR {value}\r\n'.encode()
+    if isinstance(value, bool):
+        return b':1\r\n' if value else b':0\r\n'
+    if isinstance(value, int):
+        return f':{value}\r\n'.encode()
+    if isinstance(value, str) and value in ('OK', 'QUEUED', 'PONG'):
+        return f'+{value}\r\n'.encode()
+    if isinstance(value, str):
+        value = value.encode()
+    if isinstance(value, bytes):
+        return b'$%d\r\n%s\r\n' % (len(value), value)
+    return b'*%d\r\n' % len(value) + b''.join(encode(v) for v in value)
+
+
+class Store:
+    """键空间（所有连接共享）"""
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.data = {}
+        self.expires = {}
+        self.subscribers = {}  # channel -> {handler}
+
+    def _get(self, key, kind):
+        expires_at = self.expires.get(key)
+        if expires_at is not None and expires_at <= time.time():
+            self.data.pop(key, None)
+            self.expires.pop(key, None)
+        value = self.data.get(key)
+        if value is not None and kind is not None and not isinstance(value, kind):
+            raise RespError('WRONGTYPE Operation against a key holding the wrong kind of value')
+        return value
+
+    def _cleanup(self, key):
+        if not self.data.get(key):
+            self.data.pop(key, None)
+            self.expires.pop(key, None)
+
+    def execute(self, name, args):
+        handler = getattr(self, f'cmd_{name}', None)
+        if handler is None:
+            raise RespError(f"unknown command '{name}'")
+        with self.lock:
+            return handler(*args)
+
+    # ==================== 字符串 / 通用 ====================
+
+    def cmd_ping(self, *args):
+        return args[0] if args else 'PONG'
+
+    def cmd_select(self, db):
+        return 'OK'
+
+    def cmd_client(self, *args):
+        return 'OK'
+
+    def cmd_set(self, key, value, *options):
+        self.data[key] = value
+        self.expires.pop(key, None)
+        options = [o.upper() for o in options]
+        if b'EX' in options:
+            self.expires[key] = time.time() + int(options[options.index(b'EX') + 1])
+        return 'OK'
+
+    def cmd_get(self, key):
+        return self._get(key, bytes)
+
+    def cmd_exists(self, *keys):
+        return sum(self._get(key, None) is not None for key in keys)
+
+    def cmd_del(self, *keys):
+        removed = 0
+        for key in keys:
+            if self._get(key, None) is not None:
+                removed += 1
+            self.data.pop(key, None)
+            self.expires.pop(key, None)
+        return removed
+
+    def cmd_scan(self, cursor, *options):
+        options = list(options)
+        pattern = b'*'
+        for i, option in enumerate(options[:-1]):
+            if option.upper() == b'MATCH':
+                pattern = options[i + 1]
+        keys = [k for k in list(self.data) if self._get(k, None) is not None
+                and fnmatch.fnmatchcase(k.decode(), pattern.decode())]
+        return [b'0', keys]
+
+    # ==================== 集合 ====================
+
+    def cmd_sadd(self, key, *members):
+        values = self._get(key, set)
+        if values is None:
+            values = self.data[key] = set()
+        before = len(values)
+        values.update(members)
+        return len(values) - before
+
+    def cmd_srem(self, key, *members):
+        values = self._get(key, set) or set()
+        before = len(values)
+        values.difference_update(members)
+        removed = before - len(values)
+        self._cleanup(key)
+        return removed
+
+    def cmd_scard(self, key):
+        return len(self._get(key, set) or ())
+
+    def cmd_smembers(self, key):
+        return sorted(self._get(key, set) or ())
+
+    def cmd_sismember(self, key, member):
+        return member in (self._get(key, set) or ())
+
+    # ==================== 哈希 ====================
+
+    def cmd_hset(self, key, *pairs):
+        values = self._get(key, dict)
+        if values is None:
+            values = self.data[key] = {}
+        added = 0
+        for field, value in zip(pairs[::2], pairs[1::2]):
+            added += field not in values
+            values[field] = value
+        return added
+
+    def cmd_hget(self, key, field):
+        return (self._get(key, dict) or {}).get(field)
+
+    def cmd_hdel(self, key, *fields):
+        values = self._get(key, dict) or {}
+        removed = sum(values.pop(field, None) is not None for field in fields)
+        self._cleanup(key)
+        return removed
+
+    def cmd_hgetall(self, key):
+        return [v for pair in (self._get(key, dict) or {}).items() for v in pair]
+
+    # ==================== 发布订阅 ====================
+
+    def cmd_publish(self, channel, message):
+        handlers = list(self.subscribers.get(channel, ()))
+        for handler in handlers:
+            handler.push([b'message', channel, message])
+        return len(handlers)
+
+
+class Handler(socketserver.StreamRequestHandler):
+    """一个客户端连接"""
+
+    store = None
+
+    def setup(self):
+        super().setup()
+        self.write_lock = threading.Lock()
+        self.channels = set()
+        self.queued = None  # MULTI 之后排队的命令
+
+    def push(self, value):
+        try:
+            with self.write_lock:
+                self.wfile.write(encode(value))
+                self.wfile.flush()
+        except OSError:
+            pass
+
+    def read_command(self):
+        line = self.rfile.readline()
+        if not line:
+            return None
+        if not line.startswith(b'*'):
+            return line.split()  # inline 命令（例如 telnet 调试）
+        args = []
+        for _ in range(int(line[1:])):
+            length = int(self.rfile.readline()[1:])
+            args.append(self.rfile.read(length + 2)[:-2])
+        return args
+
+    def handle(self):
+        try:
+            while True:
+                args = self.read_command()
+                if args is None:
+                    break
+                if args:
+                    self.push(self.dispatch(args[0].decode().lower(), args[1:]))
+        except (OSError, ValueError):
+            pass
+        finally:
+            with self.store.lock:
+                for channel in self.channels:
+                    self.store.subscribers.get(channel, set()).discard(self)
+
+    def dispatch(self, name, args):
+        if name == 'multi':
+            self.queued = []
+            return 'OK'
+        if name == 'exec':
+            queued, self.queued = self.queued or [], None
+            with self.store.lock:
+                return [self.run(n, a) for n, a in queued]
+        if name == 'discard':
+            self.queued = None
+            return 'OK'
+        if self.queued is not None:
+            self.queued.append((name, args))
+            return 'QUEUED'
+        if name in ('subscribe', 'unsubscribe'):
+            return self.subscribe(name, args)
+        return self.run(name, args)
+
+    def run(self, name, args):
+        try:
+            return self.store.execute(name, args)
+        except RespError as e:
+            return e
+        except TypeError:
+            return RespError(f"wrong number of arguments for '{name}' command")
+
+    def subscribe(self, name, channels):
+        replies = []
+        with self.store.lock:
+            for channel in channels or list(self.channels):
+                if name == 'subscribe':
+                    self.channels.add(channel)
+                    self.store.subscribers.setdefault(channel, set()).add(self)
+                else:
+                    self.channels.discard(channel)
+                    self.store.subscribers.get(channel, set()).discard(self)
+                replies.append([name.encode(), channel, len(self.channels)])
+        # 每个频道一条确认，最后一条作为本命令的返回
+        for reply in replies[:-1]:
+            self.push(reply)
+        return replies[-1] if replies else [name.encode(), None, 0]
+
+
+class Broker(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host='127.0.0.1', port=6390):
+        handler = type('BoundHandler', (Handler,), {'store': Store()})
+        super().__init__((host, port), handler)
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f'redis://{host}:{port}/0?protocol=2'
+
+    def start(self):
+        """在后台线程中运行，返回连接地址"""
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self.url
+
+
+def main():
+    parser = argparse.ArgumentParser(description='本地消息总线（Redis 协议子集）')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=6390)
+    args = parser.parse_args()
+    broker = Broker(args.host, args.port)
+    print(f'本地消息总线已启动: {broker.url}')
+    broker.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
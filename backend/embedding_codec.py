@@ -0,0 +1,69 @@
+"""
+人脸特征向量存储格式
+
+二进制格式（8 字节头 + 向量数据，小端）:
+    0-1  魔数 b'FE'
+    2    版本号
+    3    数据类型 1=float32, 2=float16
+    4-5  维度 (uint16)
+    6-7  保留
+头部 8 字节保证 float32 数据按 4 字节对齐，可用 np.frombuffer 零拷贝读取。
+
+读取时同时兼容旧的 JSON 文本，便于迁移期间两种格式并存。
+"""
+import json
+import struct
+import numpy as np
+from config import Config
+
+MAGIC = b'FE'
+VERSION = 1
+HEADER = struct.Struct('<2sBBHxx')
+
+DTYPES = {1: np.dtype('<f4'), 2: np.dtype('<f2')}
+DTYPE_CODES = {'float32': 1, 'float16': 2}
+
+
+def is_binary(value):
+    """是否为二进制格式"""
+    return isinstance(value, (bytes, bytearray, memoryview)) and bytes(value[:2]) == MAGIC
+
+
+def encode_binary(embedding, dtype='float32'):
+    """编码为二进制格式"""
+    code = DTYPE_CODES[dtype]
+    vec = np.asarray(embedding, dtype=DTYPES[code])
+    return HEADER.pack(MAGIC, VERSION, code, vec.shape[0]) + vec.tobytes()
+
+
+def decode_binary(value):
+    """解码二进制格式，float32 数据直接引用原缓冲区"""
+    magic, version, code, dim = HEADER.unpack_from(value)
+    if magic != MAGIC or version != VERSION or code not in DTYPES:
+        raise ValueError(f'无法识别的特征格式: version={version}, dtype={code}')
+    vec = np.frombuffer(value, dtype=DTYPES[code], count=dim, offset=HEADER.size)
+    return vec if code == 1 else vec.astype(np.float32)
+
+
+def encode_embedding(embedding, storage=None):
+    """
+    按配置编码特征向量以写入 user_faces.face_embedding
+
+    Args:
+        storage: 'json' / 'float32' / 'float16'，默认取 Config.FACE_EMBEDDING_STORAGE
+    """
+    storage = storage or Config.FACE_EMBEDDING_STORAGE
+    if storage == 'json':
+        return json.dumps([float(x) for x in embedding])
+    return encode_binary(embedding, storage)
+
+
+def decode_embedding(value):
+    """解码数据库中的特征向量（二进制或 JSON），返回 float32 数组"""
+    if isinstance(value, (list, tuple, np.ndarray)):
+        return np.asarray(value, dtype=np.float32)
+    if is_binary(value):
+        return decode_binary(value)
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        value = bytes(value).decode('utf-8')
+    return np.asarray(json.loads(value), dtype=np.float32)
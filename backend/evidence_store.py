@@ -0,0 +1,179 @@
+"""
+签到证据图片存储
+人脸/手势签到原先在请求中同步解码并写入整张截图，教师查看签到记录时每个学生都加载原图。
+这里请求中只计算内容哈希并立即返回 URL，写文件和生成缩略图交给后台线程：
+
+- 原图: /uploads/checkin_faces/<sha256>.<ext>
+- 缩略图: /uploads/checkin_faces/thumbs/<sha256>.webp（长边 EVIDENCE_THUMB_SIZE）
+
+文件名由内容决定，同一张图片只保存一次。进程退出前会写完队列中的图片，
+但进程崩溃时队列中尚未写入的图片会丢失（签到记录本身不受影响）。
+"""
+import os
+import re
+import queue
+import atexit
+import base64
+import hashlib
+import pathlib
+import threading
+from config import Config
+
+URL_PREFIX = '/uploads/checkin_faces'
+EVIDENCE_DIR = pathlib.Path(__file__).parent.absolute() / 'uploads' / 'checkin_faces'
+THUMB_DIR = EVIDENCE_DIR / 'thumbs'
+
+_CONTENT_NAME = re.compile(r'^/uploads/checkin_faces/([0-9a-f]{64})\.\w+$')
+
+
+def _extension(data):
+    """根据文件头判断图片格式"""
+    if data[:3] == b'\xff\xd8\xff':
+        return 'jpg'
+    if data[:8] == b'\x89PNG\r\n\x1a\n':
+        return 'png'
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return 'webp'
+    return None
+
+
+def thumb_url(image_url):
+    """签到截图对应的缩略图 URL，旧的（非内容寻址）截图没有缩略图，返回原 URL"""
+    if not image_url:
+        return image_url
+    match = _CONTENT_NAME.match(image_url)
+    return f'{URL_PREFIX}/thumbs/{match.group(1)}.webp' if match else image_url
+
+
+def find_original(digest):
+    """按内容哈希查找原图文件名（缩略图尚未生成时用原图代替）"""
+    for ext in ('jpg', 'png', 'webp'):
+        if (EVIDENCE_DIR / f'{digest}.{ext}').exists():
+            return f'{digest}.{ext}'
+    return None
+
+
+class EvidenceStore:
+    """
+    签到截图异步存储
+
+    - thumb_size: 缩略图长边（像素）
+    - thumb_quality: 缩略图 WebP 质量
+    - queue_size: 等待写入的图片上限，队列满时在请求中同步写入
+    """
+
+    def __init__(self, thumb_size=None, thumb_quality=None, queue_size=None):
+        self.thumb_size = thumb_size or Config.EVIDENCE_THUMB_SIZE
+        self.thumb_quality = thumb_quality or Config.EVIDENCE_THUMB_QUALITY
+        self._queue = queue.Queue(maxsize=queue_size or Config.EVIDENCE_QUEUE_SIZE)
+        self._lock = threading.Lock()
+        self._pending = set()  # 已入队未写完的文件名
+        self._thread = None
+
+        self._stored = 0
+        self._deduplicated = 0
+        self._inline = 0
+        self._errors = 0
+
+    def save(self, image):
+        """
+        保存一张签到截图
+
+        Args:
+            image: base64 字符串（可带 data: 前缀）或图片 bytes
+        Returns:
+            str: 原图 URL；不是 JPEG/PNG/WebP 图片时返回 None
+        """
+        data = image
+        if isinstance(image, str):
+            data = base64.b64decode(image.split(',')[1] if ',' in image else image)
+        ext = _extension(data)
+        if ext is None:
+            return None
+        filename = f'{hashlib.sha256(data).hexdigest()}.{ext}'
+
+        with self._lock:
+            duplicate = filename in self._pending or (EVIDENCE_DIR / filename).exists()
+            if duplicate:
+                self._deduplicated += 1
+            else:
+                self._pending.add(filename)
+        if not duplicate:
+            self._ensure_thread()
+            try:
+                self._queue.put_nowait((filename, data))
+            except queue.Full:
+                with self._lock:
+                    self._inline += 1
+                self._store(filename, data)
+        return f'{URL_PREFIX}/{filename}'
+
+    def _store(self, filename, data):
+        try:
+            EVIDENCE_DIR.mkdir(parents=True, exist_ok=True)
+            self._write_atomic(EVIDENCE_DIR / filename, data)
+            thumb = self._thumbnail(data)
+            if thumb is not None:
+                THUMB_DIR.mkdir(parents=True, exist_ok=True)
+                self._write_atomic(THUMB_DIR / f'{filename.rsplit(".", 1)[0]}.webp', thumb)
+            with self._lock:
+                self._stored += 1
+        except Exception as e:
+            with self._lock:
+                self._errors += 1
+            print(f'[签到截图] 保存 {filename} 失败: {e}')
+        finally:
+            with self._lock:
+                self._pending.discard(filename)
+
+    @staticmethod
+    def _write_atomic(path, data):
+        """先写临时文件再改名，读取方不会看到写了一半的文件"""
+        tmp = path.with_name(f'.{path.name}.tmp')
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+    def _thumbnail(self, data):
+        """生成 WebP 缩略图，解码失败返回 None"""
+        from face_service import decode_image
+        import cv2
+        img = decode_image(data, max_size=self.thumb_size)
+        if img is None:
+            return None
+        ok, encoded = cv2.imencode('.webp', img, [cv2.IMWRITE_WEBP_QUALITY, self.thumb_quality])
+        return encoded.tobytes() if ok else None
+
+    def _ensure_thread(self):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, daemon=True)
+                    self._thread.start()
+
+    def _run(self):
+        while True:
+            filename, data = self._queue.get()
+            try:
+                self._store(filename, data)
+            finally:
+                self._queue.task_done()
+
+    def drain(self):
+        """等待队列中的图片全部写完"""
+        if self._thread is not None:
+            self._queue.join()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'queued': self._queue.qsize(),
+                'stored': self._stored,
+                'deduplicated': self._deduplicated,
+                'inline': self._inline,
+                'errors': self._errors
+            }
+
+
+evidence_store = EvidenceStore()
+atexit.register(evidence_store.drain)
@@ -0,0 +1,171 @@
+"""
+人脸特征索引
+常驻内存的 L2 归一化特征矩阵，1:N 比对只需一次矩阵-向量乘法
+"""
+import time
+import threading
+import numpy as np
+from database import Database
+from config import Config
+from embedding_codec import decode_embedding
+
+
+def normalize(vec):
+    """L2 归一化，零向量原样返回"""
+    vec = np.asarray(vec, dtype=np.float32)
+    norm = np.linalg.norm(vec)
+    return vec / norm if norm > 0 else vec
+
+
+class FaceIndex:
+    """
+    人脸特征索引
+
+    特征按行存放在预分配的连续 float32 矩阵中，删除时用最后一行填补空位，
+    因此前 size 行始终是有效数据。余弦距离 = 1 - 归一化向量点积。
+    """
+
+    def __init__(self, dim=128, sync_interval=None):
+        self.dim = dim
+        self.sync_interval = Config.FACE_INDEX_SYNC_INTERVAL if sync_interval is None else sync_interval
+        self._matrix = np.empty((0, dim), dtype=np.float32)
+        self._user_ids = np.empty(0, dtype=np.int64)
+        self._rows = {}  # user_id -> 行号
+        self._size = 0
+        self._lock = threading.RLock()
+        self._loaded = False
+        self._last_sync = 0.0
+        self._synced_until = None  # 已同步到的 user_faces.updated_at
+
+    def __len__(self):
+        return self._size
+
+    def _grow(self, capacity):
+        matrix = np.empty((capacity, self.dim), dtype=np.float32)
+        user_ids = np.empty(capacity, dtype=np.int64)
+        matrix[:self._size] = self._matrix[:self._size]
+        user_ids[:self._size] = self._user_ids[:self._size]
+        self._matrix, self._user_ids = matrix, user_ids
+
+    def load(self, user_ids, embeddings):
+        """用给定数据整体替换索引"""
+        matrix = np.asarray(embeddings, dtype=np.float32).reshape(-1, self.dim)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1
+        with self._lock:
+            self._matrix = np.ascontiguousarray(matrix / norms)
+            self._user_ids = np.asarray(user_ids, dtype=np.int64)
+            self._size = len(self._user_ids)
+            self._rows = {int(uid): i for i, uid in enumerate(self._user_ids)}
+            self._loaded = True
+
+    def upsert(self, user_id, embedding):
+        """新增或更新一个用户的特征"""
+        vec = normalize(embedding)
+        if vec.shape != (self.dim,):
+            raise ValueError(f'特征维度不匹配: {vec.shape}, 期望 ({self.dim},)')
+        with self._lock:
+            row = self._rows.get(user_id)
+            if row is None:
+                if self._size == len(self._matrix):
+                    self._grow(max(64, self._size * 2))
+                row = self._size
+                self._size += 1
+                self._rows[user_id] = row
+                self._user_ids[row] = user_id
+            self._matrix[row] = vec
+
+    def remove(self, user_id):
+        """删除一个用户的特征"""
+        with self._lock:
+            row = self._rows.pop(user_id, None)
+            if row is None:
+                return
+            last = self._size - 1
+            if row != last:
+                self._matrix[row] = self._matrix[last]
+                moved = int(self._user_ids[last])
+                self._user_ids[row] = moved
+                self._rows[moved] = row
+            self._size = last
+
+    def get(self, user_id):
+        """获取某个用户的归一化特征，不存在返回 None"""
+        with self._lock:
+            row = self._rows.get(user_id)
+            return None if row is None else self._matrix[row].copy()
+
+    def search(self, embedding, k=5, max_distance=None):
+        """
+        查找最相近的 k 个用户
+
+        Args:
+            k: 返回数量，None 表示不限
+            max_distance: 只返回距离小于该值的用户（在取前 k 个之前过滤）
+
+        Returns:
+            list: [(user_id, cosine_distance)]，按距离升序
+        """
+        query = normalize(embedding)
+        with self._lock:
+            size = self._size
+            if size == 0:
+                return []
+            scores = self._matrix[:size] @ query
+            user_ids = self._user_ids[:size].copy()
+
+        rows = np.arange(size) if max_distance is None else np.flatnonzero(scores > 1 - max_distance)
+        if k is not None and k < len(rows):
+            rows = rows[np.argpartition(-scores[rows], k - 1)[:k]]
+        rows = rows[np.argsort(-scores[rows])]
+        return [(int(user_ids[i]), float(1 - scores[i])) for i in rows]
+
+    # ==================== 与数据库同步 ====================
+
+    def ensure_fresh(self):
+        """首次使用时全量加载，之后按间隔增量拉取其他进程写入的特征"""
+        if not self._loaded:
+            self.rebuild()
+        elif time.monotonic() - self._last_sync > self.sync_interval:
+            self.sync()
+
+    def rebuild(self):
+        """从 user_faces 全量重建索引"""
+        rows = Database.execute_query(
+            "SELECT user_id, face_embedding, updated_at FROM user_faces",
+            fetch_all=True
+        ) or []
+        user_ids, embeddings = [], []
+        for row in rows:
+            try:
+                vec = decode_embedding(row['face_embedding'])
+            except (ValueError, TypeError):
+                continue
+            if vec.shape == (self.dim,):
+                user_ids.append(row['user_id'])
+                embeddings.append(vec)
+        self.load(user_ids, embeddings)
+        self._synced_until = max((r['updated_at'] for r in rows if r['updated_at']), default=None)
+        self._last_sync = time.monotonic()
+        print(f'[人脸索引] 全量加载 {len(self)} 条人脸特征')
+
+    def sync(self):
+        """增量拉取 updated_at 之后变更的特征（删除由比对后的用户校验兜底）"""
+        self._last_sync = time.monotonic()
+        if self._synced_until is None:
+            self.rebuild()
+            return
+        rows = Database.execute_query(
+            "SELECT user_id, face_embedding, updated_at FROM user_faces WHERE updated_at >= %s",
+            (self._synced_until,), fetch_all=True
+        ) or []
+        for row in rows:
+            try:
+                self.upsert(row['user_id'], decode_embedding(row['face_embedding']))
+            except (ValueError, TypeError):
+                continue
+            if row['updated_at'] and row['updated_at'] > self._synced_until:
+                self._synced_until = row['updated_at']
+
+
+face_index = FaceIndex()
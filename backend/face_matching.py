@@ -0,0 +1,103 @@
+"""
+多人脸-多成员匹配
+合照点到时把检测到的人脸与群成员一次性匹配：
+归一化后一次矩阵乘法得到完整的距离矩阵，再做全局分配，保证一名学生只会被一张人脸认领。
+"""
+import numpy as np
+
+# 超过阈值的配对在分配时使用的代价，保证不会优先于任何有效配对
+_INVALID_COST = 1e6
+
+
+def _normalize_rows(matrix):
+    matrix = np.asarray(matrix, dtype=np.float32)
+    if matrix.ndim == 1:
+        matrix = matrix.reshape(1, -1)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return matrix / norms
+
+
+def distance_matrix(faces, members):
+    """faces (F, d) 与 members (M, d) 的余弦距离矩阵 (F, M)"""
+    return 1 - _normalize_rows(faces) @ _normalize_rows(members).T
+
+
+def _assign_hungarian(distances, threshold):
+    from scipy.optimize import linear_sum_assignment
+    cost = np.where(distances < threshold, distances, _INVALID_COST)
+    rows, cols = linear_sum_assignment(cost)
+    return [(int(r), int(c)) for r, c in zip(rows, cols) if distances[r, c] < threshold]
+
+
+def _assign_greedy(distances, threshold):
+    """按距离从小到大依次分配，人脸和成员各只使用一次"""
+    faces, members = np.nonzero(distances < threshold)
+    order = np.argsort(distances[faces, members], kind='stable')
+    used_faces, used_members, pairs = set(), set(), []
+    for i in order:
+        f, m = int(faces[i]), int(members[i])
+        if f in used_faces or m in used_members:
+            continue
+        used_faces.add(f)
+        used_members.add(m)
+        pairs.append((f, m))
+    return pairs
+
+
+def match_faces(face_embeddings, member_ids, member_embeddings, threshold, method='hungarian'):
+    """
+    全局匹配人脸与成员
+
+    Args:
+        face_embeddings: 检测到的人脸特征 (F, d)
+        member_ids: 成员 user_id 列表，与 member_embeddings 行对应
+        member_embeddings: 成员特征 (M, d)
+        threshold: 余弦距离阈值，达到阈值的配对不会被采用
+        method: hungarian（总距离最小）/ greedy（按分数贪心）
+
+    Returns:
+        list: 每张人脸一项，按人脸顺序:
+            face_index, user_id（未匹配为 None）, distance, similarity（百分比）,
+            margin（与该人脸次优候选的距离差，越大越可信）
+    """
+    face_count = len(face_embeddings)
+    if face_count == 0:
+        return []
+    if len(member_ids) == 0:
+        return [{'face_index': i, 'user_id': None, 'distance': None, 'similarity': None, 'margin': None}
+                for i in range(face_count)]
+
+    distances = distance_matrix(face_embeddings, member_embeddings)
+    if method == 'greedy':
+        pairs = _assign_greedy(distances, threshold)
+    else:
+        pairs = _assign_hungarian(distances, threshold)
+    assigned = dict(pairs)
+
+    # 每张人脸的最优/次优距离，用于未匹配人脸的参考分数和匹配置信度
+    if distances.shape[1] > 1:
+        nearest = np.partition(distances, 1, axis=1)[:, :2]
+        best, second = nearest.min(axis=1), nearest.max(axis=1)
+    else:
+        best, second = distances[:, 0], np.full(face_count, np.nan)
+
+    results = []
+    for f in range(face_count):
+        m = assigned.get(f)
+        distance = float(distances[f, m]) if m is not None else float(best[f])
+        if m is None:
+            margin = None
+        elif distance == float(best[f]):
+            margin = float(second[f] - distance) if not np.isnan(second[f]) else None
+        else:
+            # 最优候选被其他人脸占用，置信度为负差值
+            margin = float(best[f] - distance)
+        results.append({
+            'face_index': f,
+            'user_id': member_ids[m] if m is not None else None,
+            'distance': round(distance, 4),
+            'similarity': round((1 - distance) * 100, 1),
+            'margin': round(margin, 4) if margin is not None else None
+        })
+    return results
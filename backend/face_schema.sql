@@ -3,7 +3,7 @@ CREATE TABLE IF NOT EXISTS user_faces (
     face_id INT PRIMARY KEY AUTO_INCREMENT,
     user_id INT NOT NULL UNIQUE,
     face_image_path VARCHAR(500),
-    face_embedding TEXT NOT NULL COMMENT '人脸特征向量JSON',
+    face_embedding BLOB NOT NULL COMMENT '人脸特征向量（二进制或旧版JSON）',
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
     FOREIGN KEY (user_id) REFERENCES users(user_id) ON DELETE CASCADE
@@ -4,8 +4,10 @@
 使用 MediaPipe 进行活体检测（眨眼、转头）
 """
 import os
-import json
+import queue
 import base64
+import threading
+from contextlib import contextmanager
 import numpy as np
 from PIL import Image
 from io import BytesIO
@@ -13,6 +15,10 @@ from datetime import datetime
 from werkzeug.utils import secure_filename
 from database import Database
 from config import Config
+from face_index import face_index, normalize
+from embedding_codec import encode_embedding
+from face_worker import get_inference_pool, run_represent, run_represent_batch, run_detect, EmbeddingBatcher, InferenceBusyError
+from face_tiling import detect_tiled, crop_faces, run_bounded
 
 # 延迟导入
 _deepface = None
@@ -37,6 +43,198 @@ def get_mediapipe():
     return _mp_face_mesh, _mp_drawing
 
 
+def decode_image(source, max_size=None):
+    """
+    所有人脸接口共用的图片解码入口
+
+    source 可以是 base64 字符串（可带 data: 前缀）、上传文件对象、bytes 或已解码的数组，
+    统一解码为 BGR numpy 数组（DeepFace 对数组输入按 BGR 处理，与读取文件时一致），
+    全程在内存中完成，不落盘。OpenCV 无法解码的格式（GIF）改用 PIL 解码。
+    max_size 指定时按长边等比缩小。解码失败返回 None。
+    """
+    import cv2
+    if isinstance(source, np.ndarray):
+        img = source
+    else:
+        if isinstance(source, str):
+            data = base64.b64decode(source.split(',')[1] if ',' in source else source)
+        elif isinstance(source, (bytes, bytearray)):
+            data = source
+        else:
+            data = source.read()
+        img = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+        if img is None:
+            img = _decode_with_pil(data)
+        if img is None:
+            return None
+
+    if max_size:
+        h, w = img.shape[:2]
+        scale = max_size / max(h, w)
+        if scale < 1:
+            img = cv2.resize(img, (int(w * scale), int(h * scale)), interpolation=cv2.INTER_AREA)
+    return img
+
+
+def _decode_with_pil(data):
+    """OpenCV 不支持的格式（如上传允许的 GIF，取第一帧）用 PIL 解码为 BGR 数组，失败返回 None"""
+    try:
+        with Image.open(BytesIO(data)) as image:
+            rgb = np.asarray(image.convert('RGB'))
+    except Exception:
+        return None
+    return np.ascontiguousarray(rgb[:, :, ::-1])
+
+
+class FaceMeshPool:
+    """
+    FaceMesh 实例池
+
+    创建 FaceMesh 需要加载模型并构建计算图，代价远大于处理一帧。
+    池中实例跨请求复用，使用 static_image_mode 避免不同用户的帧之间共享跟踪状态。
+    queue.Queue 在 gevent monkey patch 后是协程安全的。
+    """
+
+    def __init__(self, size=None):
+        self.size = size or Config.FACE_MESH_POOL_SIZE
+        self._idle = queue.Queue()
+        self._lock = threading.Lock()
+        self._created = 0
+
+    def _create(self):
+        mp_face_mesh, _ = get_mediapipe()
+        return mp_face_mesh.FaceMesh(
+            static_image_mode=True,
+            max_num_faces=1,
+            refine_landmarks=True,
+            min_detection_confidence=0.5
+        )
+
+    def warm_up(self, count=None):
+        """预先创建实例"""
+        for _ in range(min(count or self.size, self.size)):
+            with self._lock:
+                if self._created >= self.size:
+                    return
+                self._created += 1
+            self._idle.put(self._create())
+
+    @contextmanager
+    def acquire(self, timeout=10):
+        """借出一个 FaceMesh 实例"""
+        try:
+            face_mesh = self._idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                can_create = self._created < self.size
+                if can_create:
+                    self._created += 1
+            if can_create:
+                try:
+                    face_mesh = self._create()
+                except Exception:
+                    with self._lock:
+                        self._created -= 1
+                    raise
+            else:
+                face_mesh = self._idle.get(timeout=timeout)
+        try:
+            yield face_mesh
+        finally:
+            self._idle.put(face_mesh)
+
+
+face_mesh_pool = FaceMeshPool()
+
+# 特征提取微批处理器（首次使用时创建）
+_embedding_batcher = None
+
+
+class ModelWarmup:
+    """
+    启动时预加载模型
+
+    依次加载 Facenet + RetinaFace（推理进程池或当前进程）和 FaceMesh，并各跑一次空白图片推理，
+    完成权重加载和计算图构建。ready 标志由 /api/health 上报，负载均衡据此决定是否转发流量。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.state = 'idle'  # idle / warming / ready / failed
+        self.started_at = None
+        self.finished_at = None
+        self.steps = {}
+        self.error = None
+
+    @property
+    def ready(self):
+        return self.state == 'ready'
+
+    def _step(self, name, func):
+        start = datetime.now()
+        func()
+        self.steps[name] = round((datetime.now() - start).total_seconds(), 2)
+
+    def _warm_deepface(self):
+        pool = get_inference_pool(FaceService.MODEL_NAME, FaceService.DETECTOR_BACKEND)
+        if pool:
+            # 推理进程启动时自行预加载，这里只等待全部进程就绪
+            pool.start()
+            if not pool.wait_ready(timeout=Config.FACE_WARMUP_TIMEOUT):
+                raise RuntimeError('推理进程预加载超时')
+            return
+        get_deepface()
+        dummy = np.zeros((160, 160, 3), dtype=np.uint8)
+        run_represent(dummy, FaceService.MODEL_NAME, FaceService.DETECTOR_BACKEND, enforce_detection=False)
+
+    def _warm_face_mesh(self):
+        face_mesh_pool.warm_up()
+        LivenessDetector.get_landmarks(np.zeros((480, 640, 3), dtype=np.uint8))
+
+    def run(self):
+        """执行预加载（阻塞），重复调用直接返回当前状态"""
+        with self._lock:
+            if self.state in ('warming', 'ready'):
+                return self.ready
+            self.state = 'warming'
+            self.started_at = datetime.now()
+            self.error = None
+
+        print('[模型预加载] 开始...')
+        try:
+            self._step('deepface', self._warm_deepface)
+            self._step('face_mesh', self._warm_face_mesh)
+        except Exception as e:
+            self.error = str(e)
+            self.state = 'failed'
+            print(f'[模型预加载] 失败: {e}')
+        else:
+            self.state = 'ready'
+            print(f'[模型预加载] 完成: {self.steps}')
+        self.finished_at = datetime.now()
+        return self.ready
+
+    def start(self):
+        """在后台线程中预加载，服务可以先启动并通过 /api/health 报告未就绪"""
+        thread = threading.Thread(target=self.run, daemon=True)
+        thread.start()
+        return thread
+
+    def status(self):
+        return {
+            'enabled': Config.FACE_WARMUP,
+            'state': self.state,
+            'ready': self.ready,
+            'steps': self.steps,
+            'error': self.error,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None
+        }
+
+
+model_warmup = ModelWarmup()
+
+
 class LivenessDetector:
     """活体检测器 - 检测眨眼和转头动作"""
     
@@ -60,57 +258,78 @@ class LivenessDetector:
         ear = (v1 + v2) / (2.0 * h) if h > 0 else 0
         return ear
     
+    @staticmethod
+    def decode_frame(frame_data):
+        """解码 base64 帧为 BGR 图像，已是图像时原样返回"""
+        return decode_image(frame_data)
+    
+    @staticmethod
+    def get_landmarks(frame):
+        """对一帧运行一次 FaceMesh，返回第一张人脸的关键点，未检测到返回 None"""
+        import cv2
+        rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+        with face_mesh_pool.acquire() as face_mesh:
+            results = face_mesh.process(rgb_frame)
+        if not results.multi_face_landmarks:
+            return None
+        return results.multi_face_landmarks[0].landmark
+    
+    @staticmethod
+    def blink_from_landmarks(landmarks, w, h):
+        """根据关键点计算双眼 EAR"""
+        # 获取眼睛关键点坐标
+        left_eye = [(landmarks[i].x * w, landmarks[i].y * h) for i in LivenessDetector.LEFT_EYE]
+        right_eye = [(landmarks[i].x * w, landmarks[i].y * h) for i in LivenessDetector.RIGHT_EYE]
+        
+        # 计算双眼EAR
+        left_ear = LivenessDetector.calculate_ear(left_eye)
+        right_ear = LivenessDetector.calculate_ear(right_eye)
+        avg_ear = (left_ear + right_ear) / 2
+        
+        return {
+            'ear': round(avg_ear, 3),
+            'is_blink': bool(avg_ear < LivenessDetector.EAR_THRESHOLD)
+        }
+    
+    @staticmethod
+    def head_pose_from_landmarks(landmarks):
+        """根据关键点判断头部朝向"""
+        # 使用鼻尖和脸部两侧点计算头部朝向
+        nose_tip = landmarks[1]  # 鼻尖
+        left_face = landmarks[234]  # 左脸
+        right_face = landmarks[454]  # 右脸
+        
+        # 计算鼻尖相对于脸部中心的偏移
+        face_center_x = (left_face.x + right_face.x) / 2
+        nose_offset = nose_tip.x - face_center_x
+        
+        # 判断方向
+        if nose_offset < -LivenessDetector.HEAD_TURN_THRESHOLD:
+            direction = 'left'
+        elif nose_offset > LivenessDetector.HEAD_TURN_THRESHOLD:
+            direction = 'right'
+        else:
+            direction = 'center'
+        
+        return {
+            'direction': direction,
+            'offset': round(nose_offset, 3)
+        }
+    
     @staticmethod
     def detect_blink(frame_data):
         """检测眨眼动作"""
         try:
-            mp_face_mesh, _ = get_mediapipe()
-            import cv2
-            
-            # 解码图片
-            if isinstance(frame_data, str):
-                # base64 字符串
-                img_data = base64.b64decode(frame_data.split(',')[1] if ',' in frame_data else frame_data)
-                nparr = np.frombuffer(img_data, np.uint8)
-                frame = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-            else:
-                frame = frame_data
-            
+            frame = LivenessDetector.decode_frame(frame_data)
             if frame is None:
                 return {'detected': False, 'ear': 0}
             
-            rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+            landmarks = LivenessDetector.get_landmarks(frame)
+            if landmarks is None:
+                return {'detected': False, 'ear': 0, 'message': '未检测到人脸'}
             
-            with mp_face_mesh.FaceMesh(
-                max_num_faces=1,
-                refine_landmarks=True,
-                min_detection_confidence=0.5,
-                min_tracking_confidence=0.5
-            ) as face_mesh:
-                results = face_mesh.process(rgb_frame)
-                
-                if not results.multi_face_landmarks:
-                    return {'detected': False, 'ear': 0, 'message': '未检测到人脸'}
-                
-                landmarks = results.multi_face_landmarks[0].landmark
-                h, w = frame.shape[:2]
-                
-                # 获取眼睛关键点坐标
-                left_eye = [(landmarks[i].x * w, landmarks[i].y * h) for i in LivenessDetector.LEFT_EYE]
-                right_eye = [(landmarks[i].x * w, landmarks[i].y * h) for i in LivenessDetector.RIGHT_EYE]
-                
-                # 计算双眼EAR
-                left_ear = LivenessDetector.calculate_ear(left_eye)
-                right_ear = LivenessDetector.calculate_ear(right_eye)
-                avg_ear = (left_ear + right_ear) / 2
-                
-                is_blink = avg_ear < LivenessDetector.EAR_THRESHOLD
-                
-                return {
-                    'detected': True,
-                    'ear': round(avg_ear, 3),
-                    'is_blink': is_blink
-                }
+            h, w = frame.shape[:2]
+            return {'detected': True, **LivenessDetector.blink_from_landmarks(landmarks, w, h)}
         except Exception as e:
             return {'detected': False, 'ear': 0, 'error': str(e)}
     
@@ -118,58 +337,38 @@ class LivenessDetector:
     def detect_head_pose(frame_data):
         """检测头部姿态（左右转头）"""
         try:
-            mp_face_mesh, _ = get_mediapipe()
-            import cv2
-            
-            # 解码图片
-            if isinstance(frame_data, str):
-                img_data = base64.b64decode(frame_data.split(',')[1] if ',' in frame_data else frame_data)
-                nparr = np.frombuffer(img_data, np.uint8)
-                frame = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-            else:
-                frame = frame_data
-            
+            frame = LivenessDetector.decode_frame(frame_data)
             if frame is None:
                 return {'detected': False, 'direction': 'unknown'}
             
-            rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+            landmarks = LivenessDetector.get_landmarks(frame)
+            if landmarks is None:
+                return {'detected': False, 'direction': 'unknown', 'message': '未检测到人脸'}
             
-            with mp_face_mesh.FaceMesh(
-                max_num_faces=1,
-                refine_landmarks=True,
-                min_detection_confidence=0.5
-            ) as face_mesh:
-                results = face_mesh.process(rgb_frame)
-                
-                if not results.multi_face_landmarks:
-                    return {'detected': False, 'direction': 'unknown', 'message': '未检测到人脸'}
-                
-                landmarks = results.multi_face_landmarks[0].landmark
-                
-                # 使用鼻尖和脸部两侧点计算头部朝向
-                nose_tip = landmarks[1]  # 鼻尖
-                left_face = landmarks[234]  # 左脸
-                right_face = landmarks[454]  # 右脸
-                
-                # 计算鼻尖相对于脸部中心的偏移
-                face_center_x = (left_face.x + right_face.x) / 2
-                nose_offset = nose_tip.x - face_center_x
-                
-                # 判断方向
-                if nose_offset < -LivenessDetector.HEAD_TURN_THRESHOLD:
-                    direction = 'left'
-                elif nose_offset > LivenessDetector.HEAD_TURN_THRESHOLD:
-                    direction = 'right'
-                else:
-                    direction = 'center'
-                
-                return {
-                    'detected': True,
-                    'direction': direction,
-                    'offset': round(nose_offset, 3)
-                }
+            return {'detected': True, **LivenessDetector.head_pose_from_landmarks(landmarks)}
         except Exception as e:
             return {'detected': False, 'direction': 'unknown', 'error': str(e)}
+    
+    @staticmethod
+    def analyze_frame(frame_data):
+        """一次解码、一次 FaceMesh 同时计算眨眼和头部姿态"""
+        try:
+            frame = LivenessDetector.decode_frame(frame_data)
+            if frame is None:
+                return {'detected': False, 'ear': 0, 'direction': 'unknown'}
+            
+            landmarks = LivenessDetector.get_landmarks(frame)
+            if landmarks is None:
+                return {'detected': False, 'ear': 0, 'direction': 'unknown', 'message': '未检测到人脸'}
+            
+            h, w = frame.shape[:2]
+            return {
+                'detected': True,
+                **LivenessDetector.blink_from_landmarks(landmarks, w, h),
+                **LivenessDetector.head_pose_from_landmarks(landmarks)
+            }
+        except Exception as e:
+            return {'detected': False, 'ear': 0, 'direction': 'unknown', 'error': str(e)}
 
 
 class FaceService:
@@ -187,18 +386,13 @@ class FaceService:
         os.makedirs(FaceService.FACE_FOLDER, exist_ok=True)
     
     @staticmethod
-    def save_face_image(image_file, user_id):
-        """保存人脸图片"""
+    def save_face_image(img, user_id):
+        """保存人脸图片（已解码并缩放的 BGR 数组）"""
+        import cv2
         FaceService.init_folders()
         filename = secure_filename(f"face_{user_id}_{datetime.now().strftime('%Y%m%d%H%M%S')}.jpg")
         filepath = os.path.join(FaceService.FACE_FOLDER, filename)
-        
-        # 压缩并保存图片
-        img = Image.open(image_file)
-        img = img.convert('RGB')
-        img.thumbnail((640, 640))
-        img.save(filepath, 'JPEG', quality=90)
-        
+        cv2.imwrite(filepath, img, [cv2.IMWRITE_JPEG_QUALITY, 90])
         return filepath
     
     @staticmethod
@@ -214,17 +408,61 @@ class FaceService:
             return None
     
     @staticmethod
-    def extract_face_embedding(image_path):
-        """提取人脸特征向量"""
+    def represent(img_path, enforce_detection=True):
+        """
+        运行 DeepFace 特征提取
+
+        配置了推理进程池时在池中执行，否则在当前进程执行。
+        进程池已满时抛出 InferenceBusyError，由路由层返回 503。
+        """
+        pool = get_inference_pool(FaceService.MODEL_NAME, FaceService.DETECTOR_BACKEND)
+        if pool:
+            return pool.run('represent', img_path=img_path, model_name=FaceService.MODEL_NAME,
+                            detector_backend=FaceService.DETECTOR_BACKEND,
+                            enforce_detection=enforce_detection)
+        return run_represent(img_path, FaceService.MODEL_NAME, FaceService.DETECTOR_BACKEND, enforce_detection)
+
+    @staticmethod
+    def represent_batch(images, enforce_detection=True):
+        """批量提取特征，返回与 images 一一对应的 ('ok', embedding_objs) / ('error', message)"""
+        pool = get_inference_pool(FaceService.MODEL_NAME, FaceService.DETECTOR_BACKEND)
+        if pool:
+            return pool.run('represent_batch', images=images, model_name=FaceService.MODEL_NAME,
+                            detector_backend=FaceService.DETECTOR_BACKEND,
+                            enforce_detection=enforce_detection)
+        return run_represent_batch(images, FaceService.MODEL_NAME, FaceService.DETECTOR_BACKEND, enforce_detection)
+
+    @staticmethod
+    def detect(img):
+        """只检测人脸框，不提取特征"""
+        pool = get_inference_pool(FaceService.MODEL_NAME, FaceService.DETECTOR_BACKEND)
+        if pool:
+            return pool.run('detect', img=img, detector_backend=FaceService.DETECTOR_BACKEND)
+        return run_detect(img, FaceService.DETECTOR_BACKEND)
+
+    @staticmethod
+    def represent_batched(img):
+        """
+        经微批处理提取单张图片特征
+
+        签到高峰时同一时间窗口内的请求合并为一批推理，FACE_BATCH_WINDOW_MS=0 时直接逐张提取。
+        """
+        global _embedding_batcher
+        if Config.FACE_BATCH_WINDOW_MS <= 0:
+            return FaceService.represent(img)
+        if _embedding_batcher is None:
+            _embedding_batcher = EmbeddingBatcher(FaceService.represent_batch)
+        return _embedding_batcher.submit(img)
+
+    @staticmethod
+    def batch_stats():
+        return _embedding_batcher.stats() if _embedding_batcher else None
+    
+    @staticmethod
+    def extract_face_embedding(img):
+        """提取人脸特征向量，img 为 BGR 数组或图片路径"""
         try:
-            DeepFace = get_deepface()
-            
-            embedding_objs = DeepFace.represent(
-                img_path=image_path,
-                model_name=FaceService.MODEL_NAME,
-                enforce_detection=True,
-                detector_backend=FaceService.DETECTOR_BACKEND
-            )
+            embedding_objs = FaceService.represent(img)
             
             if not embedding_objs:
                 return {'success': False, 'message': '未检测到人脸'}
@@ -237,6 +475,8 @@ class FaceService:
                 'face_count': len(embedding_objs)
             }
             
+        except InferenceBusyError:
+            raise
         except Exception as e:
             error_msg = str(e)
             if 'Face could not be detected' in error_msg:
@@ -247,28 +487,12 @@ class FaceService:
     def extract_embedding_from_base64(base64_str):
         """从 base64 图片提取特征"""
         try:
-            import cv2
-            DeepFace = get_deepface()
-            
-            # 解码 base64
-            if ',' in base64_str:
-                base64_str = base64_str.split(',')[1]
-            img_data = base64.b64decode(base64_str)
-            nparr = np.frombuffer(img_data, np.uint8)
-            img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+            img = decode_image(base64_str)
             
             if img is None:
                 return {'success': False, 'message': '图片解码失败'}
             
-            # 转换为 RGB
-            img_rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-            
-            embedding_objs = DeepFace.represent(
-                img_path=img_rgb,
-                model_name=FaceService.MODEL_NAME,
-                enforce_detection=True,
-                detector_backend=FaceService.DETECTOR_BACKEND
-            )
+            embedding_objs = FaceService.represent_batched(img)
             
             if not embedding_objs:
                 return {'success': False, 'message': '未检测到人脸'}
@@ -277,6 +501,8 @@ class FaceService:
                 'success': True,
                 'embedding': embedding_objs[0]['embedding']
             }
+        except InferenceBusyError:
+            raise
         except Exception as e:
             error_msg = str(e)
             if 'Face could not be detected' in error_msg:
@@ -287,17 +513,18 @@ class FaceService:
     def register_face(user_id, image_file):
         """注册用户人脸"""
         try:
-            # 保存图片
-            image_path = FaceService.save_face_image(image_file, user_id)
+            img = decode_image(image_file, max_size=640)
+            if img is None:
+                return {'success': False, 'message': '图片解码失败'}
             
-            # 提取特征
-            result = FaceService.extract_face_embedding(image_path)
+            # 提取特征，成功后再保存图片
+            result = FaceService.extract_face_embedding(img)
             
             if not result['success']:
-                if os.path.exists(image_path):
-                    os.remove(image_path)
                 return result
             
+            image_path = FaceService.save_face_image(img, user_id)
+            
             embedding = result['embedding']
             
             # 检查是否已有人脸数据
@@ -310,16 +537,20 @@ class FaceService:
                     SET face_image_path = %s, face_embedding = %s, updated_at = NOW()
                     WHERE user_id = %s
                 """
-                Database.execute_query(update_sql, (image_path, json.dumps(embedding), user_id), commit=True)
+                Database.execute_query(update_sql, (image_path, encode_embedding(embedding), user_id), commit=True)
             else:
                 insert_sql = """
                     INSERT INTO user_faces (user_id, face_image_path, face_embedding)
                     VALUES (%s, %s, %s)
                 """
-                Database.execute_query(insert_sql, (user_id, image_path, json.dumps(embedding)), commit=True)
-            
+                Database.execute_query(insert_sql, (user_id, image_path, encode_embedding(embedding)), commit=True)
+
+            face_index.upsert(user_id, embedding)
+
             return {'success': True, 'message': '人脸信息录入成功'}
             
+        except InferenceBusyError:
+            raise
         except Exception as e:
             return {'success': False, 'message': f'人脸录入失败: {str(e)}'}
     
@@ -340,60 +571,16 @@ class FaceService:
             if not liveness_data.get('head_turn_detected'):
                 return {'success': False, 'message': '活体检测失败：未检测到转头动作'}
             
-            # 提取人脸特征
-            result = FaceService.extract_embedding_from_base64(face_image_base64)
-            
+            # 提取人脸特征并在索引中查找
+            from face_verifier import face_verifier
+            result = face_verifier.identify(face_image_base64)
             if not result['success']:
-                return result
-            
-            verify_embedding = np.array(result['embedding'])
-            
-            # 查询数据库中的人脸数据
-            sql = """
-                SELECT uf.user_id, uf.face_embedding, u.email, u.real_name, u.system_account, r.role_name
-                FROM user_faces uf
-                JOIN users u ON uf.user_id = u.user_id
-                JOIN roles r ON u.role_id = r.role_id
-                WHERE u.is_active = TRUE AND u.is_verified = TRUE
-            """
-            faces = Database.execute_query(sql, fetch_all=True)
-            
-            if not faces:
-                return {'success': False, 'message': '未找到已注册的人脸信息'}
-            
-            # 比对人脸
-            best_match = None
-            best_distance = float('inf')
-            
-            for face in faces:
-                stored_embedding = np.array(json.loads(face['face_embedding']))
-                distance = FaceService.cosine_distance(verify_embedding, stored_embedding)
-                
-                if distance < best_distance:
-                    best_distance = distance
-                    best_match = face
-            
-            # 判断是否匹配
-            if best_distance < FaceService.THRESHOLD:
-                similarity = (1 - best_distance) * 100
-                return {
-                    'success': True,
-                    'matched': True,
-                    'user_id': best_match['user_id'],
-                    'email': best_match['email'],
-                    'real_name': best_match['real_name'],
-                    'system_account': best_match['system_account'],
-                    'role_name': best_match['role_name'],
-                    'similarity': round(similarity, 2),
-                    'message': '人脸验证成功'
-                }
-            else:
-                return {
-                    'success': True,
-                    'matched': False,
-                    'message': '人脸验证失败，未找到匹配的用户'
-                }
+                return {'success': False, 'message': result['message']}
+
+            return FaceService.resolve_candidates(result['candidates'])
                 
+        except InferenceBusyError:
+            raise
         except Exception as e:
             return {'success': False, 'message': f'人脸验证失败: {str(e)}'}
     
@@ -401,81 +588,98 @@ class FaceService:
     def verify_face(image_file, user_id=None):
         """验证人脸（兼容旧接口）"""
         try:
-            FaceService.init_folders()
-            temp_filename = f"temp_verify_{datetime.now().strftime('%Y%m%d%H%M%S%f')}.jpg"
-            temp_path = os.path.join(FaceService.FACE_FOLDER, temp_filename)
-            
-            img = Image.open(image_file)
-            img = img.convert('RGB')
-            img.thumbnail((640, 640))
-            img.save(temp_path, 'JPEG', quality=90)
-            
-            result = FaceService.extract_face_embedding(temp_path)
-            
-            if os.path.exists(temp_path):
-                os.remove(temp_path)
-            
-            if not result['success']:
-                return result
-            
-            verify_embedding = np.array(result['embedding'])
-            
+            from face_verifier import face_verifier
             if user_id:
-                sql = """
-                    SELECT uf.user_id, uf.face_embedding, u.email, u.real_name, u.system_account, r.role_name
-                    FROM user_faces uf
-                    JOIN users u ON uf.user_id = u.user_id
-                    JOIN roles r ON u.role_id = r.role_id
-                    WHERE uf.user_id = %s AND u.is_active = TRUE
-                """
-                faces = Database.execute_query(sql, (user_id,), fetch_all=True)
+                result = face_verifier.verify(user_id, image_file)
+                if result.get('reason') == 'not_registered':
+                    return {'success': False, 'message': '未找到已注册的人脸信息'}
+                if not result['success']:
+                    return {'success': False, 'message': result['message']}
+                candidates = [result] if result['matched'] else []
             else:
-                sql = """
-                    SELECT uf.user_id, uf.face_embedding, u.email, u.real_name, u.system_account, r.role_name
-                    FROM user_faces uf
-                    JOIN users u ON uf.user_id = u.user_id
-                    JOIN roles r ON u.role_id = r.role_id
-                    WHERE u.is_active = TRUE AND u.is_verified = TRUE
-                """
-                faces = Database.execute_query(sql, fetch_all=True)
-            
-            if not faces:
-                return {'success': False, 'message': '未找到已注册的人脸信息'}
-            
-            best_match = None
-            best_distance = float('inf')
-            
-            for face in faces:
-                stored_embedding = np.array(json.loads(face['face_embedding']))
-                distance = FaceService.cosine_distance(verify_embedding, stored_embedding)
-                
-                if distance < best_distance:
-                    best_distance = distance
-                    best_match = face
-            
-            if best_distance < FaceService.THRESHOLD:
-                similarity = (1 - best_distance) * 100
-                return {
-                    'success': True,
-                    'matched': True,
-                    'user_id': best_match['user_id'],
-                    'email': best_match['email'],
-                    'real_name': best_match['real_name'],
-                    'system_account': best_match['system_account'],
-                    'role_name': best_match['role_name'],
-                    'similarity': round(similarity, 2),
-                    'message': '人脸验证成功'
-                }
-            else:
-                return {
-                    'success': True,
-                    'matched': False,
-                    'message': '人脸验证失败，未找到匹配的用户'
-                }
+                result = face_verifier.identify(image_file)
+                if not result['success']:
+                    return {'success': False, 'message': result['message']}
+                candidates = result['candidates']
+
+            return FaceService.resolve_candidates(candidates, user_id)
                 
+        except InferenceBusyError:
+            raise
         except Exception as e:
             return {'success': False, 'message': f'人脸验证失败: {str(e)}'}
     
+    @staticmethod
+    def match_embedding(embedding, user_id=None):
+        """
+        在人脸索引中比对特征
+
+        Args:
+            embedding: 待验证的人脸特征
+            user_id: 指定时只与该用户比对（1:1），否则在全部用户中查找（1:N）
+        """
+        from face_verifier import face_verifier
+
+        if user_id:
+            stored = face_verifier.stored_embedding(user_id)
+            if stored is None:
+                return {'success': False, 'message': '未找到已注册的人脸信息'}
+            distance = float(1 - normalize(np.asarray(embedding, dtype=np.float32)) @ stored)
+            candidates = [{'user_id': user_id, 'distance': distance}] if distance < FaceService.THRESHOLD else []
+        else:
+            candidates = face_verifier.search(embedding)
+
+        return FaceService.resolve_candidates(candidates, user_id)
+
+    @staticmethod
+    def resolve_candidates(candidates, user_id=None):
+        """
+        从低于阈值的候选者（按距离升序）中取第一个状态有效的用户
+
+        候选者按距离顺序每 FACE_INDEX_TOP_K 个查询一次账号状态，前面的候选者都无效时继续查询后面的。
+
+        Args:
+            candidates: [{user_id, distance, ...}]
+            user_id: 1:1 验证时传入，不要求账号已认证
+        """
+        chunk = max(Config.FACE_INDEX_TOP_K, 1)
+        for offset in range(0, len(candidates), chunk):
+            batch = candidates[offset:offset + chunk]
+            placeholders = ','.join(['%s'] * len(batch))
+            sql = f"""
+                SELECT uf.user_id, u.email, u.real_name, u.system_account, r.role_name
+                FROM user_faces uf
+                JOIN users u ON uf.user_id = u.user_id
+                JOIN roles r ON u.role_id = r.role_id
+                WHERE uf.user_id IN ({placeholders}) AND u.is_active = TRUE
+            """
+            if not user_id:
+                sql += " AND u.is_verified = TRUE"
+            users = Database.execute_query(sql, tuple(c['user_id'] for c in batch), fetch_all=True)
+            users = {u['user_id']: u for u in users}
+
+            for candidate in batch:
+                best_match = users.get(candidate['user_id'])
+                if best_match:
+                    similarity = (1 - candidate['distance']) * 100
+                    return {
+                        'success': True,
+                        'matched': True,
+                        'user_id': best_match['user_id'],
+                        'email': best_match['email'],
+                        'real_name': best_match['real_name'],
+                        'system_account': best_match['system_account'],
+                        'role_name': best_match['role_name'],
+                        'similarity': round(similarity, 2),
+                        'message': '人脸验证成功'
+                    }
+
+        return {
+            'success': True,
+            'matched': False,
+            'message': '人脸验证失败，未找到匹配的用户'
+        }
+
     @staticmethod
     def cosine_distance(embedding1, embedding2):
         """计算余弦距离"""
@@ -496,41 +700,67 @@ class FaceService:
             list: 所有检测到的人脸特征向量列表
         """
         try:
-            DeepFace = get_deepface()
-            import cv2
+            if Config.FACE_TILED_DETECTION and max(img.shape[:2]) > Config.FACE_TILE_SIZE:
+                return FaceService.detect_all_faces_tiled(img)
             
-            # 转换为 RGB
-            img_rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+            # 直接传入 BGR 数组，不强制检测，允许检测多张脸
+            embedding_objs = FaceService.represent(img, enforce_detection=False)
             
-            # 保存临时文件（DeepFace 需要文件路径）
-            import tempfile
-            with tempfile.NamedTemporaryFile(suffix='.jpg', delete=False) as tmp:
-                tmp_path = tmp.name
-                cv2.imwrite(tmp_path, img)
-            
-            try:
-                # 提取所有人脸的特征
-                embedding_objs = DeepFace.represent(
-                    img_path=tmp_path,
-                    model_name=FaceService.MODEL_NAME,
-                    enforce_detection=False,  # 不强制检测，允许检测多张脸
-                    detector_backend=FaceService.DETECTOR_BACKEND
-                )
-                
-                embeddings = [obj['embedding'] for obj in embedding_objs if obj.get('embedding')]
-                print(f'[detect_all_faces] 检测到 {len(embeddings)} 张人脸')
-                return embeddings
-            finally:
-                # 删除临时文件
-                if os.path.exists(tmp_path):
-                    os.remove(tmp_path)
+            embeddings = [obj['embedding'] for obj in embedding_objs if obj.get('embedding')]
+            print(f'[detect_all_faces] 检测到 {len(embeddings)} 张人脸')
+            return embeddings
                     
+        except InferenceBusyError:
+            raise
         except Exception as e:
             print(f'[detect_all_faces] 检测失败: {e}')
             import traceback
             traceback.print_exc()
             return []
     
+    @staticmethod
+    def detect_all_faces_tiled(img):
+        """
+        分块检测大图中的所有人脸并提取特征
+
+        配置了推理进程池时各分块和各批人脸裁剪并发提交，同时提交的任务数不超过推理进程数，
+        避免一个请求的子任务超过进程池的等待上限而被拒绝。
+        """
+        pool = get_inference_pool(FaceService.MODEL_NAME, FaceService.DETECTOR_BACKEND)
+        concurrency = pool.workers if pool is not None else 1
+        faces = detect_tiled(img, FaceService.detect, Config.FACE_TILE_SIZE, Config.FACE_TILE_OVERLAP,
+                             Config.FACE_TILE_NMS_IOU, concurrency=concurrency)
+        print(f'[detect_all_faces] 分块检测到 {len(faces)} 张人脸')
+        if not faces:
+            return []
+
+        # 裁剪区域内重新检测以完成对齐，只对人脸区域提取特征
+        crops = crop_faces(img, faces)
+        size = Config.FACE_BATCH_MAX_SIZE
+        chunks = [crops[i:i + size] for i in range(0, len(crops), size)]
+        chunk_results = [None] * len(chunks)
+        errors = []
+
+        def run(i):
+            try:
+                chunk_results[i] = FaceService.represent_batch(chunks[i], enforce_detection=False)
+            except Exception as e:
+                errors.append(e)
+
+        run_bounded(run, len(chunks), concurrency)
+        if errors:
+            raise errors[0]
+
+        embeddings = []
+        for status, embedding_objs in (r for results in chunk_results for r in results):
+            if status != 'ok' or not embedding_objs:
+                continue
+            # 裁剪区域可能包含相邻人脸的一部分，取面积最大的一张
+            main = max(embedding_objs, key=lambda o: (o.get('facial_area') or {}).get('w', 0) *
+                                                     (o.get('facial_area') or {}).get('h', 0))
+            embeddings.append(main['embedding'])
+        return embeddings
+
     @staticmethod
     def has_face_registered(user_id):
         """检查用户是否已注册人脸"""
@@ -551,7 +781,8 @@ class FaceService:
             
             delete_sql = "DELETE FROM user_faces WHERE user_id = %s"
             Database.execute_query(delete_sql, (user_id,), commit=True)
-            
+            face_index.remove(user_id)
+
             return {'success': True, 'message': '人脸信息已删除'}
         except Exception as e:
             return {'success': False, 'message': f'删除失败: {str(e)}'}
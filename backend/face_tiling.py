@@ -0,0 +1,140 @@
+"""
+大图分块人脸检测
+阶梯教室合照分辨率高、后排人脸很小。整图送入检测器要么很慢，要么漏掉小人脸。
+这里把图片切成相互重叠的分块分别检测，坐标还原到原图后用 NMS 合并跨块的重复人脸框，
+最后只对人脸区域提取特征。
+"""
+import threading
+import numpy as np
+
+
+def make_tiles(height, width, tile_size, overlap):
+    """
+    生成覆盖整张图片的分块 (x0, y0, x1, y1)
+
+    overlap 为相邻分块重叠比例，保证位于分块边界的人脸至少完整出现在一个分块中。
+    """
+    tile_size = max(int(tile_size), 1)
+    step = max(int(tile_size * (1 - overlap)), 1)
+
+    def starts(length):
+        if length <= tile_size:
+            return [0]
+        positions = list(range(0, length - tile_size, step))
+        positions.append(length - tile_size)  # 最后一块贴齐边缘
+        return positions
+
+    return [(x, y, min(x + tile_size, width), min(y + tile_size, height))
+            for y in starts(height) for x in starts(width)]
+
+
+def nms(boxes, scores, iou_threshold):
+    """非极大值抑制，boxes 为 (N, 4) 的 x0, y0, x1, y1，返回保留的下标"""
+    boxes = np.asarray(boxes, dtype=np.float32)
+    scores = np.asarray(scores, dtype=np.float32)
+    if len(boxes) == 0:
+        return []
+    x0, y0, x1, y1 = boxes.T
+    areas = (x1 - x0) * (y1 - y0)
+    order = np.argsort(-scores, kind='stable')
+    keep = []
+    while order.size:
+        i = order[0]
+        keep.append(int(i))
+        rest = order[1:]
+        w = np.clip(np.minimum(x1[i], x1[rest]) - np.maximum(x0[i], x0[rest]), 0, None)
+        h = np.clip(np.minimum(y1[i], y1[rest]) - np.maximum(y0[i], y0[rest]), 0, None)
+        inter = w * h
+        # 分块边缘被截断的人脸框与完整框 IoU 偏低，同时按较小框的覆盖率判断
+        iou = inter / (areas[i] + areas[rest] - inter)
+        cover = inter / np.minimum(areas[i], areas[rest])
+        order = rest[(iou < iou_threshold) & (cover < 0.8)]
+    return keep
+
+
+def run_bounded(fn, count, concurrency):
+    """
+    以最多 concurrency 个线程执行 fn(0) ... fn(count - 1)
+
+    推理进程池对等待中的任务有上限（背压），同一个请求的子任务一次全部提交会超过上限、
+    把自己拒绝掉；并发数不超过推理进程数时，子任务不会占用留给其他请求的等待名额。
+    """
+    concurrency = max(min(int(concurrency), count), 1)
+    if concurrency == 1:
+        for i in range(count):
+            fn(i)
+        return
+    indexes = iter(range(count))
+    lock = threading.Lock()
+
+    def worker():
+        while True:
+            with lock:
+                i = next(indexes, None)
+            if i is None:
+                return
+            fn(i)
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+
+def detect_tiled(img, detect, tile_size, overlap, iou_threshold=0.4, concurrency=1):
+    """
+    分块检测人脸
+
+    Args:
+        img: BGR 图片数组
+        detect: 检测函数，接收图片数组，返回 [{'x', 'y', 'w', 'h', 'confidence'}]
+        tile_size: 分块边长（像素）
+        overlap: 相邻分块重叠比例
+        iou_threshold: NMS 阈值
+        concurrency: 同时提交的分块数（使用推理进程池时取进程数）
+
+    Returns:
+        list: 合并后的人脸框，坐标为原图坐标，按置信度降序
+    """
+    h, w = img.shape[:2]
+    tiles = make_tiles(h, w, tile_size, overlap)
+    results = [None] * len(tiles)
+    errors = []
+
+    def run(i):
+        x0, y0, x1, y1 = tiles[i]
+        try:
+            faces = detect(np.ascontiguousarray(img[y0:y1, x0:x1]))
+        except Exception as e:
+            errors.append(e)
+            return
+        results[i] = [(f['x'] + x0, f['y'] + y0, f['x'] + x0 + f['w'], f['y'] + y0 + f['h'], f['confidence'])
+                      for f in faces]
+
+    run_bounded(run, len(tiles), concurrency)
+    if errors:
+        raise errors[0]
+
+    candidates = [box for tile_boxes in results for box in tile_boxes]
+    if not candidates:
+        return []
+    boxes = np.array([c[:4] for c in candidates], dtype=np.float32)
+    scores = np.array([c[4] for c in candidates], dtype=np.float32)
+    return [{
+        'x': int(boxes[i, 0]), 'y': int(boxes[i, 1]),
+        'w': int(boxes[i, 2] - boxes[i, 0]), 'h': int(boxes[i, 3] - boxes[i, 1]),
+        'confidence': float(scores[i])
+    } for i in nms(boxes, scores, iou_threshold)]
+
+
+def crop_faces(img, faces, margin=0.3):
+    """按人脸框向外扩展 margin 后裁剪，留出对齐所需的上下文"""
+    h, w = img.shape[:2]
+    crops = []
+    for f in faces:
+        dx, dy = int(f['w'] * margin), int(f['h'] * margin)
+        x0, y0 = max(f['x'] - dx, 0), max(f['y'] - dy, 0)
+        x1, y1 = min(f['x'] + f['w'] + dx, w), min(f['y'] + f['h'] + dy, h)
+        crops.append(np.ascontiguousarray(img[y0:y1, x0:x1]))
+    return crops
@@ -0,0 +1,196 @@
+"""
+人脸验证引擎
+人脸签到、手势签到和人脸登录原先各自解码图片、提取特征、解析数据库中的特征、计算余弦距离并判断阈值。
+这里统一为一个 FaceVerifier：
+
+- verify(user_id, image): 1:1，判断图片是否为该用户
+- identify(image, k): 1:N，返回距离最近的 k 个已注册用户
+
+已注册特征由人脸索引（face_index，常驻内存的归一化矩阵）按用户缓存，索引中没有的用户
+（例如刚在其他进程注册）按需从数据库加载一行。每次调用返回各阶段耗时（毫秒）。
+特征提取函数和索引可以注入，不依赖 Flask，便于单独做基准测试。
+"""
+import time
+import base64
+import threading
+import numpy as np
+from database import Database
+from embedding_codec import decode_embedding
+from face_index import face_index, normalize
+
+STAGES = ('decode', 'detect_embed', 'match')
+
+
+def read_image_bytes(image):
+    """base64 图片（可带 data: 前缀）解码为 bytes，其他输入原样返回；同一张图片验证和保存截图共用"""
+    if isinstance(image, str):
+        return base64.b64decode(image.split(',')[1] if ',' in image else image)
+    return image
+
+
+class FaceVerifier:
+    """
+    人脸验证引擎
+
+    - extract: 特征提取函数，输入 BGR 数组，返回 DeepFace.represent 格式的列表
+      （默认走微批处理 FaceService.represent_batched，检测和特征提取在同一次推理中完成）
+    - index: 已注册特征索引（默认全局 face_index）
+    - threshold: 余弦距离阈值，小于该值视为同一人
+    """
+
+    def __init__(self, extract=None, index=None, threshold=None, max_size=640):
+        self._extract = extract
+        self.index = index or face_index
+        self.threshold = threshold
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._calls = 0
+        self._stage_ms = dict.fromkeys(STAGES, 0.0)
+
+    # ==================== 各阶段 ====================
+
+    def decode(self, image):
+        """解码图片（base64 / bytes / 文件对象 / 数组），统一为 BGR 数组"""
+        from face_service import decode_image
+        return decode_image(image, max_size=self.max_size)
+
+    def embed(self, img):
+        """
+        提取图片中第一张人脸的特征
+
+        Returns:
+            (embedding, error): 成功时 error 为 None
+        """
+        extract = self._extract
+        if extract is None:
+            from face_service import FaceService
+            extract = FaceService.represent_batched
+        from face_worker import InferenceBusyError
+        try:
+            objs = extract(img)
+        except InferenceBusyError:
+            raise
+        except Exception as e:
+            if 'Face could not be detected' in str(e):
+                return None, '未检测到人脸，请确保照片清晰且包含正面人脸'
+            return None, f'人脸特征提取失败: {e}'
+        if not objs:
+            return None, '未检测到人脸'
+        return np.asarray(objs[0]['embedding'], dtype=np.float32), None
+
+    def stored_embedding(self, user_id):
+        """已注册的归一化特征，未注册返回 None"""
+        self.index.ensure_fresh()
+        stored = self.index.get(user_id)
+        if stored is None:
+            row = Database.execute_query(
+                "SELECT face_embedding FROM user_faces WHERE user_id = %s", (user_id,), fetch_one=True
+            )
+            if not row:
+                return None
+            self.index.upsert(user_id, decode_embedding(row['face_embedding']))
+            stored = self.index.get(user_id)
+        return stored
+
+    def _threshold(self):
+        if self.threshold is not None:
+            return self.threshold
+        from face_service import FaceService
+        return FaceService.THRESHOLD
+
+    # ==================== 1:1 / 1:N ====================
+
+    def _prepare(self, image, timings):
+        """解码并提取特征，返回 (embedding, reason, error)"""
+        start = time.perf_counter()
+        img = self.decode(image)
+        timings['decode'] = (time.perf_counter() - start) * 1000
+        if img is None:
+            return None, 'decode_failed', '图片解码失败'
+        start = time.perf_counter()
+        embedding, error = self.embed(img)
+        timings['detect_embed'] = (time.perf_counter() - start) * 1000
+        return embedding, 'no_face', error
+
+    def verify(self, user_id, image):
+        """
+        1:1 验证
+
+        Returns:
+            dict: success（流程是否完成）、matched、distance、similarity（百分比）、message、timings；
+            reason 为 not_registered / decode_failed / no_face / mismatch 之一（matched 为 False 时）
+        """
+        timings = {}
+        stored = self.stored_embedding(user_id)
+        if stored is None:
+            return self._finish(timings, success=False, matched=False, reason='not_registered',
+                                message='您尚未录入人脸信息，请先在个人中心录入人脸')
+
+        embedding, reason, error = self._prepare(image, timings)
+        if embedding is None:
+            return self._finish(timings, success=False, matched=False, reason=reason, message=error)
+
+        start = time.perf_counter()
+        distance = float(1 - normalize(embedding) @ stored)
+        timings['match'] = (time.perf_counter() - start) * 1000
+        similarity = round((1 - distance) * 100, 2)
+        if distance >= self._threshold():
+            return self._finish(timings, success=True, matched=False, reason='mismatch', user_id=user_id,
+                                distance=distance, similarity=similarity,
+                                message=f'人脸验证失败，相似度不足（{similarity:.1f}%）')
+        return self._finish(timings, success=True, matched=True, user_id=user_id,
+                            distance=distance, similarity=similarity, message='人脸验证成功')
+
+    def identify(self, image, k=None):
+        """
+        1:N 识别
+
+        Returns:
+            dict: success、candidates（[{user_id, distance, similarity}]，按距离升序，只包含低于阈值的）、
+            message、timings
+        """
+        timings = {}
+        embedding, _, error = self._prepare(image, timings)
+        if embedding is None:
+            return self._finish(timings, success=False, message=error)
+        return self._finish(timings, success=True, candidates=self.search(embedding, k, timings))
+
+    def search(self, embedding, k=None, timings=None):
+        """
+        在索引中查找低于阈值的候选用户
+
+        k 为 None 时返回全部低于阈值的候选者：索引中不区分账号状态，先取前 k 个会让停用或未认证的用户
+        挤掉排在后面的有效用户，账号状态由调用方（FaceService.resolve_candidates）按距离顺序过滤。
+        """
+        start = time.perf_counter()
+        self.index.ensure_fresh()
+        candidates = [
+            {'user_id': uid, 'distance': distance, 'similarity': round((1 - distance) * 100, 2)}
+            for uid, distance in self.index.search(embedding, k=k, max_distance=self._threshold())
+        ]
+        if timings is not None:
+            timings['match'] = (time.perf_counter() - start) * 1000
+        return candidates
+
+    # ==================== 统计 ====================
+
+    def _finish(self, timings, **result):
+        with self._lock:
+            self._calls += 1
+            for stage in STAGES:
+                self._stage_ms[stage] += timings.get(stage, 0.0)
+        timings['total'] = sum(timings.get(stage, 0.0) for stage in STAGES)
+        result['timings'] = {stage: round(ms, 2) for stage, ms in timings.items()}
+        return result
+
+    def stats(self):
+        """各阶段平均耗时（毫秒）"""
+        with self._lock:
+            calls = self._calls
+            return {
+                'calls': calls,
+                'avg_ms': {stage: round(ms / calls, 2) if calls else 0 for stage, ms in self._stage_ms.items()}
+            }
+
+
+face_verifier = FaceVerifier()
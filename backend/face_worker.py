@@ -0,0 +1,500 @@
+"""
+人脸推理进程池
+DeepFace/RetinaFace 推理是纯 CPU 计算，在 gevent 协程中直接运行会阻塞整个事件循环。
+这里把推理放到独立进程中执行，每个进程启动时预加载模型，Web 进程只等待结果。
+"""
+import os
+import sys
+import queue
+import socket
+import subprocess
+import threading
+import time
+from multiprocessing.connection import Connection
+from config import Config
+
+
+class InferenceError(Exception):
+    """推理进程返回的错误"""
+    pass
+
+
+class InferenceTimeoutError(InferenceError):
+    """推理超时"""
+    pass
+
+
+class InferenceBusyError(Exception):
+    """推理进程池已满，调用方应返回 503"""
+
+    def __init__(self, message='人脸识别服务繁忙，请稍后重试', retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after or Config.FACE_WORKER_RETRY_AFTER
+
+
+# ==================== 推理任务（在推理进程或当前进程中执行） ====================
+
+def run_represent(img_path, model_name, detector_backend, enforce_detection=True):
+    """提取图片中人脸的特征向量，img_path 可以是文件路径或 BGR numpy 数组"""
+    from deepface import DeepFace
+    embedding_objs = DeepFace.represent(
+        img_path=img_path,
+        model_name=model_name,
+        enforce_detection=enforce_detection,
+        detector_backend=detector_backend
+    )
+    # 只返回可序列化的字段
+    return [{
+        'embedding': list(obj['embedding']),
+        'facial_area': obj.get('facial_area'),
+        'face_confidence': obj.get('face_confidence')
+    } for obj in embedding_objs]
+
+
+def run_represent_batch(images, model_name, detector_backend, enforce_detection=True):
+    """
+    批量提取特征向量
+
+    人脸检测逐张进行（检测器不支持批量输入），对齐后的人脸按批送入识别模型做一次前向计算。
+    预处理与 DeepFace.represent 一致，保证批量得到的特征与逐张提取的特征可以互相比对。
+    返回与 images 一一对应的 ('ok', embedding_objs) 或 ('error', message)。
+    """
+    import numpy as np
+    from deepface import DeepFace
+    try:
+        from deepface.modules import preprocessing
+    except ImportError:
+        # 旧版 DeepFace 没有公开预处理模块，退化为逐张提取
+        preprocessing = None
+
+    if preprocessing is None or len(images) == 1:
+        results = []
+        for img in images:
+            try:
+                results.append(('ok', run_represent(img, model_name, detector_backend, enforce_detection)))
+            except Exception as e:
+                results.append(('error', str(e)))
+        return results
+
+    model = DeepFace.build_model(model_name)
+    target_size = model.input_shape
+
+    results = [None] * len(images)
+    faces, owners, metas = [], [], []
+    for i, img in enumerate(images):
+        try:
+            face_objs = DeepFace.extract_faces(
+                img_path=img,
+                detector_backend=detector_backend,
+                enforce_detection=enforce_detection,
+                align=True
+            )
+        except Exception as e:
+            results[i] = ('error', str(e))
+            continue
+        results[i] = ('ok', [])
+        for obj in face_objs:
+            face = obj['face'][:, :, ::-1]  # RGB -> BGR，与 represent 一致
+            face = preprocessing.resize_image(img=face, target_size=(target_size[1], target_size[0]))
+            faces.append(preprocessing.normalize_input(img=face, normalization='base'))
+            owners.append(i)
+            metas.append((obj.get('facial_area'), obj.get('confidence')))
+
+    if faces:
+        keras_model = getattr(model, 'model', model)
+        embeddings = np.asarray(keras_model(np.concatenate(faces, axis=0), training=False))
+        for owner, embedding, (area, confidence) in zip(owners, embeddings, metas):
+            results[owner][1].append({
+                'embedding': embedding.tolist(),
+                'facial_area': area,
+                'face_confidence': confidence
+            })
+    return results
+
+
+def run_detect(img, detector_backend):
+    """只做人脸检测，返回人脸框 [{'x', 'y', 'w', 'h', 'confidence'}]"""
+    from deepface import DeepFace
+    face_objs = DeepFace.extract_faces(
+        img_path=img,
+        detector_backend=detector_backend,
+        enforce_detection=False,
+        align=False
+    )
+    faces = []
+    for obj in face_objs:
+        # 未检测到人脸时 DeepFace 返回整张图片且置信度为 0
+        confidence = float(obj.get('confidence') or 0)
+        if confidence <= 0:
+            continue
+        area = obj['facial_area']
+        faces.append({
+            'x': int(area['x']), 'y': int(area['y']),
+            'w': int(area['w']), 'h': int(area['h']),
+            'confidence': confidence
+        })
+    return faces
+
+
+TASKS = {
+    'represent': run_represent,
+    'represent_batch': run_represent_batch,
+    'detect': run_detect,
+}
+
+
+def _worker_main(conn, model_name, detector_backend):
+    """推理进程主循环"""
+    import numpy as np
+    try:
+        # 预加载模型：对空白图片跑一次推理，完成权重加载和计算图构建
+        run_represent(np.zeros((160, 160, 3), dtype=np.uint8), model_name, detector_backend, enforce_detection=False)
+        conn.send(('ready', os.getpid()))
+    except Exception as e:
+        # 报告失败，由进程池和 ModelWarmup 上报未就绪；进程继续运行，之后的任务会再次尝试加载模型
+        print(f'[推理进程] 模型预加载失败: {e}')
+        conn.send(('failed', str(e)))
+
+    while True:
+        try:
+            task, kwargs = conn.recv()
+        except (EOFError, KeyboardInterrupt):
+            break
+        try:
+            conn.send(('ok', TASKS[task](**kwargs)))
+        except Exception as e:
+            conn.send(('error', str(e)))
+
+
+def _wait_readable(conn, timeout):
+    """等待管道可读；gevent 打补丁后只挂起当前协程"""
+    from gevent import monkey
+    if monkey.is_module_patched('socket'):
+        from gevent.socket import wait_read
+        try:
+            wait_read(conn.fileno(), timeout=timeout, timeout_exc=InferenceTimeoutError())
+            return True
+        except InferenceTimeoutError:
+            return False
+    return conn.poll(timeout)
+
+
+class _Worker:
+    """
+    一个推理子进程
+
+    通过 python -m face_worker 启动独立解释器，而不是 multiprocessing 的 spawn：
+    spawn 会在子进程中重新导入 __main__（即 app.py），带上 gevent 补丁和整个 Flask 应用。
+    """
+
+    def __init__(self, model_name, detector_backend):
+        parent_sock, child_sock = socket.socketpair()
+        self.process = subprocess.Popen(
+            [sys.executable, '-m', 'face_worker', str(child_sock.fileno()), model_name, detector_backend],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            pass_fds=(child_sock.fileno(),)
+        )
+        child_sock.close()
+        # gevent 的 socketpair 是非阻塞的，Connection 需要阻塞读写（读之前已用 wait_read 等待）
+        fd = parent_sock.detach()
+        os.set_blocking(fd, True)
+        self.conn = Connection(fd)
+        self.ready = False
+        self.preload_error = None
+
+    def _preload_message(self, message):
+        """处理进程启动后的预加载通知，是预加载通知时返回 True"""
+        if message[0] == 'ready':
+            self.ready = True
+            return True
+        if message[0] == 'failed':
+            self.preload_error = message[1]
+            return True
+        return False
+
+    def call(self, task, kwargs, timeout):
+        self.conn.send((task, kwargs))
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not _wait_readable(self.conn, remaining):
+                raise InferenceTimeoutError(f'人脸识别超时（{timeout}秒）')
+            message = self.conn.recv()
+            if self._preload_message(message):
+                continue
+            if message[0] == 'error':
+                raise InferenceError(message[1])
+            return message[1]
+
+    def kill(self):
+        try:
+            self.conn.close()
+        except Exception:
+            pass
+        if self.process.poll() is None:
+            self.process.kill()
+        try:
+            self.process.wait(timeout=1)
+        except Exception:
+            pass
+
+
+class FaceInferencePool:
+    """
+    人脸推理进程池
+
+    - workers: 推理进程数
+    - max_queue: 等待空闲进程的请求上限，超过直接拒绝（背压）
+    - timeout: 单个任务超时，超时的进程会被杀掉并重建
+    """
+
+    def __init__(self, model_name, detector_backend, workers=None, max_queue=None, timeout=None):
+        self.model_name = model_name
+        self.detector_backend = detector_backend
+        self.workers = workers or Config.FACE_WORKERS
+        self.max_queue = Config.FACE_WORKER_QUEUE if max_queue is None else max_queue
+        self.timeout = timeout or Config.FACE_WORKER_TIMEOUT
+
+        self._idle = queue.Queue()
+        self._lock = threading.Lock()
+        self._all = []
+        self._waiting = 0
+        self._started = False
+        self._completed = 0
+        self._failed = 0
+        self._rejected = 0
+        self._timeouts = 0
+
+    def start(self):
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        for _ in range(self.workers):
+            self._spawn()
+        print(f'[推理进程池] 启动 {self.workers} 个推理进程')
+
+    def _spawn(self):
+        worker = _Worker(self.model_name, self.detector_backend)
+        with self._lock:
+            self._all.append(worker)
+        self._idle.put(worker)
+
+    def _retire(self, worker):
+        worker.kill()
+        with self._lock:
+            if worker in self._all:
+                self._all.remove(worker)
+        self._spawn()
+
+    def wait_ready(self, timeout=120):
+        """
+        等待所有进程完成模型预加载
+
+        Raises:
+            InferenceError: 有进程报告模型预加载失败
+        """
+        deadline = time.monotonic() + timeout
+        workers = []
+        try:
+            for _ in range(self.workers):
+                workers.append(self._idle.get(timeout=max(deadline - time.monotonic(), 0.01)))
+            for worker in workers:
+                while not worker.ready:
+                    if worker.preload_error is not None:
+                        raise InferenceError(f'推理进程模型预加载失败: {worker.preload_error}')
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0 or not _wait_readable(worker.conn, remaining):
+                        return False
+                    worker._preload_message(worker.conn.recv())
+            return True
+        except queue.Empty:
+            return False
+        finally:
+            for worker in workers:
+                self._idle.put(worker)
+
+    def run(self, task, **kwargs):
+        """提交任务并等待结果"""
+        if not self._started:
+            self.start()
+
+        with self._lock:
+            if self._waiting >= self.max_queue:
+                self._rejected += 1
+                raise InferenceBusyError()
+            self._waiting += 1
+        try:
+            worker = self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            with self._lock:
+                self._rejected += 1
+            raise InferenceBusyError()
+        finally:
+            with self._lock:
+                self._waiting -= 1
+
+        try:
+            result = worker.call(task, kwargs, self.timeout)
+        except InferenceTimeoutError:
+            with self._lock:
+                self._timeouts += 1
+            self._retire(worker)
+            raise
+        except InferenceError:
+            with self._lock:
+                self._failed += 1
+            self._idle.put(worker)
+            raise
+        except (EOFError, OSError) as e:
+            # 进程崩溃
+            with self._lock:
+                self._failed += 1
+            self._retire(worker)
+            raise InferenceError(f'推理进程异常退出: {e}')
+
+        with self._lock:
+            self._completed += 1
+        self._idle.put(worker)
+        return result
+
+    def stats(self):
+        with self._lock:
+            return {
+                'workers': len(self._all),
+                'ready': sum(1 for w in self._all if w.ready),
+                'preload_failed': sum(1 for w in self._all if w.preload_error is not None),
+                'idle': self._idle.qsize(),
+                'waiting': self._waiting,
+                'completed': self._completed,
+                'failed': self._failed,
+                'rejected': self._rejected,
+                'timeouts': self._timeouts
+            }
+
+    def shutdown(self):
+        with self._lock:
+            workers, self._all = self._all, []
+            self._started = False
+        for worker in workers:
+            worker.kill()
+
+
+class _BatchItem:
+    __slots__ = ('image', 'event', 'result', 'error')
+
+    def __init__(self, image):
+        self.image = image
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class EmbeddingBatcher:
+    """
+    特征提取微批处理
+
+    签到开始后大量请求在很短时间内到达。第一个请求到达时开启一个时间窗口，
+    窗口内到达的请求合并为一批，由 run_batch 一次处理后把结果分发回各个等待的请求。
+    批次达到 max_batch 时立即提交，不再等待窗口结束。
+
+    - run_batch: 接收图片列表，返回一一对应的 ('ok', result) / ('error', message)
+    - window_ms: 收集窗口（毫秒）
+    - max_batch: 单批最大图片数
+    """
+
+    def __init__(self, run_batch, window_ms=None, max_batch=None):
+        self.run_batch = run_batch
+        self.window = (Config.FACE_BATCH_WINDOW_MS if window_ms is None else window_ms) / 1000.0
+        self.max_batch = max_batch or Config.FACE_BATCH_MAX_SIZE
+
+        self._lock = threading.Lock()
+        self._pending = []
+        self._generation = 0
+        self._batches = 0
+        self._items = 0
+        self._largest = 0
+
+    def submit(self, image):
+        """提交一张图片并等待结果，失败时抛出对应异常"""
+        item = _BatchItem(image)
+        batch = None
+        with self._lock:
+            self._pending.append(item)
+            if len(self._pending) >= self.max_batch:
+                batch = self._take()
+            elif len(self._pending) == 1:
+                threading.Thread(target=self._flush_after, args=(self._generation,), daemon=True).start()
+
+        if batch:
+            self._dispatch(batch)
+        item.event.wait()
+        if item.error is not None:
+            raise item.error
+        return item.result
+
+    def _take(self):
+        """取出当前批次（需持有锁）"""
+        batch, self._pending = self._pending, []
+        self._generation += 1
+        return batch
+
+    def _flush_after(self, generation):
+        time.sleep(self.window)
+        with self._lock:
+            # 窗口内批次已满并被提交时，计时器作废
+            if generation != self._generation or not self._pending:
+                return
+            batch = self._take()
+        self._dispatch(batch)
+
+    def _dispatch(self, batch):
+        with self._lock:
+            self._batches += 1
+            self._items += len(batch)
+            self._largest = max(self._largest, len(batch))
+        try:
+            results = self.run_batch([item.image for item in batch])
+            for item, (status, value) in zip(batch, results):
+                if status == 'ok':
+                    item.result = value
+                else:
+                    item.error = InferenceError(value)
+        except Exception as e:
+            for item in batch:
+                item.error = e
+        finally:
+            for item in batch:
+                item.event.set()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'window_ms': self.window * 1000,
+                'max_batch': self.max_batch,
+                'pending': len(self._pending),
+                'batches': self._batches,
+                'items': self._items,
+                'avg_batch': round(self._items / self._batches, 2) if self._batches else 0,
+                'largest_batch': self._largest
+            }
+
+
+_inference_pool = None
+
+
+def get_inference_pool(model_name, detector_backend):
+    """获取全局推理进程池，FACE_WORKERS=0 时返回 None（在当前进程中推理）"""
+    global _inference_pool
+    if Config.FACE_WORKERS <= 0:
+        return None
+    if _inference_pool is None:
+        _inference_pool = FaceInferencePool(model_name, detector_backend)
+    return _inference_pool
+
+
+if __name__ == '__main__':
+    # 推理子进程入口: python -m face_worker <fd> <model_name> <detector_backend>
+    fd = int(sys.argv[1])
+    os.set_blocking(fd, True)
+    _worker_main(Connection(fd), sys.argv[2], sys.argv[3])
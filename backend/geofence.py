@@ -0,0 +1,220 @@
+"""
+位置签到地理围栏
+原先每次位置签到只按一个圆心和半径计算一次 Haversine 距离。这里支持：
+
+- 多个允许区域（教学楼的几间教室、主会场和分会场）
+- 圆形区域 {type: circle, lat, lng, radius} 和多边形区域 {type: polygon, points: [[lat, lng], ...], margin}
+- 批量校验：先用预先计算的外接矩形筛掉明显在区域外的点，再用向量化的 Haversine /
+  射线法计算，教师修改签到位置后可以一次重新校验整个签到的所有位置记录
+
+距离单位均为米。多边形在其中心附近做等距投影后计算，教室尺度下误差可以忽略。
+"""
+import json
+import math
+import threading
+from collections import OrderedDict
+import numpy as np
+
+EARTH_RADIUS = 6371000  # 地球半径（米）
+METERS_PER_DEGREE = math.pi * EARTH_RADIUS / 180
+DEFAULT_RADIUS = 50
+
+
+def haversine(lat1, lng1, lat2, lng2):
+    """Haversine 距离（米），参数可以是标量或可广播的数组"""
+    lat1, lng1, lat2, lng2 = (np.radians(np.asarray(v, dtype=np.float64)) for v in (lat1, lng1, lat2, lng2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+
+def parse_zones(zones):
+    """
+    校验并规范化区域列表（可以是 JSON 字符串）
+
+    Raises:
+        ValueError: 区域格式不正确
+    """
+    if isinstance(zones, str):
+        zones = json.loads(zones)
+    if not isinstance(zones, list) or not zones:
+        raise ValueError('签到区域不能为空')
+    result = []
+    for zone in zones:
+        if not isinstance(zone, dict):
+            raise ValueError('签到区域格式不正确')
+        kind = zone.get('type', 'circle')
+        if kind == 'circle':
+            lat, lng = float(zone['lat']), float(zone['lng'])
+            radius = float(zone.get('radius') or DEFAULT_RADIUS)
+            if not (-90 <= lat <= 90 and -180 <= lng <= 180) or radius <= 0:
+                raise ValueError('圆形签到区域的坐标或半径不正确')
+            result.append({'type': 'circle', 'lat': lat, 'lng': lng, 'radius': radius})
+        elif kind == 'polygon':
+            points = [[float(lat), float(lng)] for lat, lng in zone['points']]
+            if len(points) < 3:
+                raise ValueError('多边形签到区域至少需要 3 个顶点')
+            if points[0] == points[-1]:
+                points.pop()
+            result.append({'type': 'polygon', 'points': points, 'margin': float(zone.get('margin') or 0)})
+        else:
+            raise ValueError(f'不支持的签到区域类型: {kind}')
+    return result
+
+
+def zone_center(zone):
+    """区域中心 (lat, lng)，用于列表展示和地图定位"""
+    if zone['type'] == 'circle':
+        return zone['lat'], zone['lng']
+    points = zone['points']
+    return sum(p[0] for p in points) / len(points), sum(p[1] for p in points) / len(points)
+
+
+def zones_for_checkin(checkin):
+    """签到的允许区域：location_zones 未设置时使用 location_lat / location_lng / location_range 圆形区域"""
+    if checkin.get('location_zones'):
+        return parse_zones(checkin['location_zones'])
+    if checkin.get('location_lat') is None or checkin.get('location_lng') is None:
+        return []
+    return [{
+        'type': 'circle',
+        'lat': float(checkin['location_lat']),
+        'lng': float(checkin['location_lng']),
+        'radius': float(checkin.get('location_range') or DEFAULT_RADIUS)
+    }]
+
+
+class _Circle:
+    def __init__(self, zone):
+        self.zone = zone
+        self.lat, self.lng, self.radius = zone['lat'], zone['lng'], zone['radius']
+        dlat = self.radius / METERS_PER_DEGREE
+        dlng = dlat / max(math.cos(math.radians(self.lat)), 1e-6)
+        self.bbox = (self.lat - dlat, self.lat + dlat, self.lng - dlng, self.lng + dlng)
+
+    def measure(self, lats, lngs, in_box):
+        """返回 (到圆心的距离, 超出区域的距离)"""
+        distance = haversine(lats, lngs, self.lat, self.lng)
+        return distance, np.maximum(distance - self.radius, 0)
+
+
+class _Polygon:
+    def __init__(self, zone):
+        self.zone = zone
+        self.margin = zone['margin']
+        points = np.array(zone['points'], dtype=np.float64)
+        self.lat0, self.lng0 = points[:, 0].mean(), points[:, 1].mean()
+        self.cos0 = math.cos(math.radians(self.lat0))
+        self.vertices = self._project(points[:, 0], points[:, 1])  # (E, 2)
+        self.next_vertices = np.roll(self.vertices, -1, axis=0)
+        dlat = self.margin / METERS_PER_DEGREE
+        dlng = dlat / max(self.cos0, 1e-6)
+        self.bbox = (points[:, 0].min() - dlat, points[:, 0].max() + dlat,
+                     points[:, 1].min() - dlng, points[:, 1].max() + dlng)
+
+    def _project(self, lats, lngs):
+        """以多边形中心为原点的等距投影（米）"""
+        x = (np.asarray(lngs, dtype=np.float64) - self.lng0) * METERS_PER_DEGREE * self.cos0
+        y = (np.asarray(lats, dtype=np.float64) - self.lat0) * METERS_PER_DEGREE
+        return np.stack([x, y], axis=-1)
+
+    def _contains(self, p):
+        """射线法判断点是否在多边形内，p: (N, 2)"""
+        px, py = p[:, :1], p[:, 1:]
+        (xi, yi), (xj, yj) = self.vertices.T, self.next_vertices.T
+        crosses = (yi > py) != (yj > py)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            x_cross = xi + (py - yi) * (xj - xi) / (yj - yi)
+        return (crosses & (px < x_cross)).sum(axis=1) % 2 == 1
+
+    def _edge_distance(self, p):
+        """点到多边形边界的最短距离，p: (N, 2)"""
+        a, b = self.vertices[None], self.next_vertices[None]
+        ab = b - a
+        length = (ab ** 2).sum(axis=-1)
+        t = np.clip(((p[:, None] - a) * ab).sum(axis=-1) / np.where(length > 0, length, 1), 0, 1)
+        nearest = a + t[..., None] * ab
+        return np.sqrt(((p[:, None] - nearest) ** 2).sum(axis=-1)).min(axis=1)
+
+    def measure(self, lats, lngs, in_box):
+        """返回 (到多边形的距离，内部为 0, 超出区域的距离)；只对外接矩形内的点做射线法判断"""
+        p = self._project(lats, lngs)
+        distance = self._edge_distance(p)
+        if in_box.any():
+            candidates = np.flatnonzero(in_box)
+            distance[candidates[self._contains(p[candidates])]] = 0
+        return distance, np.maximum(distance - self.margin, 0)
+
+
+class Geofence:
+    """一个签到的全部允许区域"""
+
+    def __init__(self, zones):
+        self.zones = [(_Circle if z['type'] == 'circle' else _Polygon)(z) for z in zones]
+
+    def check_many(self, lats, lngs):
+        """
+        批量校验位置
+
+        Returns:
+            (inside, distance, zone): 是否在任一区域内、到最近区域的距离（圆形为到圆心距离）、
+            最近区域的下标（没有区域时为 -1）
+        """
+        lats = np.asarray(lats, dtype=np.float64)
+        lngs = np.asarray(lngs, dtype=np.float64)
+        n = len(lats)
+        best_excess = np.full(n, np.inf)
+        best_distance = np.full(n, np.inf)
+        best_zone = np.full(n, -1)
+        for index, zone in enumerate(self.zones):
+            lat_min, lat_max, lng_min, lng_max = zone.bbox
+            in_box = (lats >= lat_min) & (lats <= lat_max) & (lngs >= lng_min) & (lngs <= lng_max)
+            # 已经在其他区域内的点不用再算；外接矩形外的点一定不在该区域内，只需计算距离
+            todo = best_excess > 0
+            if not todo.any():
+                break
+            distance, excess = zone.measure(lats[todo], lngs[todo], in_box[todo])
+            better = excess < best_excess[todo]
+            idx = np.flatnonzero(todo)[better]
+            best_excess[idx] = excess[better]
+            best_distance[idx] = distance[better]
+            best_zone[idx] = index
+        return best_excess <= 0, best_distance, best_zone
+
+    def check(self, lat, lng):
+        inside, distance, zone = self.check_many([lat], [lng])
+        return bool(inside[0]), float(distance[0]), int(zone[0])
+
+    def describe(self, zone_index):
+        return self.zones[zone_index].zone if zone_index >= 0 else None
+
+
+class _GeofenceCache:
+    """按签到缓存 Geofence，签到区域修改后键随之变化"""
+
+    def __init__(self, max_size=256):
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._items = OrderedDict()
+
+    def get(self, checkin):
+        key = (checkin.get('id'), checkin.get('location_zones'), str(checkin.get('location_lat')),
+               str(checkin.get('location_lng')), checkin.get('location_range'))
+        with self._lock:
+            fence = self._items.get(key)
+            if fence is not None:
+                self._items.move_to_end(key)
+                return fence
+        fence = Geofence(zones_for_checkin(checkin))
+        with self._lock:
+            self._items[key] = fence
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+        return fence
+
+
+_fences = _GeofenceCache()
+
+
+def for_checkin(checkin):
+    """签到对应的 Geofence（缓存）"""
+    return _fences.get(checkin)
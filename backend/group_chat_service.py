@@ -4,6 +4,7 @@ from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from database import Database
 from pymysql.cursors import DictCursor
+from group_messaging import group_members
 
 group_chat_bp = Blueprint('group_chat', __name__)
 
@@ -209,12 +210,14 @@ def add_members(group_id):
             return jsonify({'success': False, 'message': 'No permission'}), 403
         
         added = []
+        inserted = []
         for mid in member_ids:
             try:
                 cursor.execute("""
                     INSERT INTO group_members (group_id, user_id, role)
                     VALUES (%s, %s, 'member')
                 """, (group_id, mid))
+                inserted.append(mid)
                 cursor.execute("SELECT real_name FROM users WHERE user_id = %s", (mid,))
                 new_member = cursor.fetchone()
                 if new_member:
@@ -229,6 +232,8 @@ def add_members(group_id):
             """, (group_id, user_id, f'{", ".join(added)} joined'))
         
         conn.commit()
+        for mid in inserted:
+            group_members.invalidate(group_id, int(mid))
         return jsonify({'success': True, 'message': f'Added {len(added)} members'})
     except Exception as e:
         conn.rollback()
@@ -277,6 +282,7 @@ def remove_member(group_id, member_id):
         """, (group_id, user_id, f'{target["real_name"]} was removed'))
         
         conn.commit()
+        group_members.invalidate(group_id, member_id)
         return jsonify({'success': True, 'message': 'Member removed'})
     except Exception as e:
         conn.rollback()
@@ -318,6 +324,7 @@ def leave_group(group_id):
         """, (group_id, user_id, f'{member["real_name"]} left'))
         
         conn.commit()
+        group_members.invalidate(group_id, user_id)
         return jsonify({'success': True, 'message': 'Left group'})
     except Exception as e:
         conn.rollback()
@@ -571,6 +578,7 @@ def dissolve_group(group_id):
         cursor.execute("SET FOREIGN_KEY_CHECKS = 1")
         
         conn.commit()
+        group_members.invalidate(group_id)
         return jsonify({'success': True, 'message': '群聊已解散'})
     except Exception as e:
         conn.rollback()
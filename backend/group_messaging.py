@@ -0,0 +1,242 @@
+"""
+群消息发送
+handle_send_group_message 原先每条消息依次执行：查询成员身份、插入消息（签到消息还要插入签到）、
+查询发送者信息、重新查询刚插入消息的 created_at，每次 Database.execute_query 都单独借出一个连接。
+这里：
+
+- GroupMembershipCache: (群组, 用户) -> 角色 / 是否禁言，group_chat_service 中添加成员、
+  移除成员、退群、解散群聊后失效；另设 ttl，多进程部署时其他进程的修改最多 ttl 秒后生效
+- SenderProfileCache: 发送者姓名和头像。目前没有修改 users.real_name / photo_url 的接口（注册时写入），
+  直接修改数据库后最多 SENDER_PROFILE_CACHE_TTL 秒后生效；以后增加修改资料的接口时需调用 sender_profiles.invalidate
+- GroupMessageEngine.send: 缓存命中时只借出一个连接、在一个事务中插入（签到和）消息，
+  created_at 由应用写入，不再重新查询
+"""
+import time
+import uuid
+import hashlib
+import threading
+from datetime import datetime, timedelta
+from database import Database
+from config import Config
+
+
+def _fetch_one(sql, params):
+    return Database.execute_query(sql, params, fetch_one=True)
+
+
+class GroupMessageError(Exception):
+    """群消息不能发送（不是群成员、被禁言、无权发起签到等）"""
+    pass
+
+
+class GroupMembershipCache:
+    """
+    群成员身份缓存
+
+    不是成员的结果也会缓存（加入群后由 add_members 失效）。
+    """
+
+    def __init__(self, ttl=None, max_groups=5000):
+        self.ttl = Config.GROUP_MEMBER_CACHE_TTL if ttl is None else ttl
+        self.max_groups = max_groups
+        self._lock = threading.Lock()
+        self._groups = {}  # group_id -> {user_id: (member 或 None, expires_at)}
+        self._hits = 0
+        self._misses = 0
+
+    def get(self, group_id, user_id, fetch_one=None):
+        """成员信息 {role, is_muted}，不是成员返回 None；fetch_one(sql, params) 为缓存未命中时的查询函数"""
+        now = time.monotonic()
+        with self._lock:
+            cached = self._groups.get(group_id, {}).get(user_id)
+            if cached and cached[1] > now:
+                self._hits += 1
+                return cached[0]
+            self._misses += 1
+        member = (fetch_one or _fetch_one)(
+            "SELECT role, is_muted FROM group_members WHERE group_id = %s AND user_id = %s",
+            (group_id, user_id)
+        )
+        if self.ttl > 0:
+            with self._lock:
+                if group_id not in self._groups and len(self._groups) >= self.max_groups:
+                    self._groups.clear()
+                self._groups.setdefault(group_id, {})[user_id] = (member, now + self.ttl)
+        return member
+
+    def invalidate(self, group_id, user_id=None):
+        """成员变动后失效，user_id 为 None 时失效整个群"""
+        with self._lock:
+            if user_id is None:
+                self._groups.pop(group_id, None)
+            else:
+                self._groups.get(group_id, {}).pop(user_id, None)
+
+    def stats(self):
+        with self._lock:
+            total = self._hits + self._misses
+            return {
+                'groups': len(self._groups),
+                'hits': self._hits,
+                'misses': self._misses,
+                'hit_rate': round(self._hits / total, 4) if total else 0
+            }
+
+
+class SenderProfileCache:
+    """
+    发送者姓名和头像缓存
+
+    修改 users.real_name / photo_url 的代码应调用 invalidate；其他进程的缓存最多 ttl 秒后过期
+    """
+
+    def __init__(self, ttl=None, max_users=20000):
+        self.ttl = Config.SENDER_PROFILE_CACHE_TTL if ttl is None else ttl
+        self.max_users = max_users
+        self._lock = threading.Lock()
+        self._profiles = {}  # user_id -> (profile, expires_at)
+
+    def get(self, user_id, fetch_one=None):
+        now = time.monotonic()
+        with self._lock:
+            cached = self._profiles.get(user_id)
+            if cached and cached[1] > now:
+                return cached[0]
+        profile = (fetch_one or _fetch_one)(
+            "SELECT real_name, photo_url FROM users WHERE user_id = %s", (user_id,)
+        )
+        if profile and self.ttl > 0:
+            with self._lock:
+                if len(self._profiles) >= self.max_users:
+                    self._profiles.clear()
+                self._profiles[user_id] = (profile, now + self.ttl)
+        return profile
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._profiles.pop(user_id, None)
+
+
+class GroupMessageEngine:
+    """群消息发送"""
+
+    def __init__(self, members=None, senders=None):
+        self.members = members or group_members
+        self.senders = senders or sender_profiles
+        self._lock = threading.Lock()
+        self._sent = 0
+        self._total_ms = 0.0
+        self._queries = 0
+
+    def send(self, group_id, sender_id, message_type, content, checkin=None):
+        """
+        发送一条群消息
+
+        Args:
+            checkin: 签到消息的签到参数 {checkin_type, duration, gesture_number,
+                     location_lat, location_lng, location_range}
+        Returns:
+            dict: 广播给群聊房间的消息
+        Raises:
+            GroupMessageError: 不允许发送
+        """
+        start = time.perf_counter()
+        conn = Database.get_connection()
+        cursor = conn.cursor()
+        queries = 0
+
+        def execute(sql, params):
+            nonlocal queries
+            queries += 1
+            cursor.execute(sql, params)
+
+        def fetch_one(sql, params):
+            execute(sql, params)
+            return cursor.fetchone()
+
+        try:
+            # 身份和发送者信息优先从缓存读取，未命中时与插入共用同一个连接
+            member = self.members.get(group_id, sender_id, fetch_one)
+            if not member:
+                raise GroupMessageError('您不是该群成员')
+            if member['is_muted']:
+                raise GroupMessageError('您已被禁言')
+            if message_type == 'checkin' and member['role'] not in ('owner', 'admin'):
+                raise GroupMessageError('只有群主或管理员可以发起签到')
+
+            sender = self.senders.get(sender_id, fetch_one)
+
+            created_at = datetime.now().replace(microsecond=0)
+            checkin_id = checkin_code = end_time = None
+            if message_type == 'checkin':
+                checkin = checkin or {}
+                duration = checkin.get('duration', 5)
+                checkin_code = hashlib.md5(f"{uuid.uuid4()}{datetime.now().timestamp()}".encode()).hexdigest()[:8].upper()
+                end_time = created_at + timedelta(minutes=duration)
+                execute("""
+                    INSERT INTO checkins (group_id, creator_id, title, type, checkin_code,
+                                          duration, end_time, description, gesture_number,
+                                          location_lat, location_lng, location_range, status)
+                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, 'active')
+                """, (
+                    group_id, sender_id, content, checkin.get('checkin_type', 'qrcode'), checkin_code,
+                    duration, end_time, '', checkin.get('gesture_number'),
+                    checkin.get('location_lat'), checkin.get('location_lng'), checkin.get('location_range', 50)
+                ))
+                checkin_id = cursor.lastrowid
+
+            execute("""
+                INSERT INTO group_messages (group_id, sender_id, message_type, content,
+                                            reference_id, reference_type, created_at)
+                VALUES (%s, %s, %s, %s, %s, %s, %s)
+            """, (group_id, sender_id, message_type, content, checkin_id,
+                  'checkin' if checkin_id else None, created_at))
+            message_id = cursor.lastrowid
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cursor.close()
+            conn.close()
+
+        if checkin_id:
+            from checkin_cache import active_checkins, user_active_lists
+            from checkin_scheduler import checkin_scheduler
+            active_checkins.refresh(checkin_id)
+            user_active_lists.clear()
+            checkin_scheduler.schedule(checkin_id, end_time)
+            print(f'[群聊签到] 创建签到: ID={checkin_id}, 类型={checkin.get("checkin_type", "qrcode")}, '
+                  f'时长={checkin.get("duration", 5)}分钟')
+
+        with self._lock:
+            self._sent += 1
+            self._total_ms += (time.perf_counter() - start) * 1000
+            self._queries += queries
+
+        return {
+            'id': message_id,
+            'group_id': group_id,
+            'sender_id': sender_id,
+            'sender_name': sender['real_name'] if sender else None,
+            'sender_avatar': sender['photo_url'] if sender else None,
+            'message_type': message_type,
+            'content': content,
+            'created_at': created_at.isoformat(),
+            'reference_id': checkin_id,
+            'checkin_code': checkin_code
+        }
+
+    def stats(self):
+        with self._lock:
+            return {
+                'sent': self._sent,
+                'avg_ms': round(self._total_ms / self._sent, 2) if self._sent else 0,
+                'queries_per_message': round(self._queries / self._sent, 2) if self._sent else 0,
+                'membership_cache': self.members.stats()
+            }
+
+
+group_members = GroupMembershipCache()
+sender_profiles = SenderProfileCache()
+group_messages = GroupMessageEngine()
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+"""创建考勤汇总表并按现有签到记录重建（汇总与记录不一致时也可以重新执行）"""
+from database import Database
+from attendance_rollup import rebuild
+
+
+def init_attendance_rollup():
+    conn = Database.get_connection()
+    cursor = conn.cursor()
+    
+    try:
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS checkin_attendance_stats (
+                group_id INT NOT NULL,
+                user_id INT NOT NULL,
+                checked_count INT NOT NULL DEFAULT 0,
+                late_count INT NOT NULL DEFAULT 0,
+                absent_count INT NOT NULL DEFAULT 0,
+                last_checkin_at DATETIME,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+                PRIMARY KEY (group_id, user_id),
+                INDEX idx_user (user_id)
+            ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+        """)
+        print("✓ checkin_attendance_stats 表已就绪")
+        
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS checkin_totals (
+                checkin_id INT PRIMARY KEY,
+                group_id INT,
+                checked_count INT NOT NULL DEFAULT 0,
+                late_count INT NOT NULL DEFAULT 0,
+                absent_count INT NOT NULL DEFAULT 0,
+                closed TINYINT(1) NOT NULL DEFAULT 0,
+                FOREIGN KEY (checkin_id) REFERENCES checkins(id) ON DELETE CASCADE,
+                INDEX idx_group (group_id)
+            ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+        """)
+        print("✓ checkin_totals 表已就绪")
+        
+        totals, students = rebuild(cursor)
+        conn.commit()
+        print(f"✓ 已重建汇总：{totals} 个签到，{students} 条学生统计")
+        print("\n考勤汇总初始化成功！")
+    except Exception as e:
+        print(f"初始化失败: {e}")
+        conn.rollback()
+    finally:
+        cursor.close()
+        conn.close()
+
+if __name__ == '__main__':
+    init_attendance_rollup()
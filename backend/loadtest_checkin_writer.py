@@ -0,0 +1,76 @@
+"""
+签到记录写入压测
+模拟 N 名学生同时签到，对比 sync / batch / async 三种写入模式的耗时和每秒提交数。
+使用 .env 中配置的数据库：临时创建一条签到，结束后删除该签到及其记录。
+
+用法:
+    python loadtest_checkin_writer.py                  # 500 并发，三种模式
+    python loadtest_checkin_writer.py --users 200 --modes batch async
+"""
+from gevent import monkey
+monkey.patch_all()
+
+import time
+import argparse
+import gevent
+from datetime import datetime, timedelta
+from database import Database
+from checkin_writer import CheckinRecordWriter
+
+
+def create_checkin(creator_id):
+    sql = """
+        INSERT INTO checkins (group_id, creator_id, title, type, checkin_code, duration, end_time, status)
+        VALUES (NULL, %s, '写入压测', 'qrcode', %s, 5, %s, 'active')
+    """
+    code = f'LT{int(time.time()) % 1000000:06d}'
+    return Database.execute_query(sql, (creator_id, code, datetime.now() + timedelta(minutes=5)), commit=True)
+
+
+def run(mode, checkin_id, user_ids):
+    writer = CheckinRecordWriter(mode=mode)
+    Database.execute_query("DELETE FROM checkin_records WHERE checkin_id = %s", (checkin_id,), commit=True)
+    writer.checked_users(checkin_id)  # 预先加载去重集合
+
+    start = time.perf_counter()
+    jobs = [gevent.spawn(writer.submit, checkin_id, uid, 'checked') for uid in user_ids]
+    gevent.joinall(jobs)
+    acked = time.perf_counter() - start
+    writer.flush()
+    durable = time.perf_counter() - start
+
+    failed = sum(1 for job in jobs if not job.successful())
+    count = Database.execute_query(
+        "SELECT COUNT(*) AS n FROM checkin_records WHERE checkin_id = %s", (checkin_id,), fetch_one=True
+    )['n']
+    stats = writer.stats()
+    commits = stats['flushes'] + stats['errors']
+    print(f"{mode:<6} {acked * 1000:>10.1f} {durable * 1000:>10.1f} {commits:>8} {commits / durable:>10.1f}"
+          f" {count / durable:>10.1f} {count:>6} {failed:>6}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='签到记录写入压测')
+    parser.add_argument('--users', type=int, default=500)
+    parser.add_argument('--modes', nargs='+', default=['sync', 'batch', 'async'])
+    args = parser.parse_args()
+
+    rows = Database.execute_query("SELECT user_id FROM users ORDER BY user_id LIMIT %s", (args.users,), fetch_all=True)
+    user_ids = [r['user_id'] for r in rows]
+    if len(user_ids) < args.users:
+        print(f'数据库中只有 {len(user_ids)} 个用户，按 {len(user_ids)} 并发测试')
+
+    checkin_id = create_checkin(user_ids[0])
+    try:
+        print(f"并发签到 {len(user_ids)} 人，连接池 {Database.pool_stats()['max_size']}")
+        print(f"{'模式':<6} {'确认(ms)':>10} {'落库(ms)':>10} {'提交次数':>8} {'提交/秒':>10} {'记录/秒':>10}"
+              f" {'落库数':>6} {'失败':>6}")
+        for mode in args.modes:
+            run(mode, checkin_id, user_ids)
+    finally:
+        Database.execute_query("DELETE FROM checkin_records WHERE checkin_id = %s", (checkin_id,), commit=True)
+        Database.execute_query("DELETE FROM checkins WHERE id = %s", (checkin_id,), commit=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,208 @@
+"""
+多进程 Socket.IO 压测
+启动本地消息总线（dev_broker.py）和 W 个后端进程，N 个客户端轮流连接到各个进程，验证：
+
+1. 跨进程投递：每个用户给连接在下一个进程上的用户发消息（按 user_<id> 房间发送），全部送达
+2. 共享在线状态：任一进程都能查到连接在其他进程上的用户在线，断开后变为离线
+3. 跨进程通话状态：在一个进程上发起的通话可以在另一个进程上结束
+4. 群发吞吐：一个客户端向包含全部用户的房间连续发送 K 条消息，统计送达速率
+
+后端进程使用与 websocket_server 相同的消息队列参数和 session_registry 中的共享登记表，
+但认证直接使用客户端给出的 user_id（不需要数据库和 JWT）。
+
+用法:
+    python loadtest_socketio_cluster.py
+    python loadtest_socketio_cluster.py --workers 4 --clients 200 --messages 50
+"""
+import sys
+
+if '--worker' in sys.argv:
+    from gevent import monkey
+    monkey.patch_all()
+
+import os
+import time
+import argparse
+import threading
+import subprocess
+
+
+def run_worker(port, url):
+    """后端进程：与 init_socketio 相同的消息队列配置 + 共享会话登记表"""
+    os.environ['SHARED_STATE_URL'] = url
+    from flask import Flask, request
+    from flask_socketio import SocketIO, join_room
+    from session_registry import socket_sessions, active_calls
+
+    app = Flask(__name__)
+    sio = SocketIO(app, async_mode='gevent', message_queue=url, channel='loadtest-socketio')
+    socket_sessions.start()
+
+    @sio.on('authenticate')
+    def authenticate(data):
+        user_id = int(data['user_id'])
+        socket_sessions.register(request.sid, user_id)
+        join_room(f'user_{user_id}')
+        join_room('group_all')
+        return {'port': port}
+
+    @sio.on('disconnect')
+    def disconnect():
+        socket_sessions.unregister(request.sid)
+
+    @sio.on('send')
+    def send(data):
+        sio.emit('deliver', data, room=f"user_{data['to']}")
+
+    @sio.on('fanout')
+    def fanout(data):
+        sio.emit('fanout', data, room='group_all')
+
+    @sio.on('presence')
+    def presence(data):
+        return socket_sessions.is_online(int(data['user_id']))
+
+    @sio.on('call_user')
+    def call_user(data):
+        active_calls.start(socket_sessions.user_of(request.sid), int(data['receiver_id']), True)
+
+    @sio.on('end_call')
+    def end_call(data):
+        return active_calls.pop_for(socket_sessions.user_of(request.sid)) is not None
+
+    sio.run(app, host='127.0.0.1', port=port, log_output=False)
+
+
+class Client:
+    """一个测试用户的连接"""
+
+    def __init__(self, user_id, port):
+        import socketio
+        self.user_id = user_id
+        self.port = port
+        self.received = []
+        self.fanout = 0
+        self.fanout_done = threading.Event()
+        self.expected_fanout = 0
+        self.sio = socketio.Client(reconnection=False)
+        self.sio.on('deliver', self.received.append)
+        self.sio.on('fanout', self._on_fanout)
+
+    def _on_fanout(self, data):
+        self.fanout += 1
+        if self.fanout >= self.expected_fanout:
+            self.fanout_done.set()
+
+    def connect(self):
+        self.sio.connect(f'http://127.0.0.1:{self.port}', transports=['websocket'])
+        return self.sio.call('authenticate', {'user_id': self.user_id}, timeout=10)
+
+    def call(self, event, data):
+        return self.sio.call(event, data, timeout=10)
+
+
+def wait_for_port(port, timeout=30):
+    import socket
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f'后端进程 {port} 启动超时')
+
+
+def wait_until(condition, timeout=10):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if condition():
+            return True
+        time.sleep(0.02)
+    return condition()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='多进程 Socket.IO 压测')
+    parser.add_argument('--workers', type=int, default=3)
+    parser.add_argument('--clients', type=int, default=60)
+    parser.add_argument('--messages', type=int, default=20, help='群发消息条数')
+    parser.add_argument('--base-port', type=int, default=5101)
+    parser.add_argument('--worker', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--port', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--url', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args.port, args.url)
+        return
+
+    from dev_broker import Broker
+    url = Broker(port=0).start()
+    ports = [args.base_port + i for i in range(args.workers)]
+    workers = [subprocess.Popen([sys.executable, __file__, '--worker', '--port', str(p), '--url', url])
+               for p in ports]
+    clients = []
+    try:
+        for port in ports:
+            wait_for_port(port)
+        print(f"消息总线 {url}，{args.workers} 个后端进程，{args.clients} 个客户端")
+
+        clients = [Client(i + 1, ports[i % len(ports)]) for i in range(args.clients)]
+        for client in clients:
+            assert client.connect()['port'] == client.port
+
+        # 1. 跨进程投递：每个用户发给下一个用户（轮流分配，相邻用户在不同进程上）
+        start = time.perf_counter()
+        for i, client in enumerate(clients):
+            target = clients[(i + 1) % len(clients)]
+            client.sio.emit('send', {'from': client.user_id, 'to': target.user_id})
+        delivered = wait_until(lambda: all(c.received for c in clients))
+        elapsed = (time.perf_counter() - start) * 1000
+        for i, client in enumerate(clients):
+            sender = clients[i - 1]
+            assert [m['from'] for m in client.received] == [sender.user_id], f'用户 {client.user_id} 收到 {client.received}'
+        cross = sum(c.port != clients[(i + 1) % len(clients)].port for i, c in enumerate(clients))
+        print(f"[跨进程投递] {len(clients)} 条全部送达（{cross} 条跨进程），耗时 {elapsed:.1f}ms" if delivered else '[跨进程投递] 失败')
+        assert delivered
+
+        # 2. 共享在线状态
+        probe, other = clients[0], clients[-1]
+        assert other.port != probe.port or args.workers == 1
+        assert all(probe.call('presence', {'user_id': c.user_id}) for c in clients)
+        other.sio.disconnect()
+        offline = wait_until(lambda: not probe.call('presence', {'user_id': other.user_id}))
+        print(f"[在线状态] 其他进程上的 {len(clients)} 个用户均在线，断开后{'离线' if offline else '仍显示在线'}")
+        assert offline
+        clients.pop()
+
+        # 3. 跨进程通话状态：在一个进程上发起，在另一个进程上由接听者结束
+        caller, receiver = clients[0], clients[1]
+        caller.sio.emit('call_user', {'receiver_id': receiver.user_id})
+        ended = wait_until(lambda: receiver.call('end_call', {}))
+        print(f"[通话状态] 进程 {caller.port} 发起的通话{'已由进程 ' + str(receiver.port) + ' 结束' if ended else '未找到'}")
+        assert ended
+
+        # 4. 群发吞吐
+        for client in clients:
+            client.expected_fanout = args.messages
+        start = time.perf_counter()
+        for n in range(args.messages):
+            clients[0].sio.emit('fanout', {'n': n})
+        complete = all(c.fanout_done.wait(timeout=30) for c in clients)
+        elapsed = time.perf_counter() - start
+        total = sum(c.fanout for c in clients)
+        print(f"[群发] {args.messages} 条 x {len(clients)} 人 = {total} 次送达，耗时 {elapsed * 1000:.1f}ms，"
+              f"{total / elapsed:.0f} 次/秒")
+        assert complete and total == args.messages * len(clients)
+        print('全部通过')
+    finally:
+        # 先停止后端进程，客户端随之断开（逐个主动断开需要等待每个连接的关闭握手）
+        for worker in workers:
+            worker.terminate()
+        for worker in workers:
+            worker.wait()
+
+
+if __name__ == '__main__':
+    main()
@@ -7,6 +7,8 @@ from datetime import datetime
 from werkzeug.utils import secure_filename
 from database import Database
 from config import Config
+from presence import contact_graph
+from online_status import online_status
 
 class MessageService:
     """私聊消息服务"""
@@ -45,6 +47,7 @@ class MessageService:
             INSERT INTO private_conversations (user1_id, user2_id) VALUES (%s, %s)
         """
         Database.execute_query(insert_sql, (user1_id, user2_id), commit=True)
+        contact_graph.add(user1_id, user2_id)
         
         # 获取新创建的会话ID
         result = Database.execute_query(sql, (user1_id, user2_id), fetch_one=True)
@@ -211,28 +214,12 @@ class MessageService:
     
     @staticmethod
     def update_online_status(user_id, is_online, socket_id=None):
-        """更新用户在线状态"""
-        sql = """
-            INSERT INTO user_online_status (user_id, is_online, socket_id)
-            VALUES (%s, %s, %s)
-            ON DUPLICATE KEY UPDATE is_online = %s, socket_id = %s, last_seen = NOW()
-        """
-        Database.execute_query(sql, (user_id, is_online, socket_id, is_online, socket_id), commit=True)
+        """更新用户在线状态（先更新内存，后台批量写入数据库）"""
+        online_status.set(user_id, is_online, socket_id)
     
     @staticmethod
     def get_online_status(user_ids):
         """获取用户在线状态"""
         if not user_ids:
             return {}
-        
-        placeholders = ','.join(['%s'] * len(user_ids))
-        sql = f"SELECT user_id, is_online, last_seen FROM user_online_status WHERE user_id IN ({placeholders})"
-        results = Database.execute_query(sql, tuple(user_ids), fetch_all=True)
-        
-        status_map = {}
-        for r in results:
-            status_map[r['user_id']] = {
-                'is_online': r['is_online'],
-                'last_seen': r['last_seen'].strftime('%Y-%m-%d %H:%M:%S') if r['last_seen'] else None
-            }
-        return status_map
+        return online_status.get(user_ids)
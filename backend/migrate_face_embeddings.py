@@ -0,0 +1,106 @@
+"""
+迁移 user_faces.face_embedding 为二进制格式
+
+1. 将 face_embedding 列从 TEXT 改为 BLOB（旧 JSON 文本原样保留）
+2. 分批把 JSON 文本转换为二进制格式
+
+读取端（embedding_codec.decode_embedding）同时兼容两种格式，迁移可在线分批进行。
+迁移完成后把 FACE_EMBEDDING_STORAGE 设为 float32（或 float16），新写入也使用二进制格式。
+
+用法:
+    python migrate_face_embeddings.py                 # 转换为 float32
+    python migrate_face_embeddings.py --dtype float16
+    python migrate_face_embeddings.py --dry-run       # 只统计不写入
+"""
+import argparse
+from database import Database
+from embedding_codec import is_binary, encode_binary, decode_embedding
+
+
+def ensure_blob_column():
+    """确保 face_embedding 列为 BLOB 类型"""
+    check_sql = """
+        SELECT DATA_TYPE
+        FROM INFORMATION_SCHEMA.COLUMNS
+        WHERE TABLE_SCHEMA = DATABASE()
+        AND TABLE_NAME = 'user_faces'
+        AND COLUMN_NAME = 'face_embedding'
+    """
+    result = Database.execute_query(check_sql, fetch_one=True)
+    if not result:
+        raise RuntimeError('user_faces.face_embedding 字段不存在')
+
+    if result['DATA_TYPE'].lower() in ('blob', 'mediumblob', 'longblob'):
+        print(f"- face_embedding 已是 {result['DATA_TYPE']} 类型")
+        return
+
+    alter_sql = """
+        ALTER TABLE user_faces
+        MODIFY COLUMN face_embedding BLOB NOT NULL COMMENT '人脸特征向量（二进制或旧版JSON）'
+    """
+    Database.execute_query(alter_sql, commit=True)
+    print(f"✓ face_embedding 类型 {result['DATA_TYPE']} -> BLOB")
+
+
+def migrate(dtype='float32', batch_size=500, dry_run=False):
+    """分批转换 JSON 特征为二进制格式"""
+    if not dry_run:
+        ensure_blob_column()
+
+    last_id = 0
+    converted = skipped = failed = 0
+    bytes_before = bytes_after = 0
+
+    while True:
+        rows = Database.execute_query("""
+            SELECT face_id, face_embedding FROM user_faces
+            WHERE face_id > %s ORDER BY face_id LIMIT %s
+        """, (last_id, batch_size), fetch_all=True)
+        if not rows:
+            break
+        last_id = rows[-1]['face_id']
+
+        updates = []
+        for row in rows:
+            value = row['face_embedding']
+            if is_binary(value):
+                skipped += 1
+                continue
+            try:
+                data = encode_binary(decode_embedding(value), dtype)
+            except (ValueError, TypeError) as e:
+                failed += 1
+                print(f"✗ face_id={row['face_id']} 解析失败: {e}")
+                continue
+            bytes_before += len(value)
+            bytes_after += len(data)
+            updates.append((data, row['face_id']))
+
+        if updates and not dry_run:
+            conn = Database.get_connection()
+            try:
+                with conn.cursor() as cursor:
+                    cursor.executemany(
+                        "UPDATE user_faces SET face_embedding = %s, updated_at = updated_at WHERE face_id = %s",
+                        updates
+                    )
+                conn.commit()
+            finally:
+                conn.close()
+        converted += len(updates)
+        print(f"  已处理到 face_id={last_id}，本批转换 {len(updates)} 条")
+
+    print(f"\n转换 {converted} 条，已是二进制 {skipped} 条，失败 {failed} 条")
+    if converted:
+        print(f"存储 {bytes_before} -> {bytes_after} 字节（{bytes_before / max(bytes_after, 1):.1f}x）")
+    if dry_run:
+        print("（dry-run，未写入数据库）")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='迁移人脸特征为二进制格式')
+    parser.add_argument('--dtype', choices=['float32', 'float16'], default='float32')
+    parser.add_argument('--batch-size', type=int, default=500)
+    parser.add_argument('--dry-run', action='store_true')
+    args = parser.parse_args()
+    migrate(args.dtype, args.batch_size, args.dry_run)
@@ -0,0 +1,222 @@
+"""
+用户在线状态（写回缓存）
+每次认证和断开原先都用单独的连接同步执行一次 INSERT ... ON DUPLICATE KEY UPDATE，
+上课时上千名学生同时连接就是上千次同步写入。这里以内存为准：
+
+- set: 只更新内存并标记为待写入
+- 后台每隔 ONLINE_STATUS_FLUSH_INTERVAL 秒把有变化的用户合并为一条多行 upsert 写入 user_online_status
+- get: 是否在线取自会话登记表（多进程部署时为共享登记表），最后在线时间取自内存，
+  内存中没有的用户从数据库读取一次。多进程部署时用户的状态可能由其他进程写入，
+  超过 ONLINE_STATUS_CACHE_TTL 秒且没有待写入变化的内存记录重新从数据库读取
+- 多个进程的刷新可能乱序到达，upsert 只保留 last_seen 较新的状态
+
+进程崩溃时未写入的变化会丢失，表中会残留 is_online = TRUE 的行；启动时 recover()
+把不在会话登记表中的在线行改为离线。
+"""
+import time
+import atexit
+import threading
+from datetime import datetime
+from database import Database
+from session_registry import socket_sessions
+from config import Config
+
+
+class OnlineStatusStore:
+    """
+    在线状态写回缓存
+
+    - interval: 刷新间隔（秒）
+    - batch_size: 每条 upsert 最多写入的行数
+    - max_users: 内存中保留的用户数上限，超出时丢弃已写入的离线用户
+    - cache_ttl: 内存记录的有效期（秒），None 表示不过期（单进程部署时内存即为最新状态）
+    """
+
+    def __init__(self, interval=None, batch_size=500, max_users=100000, cache_ttl=None, shared=None):
+        self.interval = Config.ONLINE_STATUS_FLUSH_INTERVAL if interval is None else interval
+        self.batch_size = batch_size
+        self.max_users = max_users
+        if shared is None:
+            shared = bool(Config.SOCKETIO_MESSAGE_QUEUE)
+        self.cache_ttl = (Config.ONLINE_STATUS_CACHE_TTL if cache_ttl is None else cache_ttl) if shared else None
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._has_data = threading.Event()
+        self._state = {}  # user_id -> {is_online, socket_id, last_seen, cached_at}
+        self._dirty = set()
+        self._thread = None
+
+        self._updates = 0
+        self._rows_written = 0
+        self._flushes = 0
+        self._errors = 0
+
+    def set(self, user_id, is_online, socket_id=None):
+        """更新内存中的在线状态，稍后写入数据库"""
+        with self._lock:
+            self._state[user_id] = {
+                'is_online': bool(is_online),
+                'socket_id': socket_id if is_online else None,
+                'last_seen': datetime.now().replace(microsecond=0),
+                'cached_at': time.monotonic()
+            }
+            self._dirty.add(user_id)
+            self._updates += 1
+        if self.interval <= 0:
+            self.flush()
+            return
+        self._ensure_thread()
+        self._has_data.set()
+
+    def get(self, user_ids):
+        """
+        批量查询在线状态
+
+        Returns:
+            dict: {user_id: {is_online, last_seen}}，从未登录过的用户不在结果中
+        """
+        user_ids = {int(uid) for uid in user_ids}
+        with self._lock:
+            known = {uid: self._state[uid]['last_seen'] for uid in user_ids if self._fresh(uid)}
+        missing = user_ids - known.keys()
+        if missing:
+            placeholders = ','.join(['%s'] * len(missing))
+            rows = Database.execute_query(
+                f"SELECT user_id, is_online, last_seen FROM user_online_status WHERE user_id IN ({placeholders})",
+                tuple(missing), fetch_all=True
+            ) or []
+            now = time.monotonic()
+            with self._lock:
+                self._trim()
+                for r in rows:
+                    # 查询期间内存中可能已有更新的状态，待写入或较新的内存记录不被覆盖
+                    entry = self._state.get(r['user_id'])
+                    if entry is None or (r['user_id'] not in self._dirty and
+                                         (entry['last_seen'] is None or
+                                          (r['last_seen'] and r['last_seen'] >= entry['last_seen']))):
+                        entry = self._state[r['user_id']] = {
+                            'is_online': bool(r['is_online']), 'socket_id': None, 'last_seen': r['last_seen']
+                        }
+                    entry['cached_at'] = now
+                    known[r['user_id']] = entry['last_seen']
+
+        return {
+            uid: {
+                'is_online': socket_sessions.is_online(uid),
+                'last_seen': last_seen.strftime('%Y-%m-%d %H:%M:%S') if last_seen else None
+            }
+            for uid, last_seen in known.items()
+        }
+
+    def _fresh(self, user_id):
+        """内存中是否有可以直接使用的记录（调用方持有锁）"""
+        entry = self._state.get(user_id)
+        if entry is None:
+            return False
+        if self.cache_ttl is None or user_id in self._dirty:
+            return True
+        return time.monotonic() - entry['cached_at'] < self.cache_ttl
+
+    def _trim(self):
+        """内存中的用户过多时丢弃已写入的离线用户（调用方持有锁）"""
+        if len(self._state) < self.max_users:
+            return
+        for uid in [uid for uid, s in self._state.items() if not s['is_online'] and uid not in self._dirty]:
+            del self._state[uid]
+
+    # ==================== 写入 ====================
+
+    def flush(self):
+        """把有变化的用户写入数据库，返回写入行数"""
+        with self._flush_lock:
+            with self._lock:
+                dirty, self._dirty = self._dirty, set()
+                rows = []
+                for uid in sorted(dirty):
+                    state = self._state[uid]
+                    rows.append((uid, state['is_online'], state['socket_id'], state['last_seen']))
+            if not rows:
+                return 0
+            written = 0
+            for start in range(0, len(rows), self.batch_size):
+                batch = rows[start:start + self.batch_size]
+                try:
+                    self._write(batch)
+                    written += len(batch)
+                except Exception as e:
+                    # 写入失败的用户重新标记，下次刷新时重试
+                    with self._lock:
+                        self._dirty.update(uid for uid, *_ in batch)
+                        self._errors += 1
+                    print(f'[在线状态] 写入失败: {e}')
+            with self._lock:
+                self._rows_written += written
+                self._flushes += 1
+            return written
+
+    @staticmethod
+    def _write(rows):
+        # 多个进程的刷新可能乱序到达：只有不早于表中 last_seen 的状态才覆盖（last_seen 精确到秒，同一秒内以后写入的为准）。
+        # MySQL 按顺序执行赋值，last_seen 必须最后更新，前面的比较才使用表中原来的值
+        sql = f"""
+            INSERT INTO user_online_status (user_id, is_online, socket_id, last_seen)
+            VALUES {', '.join(['(%s, %s, %s, %s)'] * len(rows))}
+            ON DUPLICATE KEY UPDATE
+                is_online = IF(VALUES(last_seen) >= last_seen, VALUES(is_online), is_online),
+                socket_id = IF(VALUES(last_seen) >= last_seen, VALUES(socket_id), socket_id),
+                last_seen = GREATEST(last_seen, VALUES(last_seen))
+        """
+        Database.execute_query(sql, tuple(v for row in rows for v in row), commit=True)
+
+    def recover(self):
+        """
+        进程启动时调用：把表中残留的在线行（上次崩溃时未写入离线状态）改为离线
+
+        多进程部署时跳过仍连接在其他进程上的用户。
+        """
+        rows = Database.execute_query(
+            "SELECT user_id FROM user_online_status WHERE is_online = TRUE", fetch_all=True
+        ) or []
+        stale = [r['user_id'] for r in rows if not socket_sessions.is_online(r['user_id'])]
+        for start in range(0, len(stale), self.batch_size):
+            batch = stale[start:start + self.batch_size]
+            Database.execute_query(
+                f"UPDATE user_online_status SET is_online = FALSE, socket_id = NULL "
+                f"WHERE user_id IN ({','.join(['%s'] * len(batch))}) AND is_online = TRUE",
+                tuple(batch), commit=True
+            )
+        if stale:
+            print(f'[在线状态] 已将 {len(stale)} 个残留的在线用户改为离线')
+        return len(stale)
+
+    def _ensure_thread(self):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, daemon=True)
+                    self._thread.start()
+
+    def _run(self):
+        while True:
+            self._has_data.wait()
+            self._has_data.clear()
+            time.sleep(self.interval)  # 攒一个间隔内的变化
+            try:
+                self.flush()
+            except Exception as e:
+                print(f'[在线状态] 刷新失败: {e}')
+
+    def stats(self):
+        with self._lock:
+            return {
+                'users': len(self._state),
+                'dirty': len(self._dirty),
+                'updates': self._updates,
+                'rows_written': self._rows_written,
+                'flushes': self._flushes,
+                'errors': self._errors
+            }
+
+
+online_status = OnlineStatusStore()
+atexit.register(online_status.flush)
@@ -0,0 +1,215 @@
+"""
+在线状态广播
+用户每次连接和断开时，broadcast_online_status 原先都调用 MessageService.get_user_conversations
+（每个会话带 4 个相关子查询的会话列表查询）只为了知道要通知谁；手机网络不稳定时反复断线重连，
+这条查询和 user_status_changed 推送会被重复执行。这里：
+
+- ContactGraph: 用户 -> 私聊联系人集合的进程内缓存，首次用到时用一条只查两列的查询加载，
+  创建会话时直接加边；另设 ttl，多进程部署时其他进程新建的会话最多 ttl 秒后可见
+- PresenceBroadcaster: 在线状态变化先登记，防抖窗口结束后按会话登记表中的实际状态广播，
+  与上次广播相同（例如断开后很快重连）则不广播。多进程部署时用户的首个连接和最后一个连接
+  可能在不同进程上，上次广播的状态保存在共享存储中（SharedAnnouncedSet）
+"""
+import time
+import heapq
+import threading
+from database import Database
+from config import Config
+
+
+class ContactGraph:
+    """
+    私聊联系人缓存
+
+    - ttl: 条目有效期（秒）
+    - max_users: 缓存用户数上限，超出时淘汰最早加载的条目
+    """
+
+    def __init__(self, ttl=None, max_users=None):
+        self.ttl = Config.CONTACT_GRAPH_TTL if ttl is None else ttl
+        self.max_users = max_users or Config.CONTACT_GRAPH_MAX_USERS
+        self._lock = threading.Lock()
+        self._peers = {}  # user_id -> (peers, expires_at)，按加载顺序
+        self._hits = 0
+        self._loads = 0
+
+    def peers(self, user_id):
+        """用户的私聊联系人（返回副本）"""
+        now = time.monotonic()
+        with self._lock:
+            cached = self._peers.get(user_id)
+            if cached and cached[1] > now:
+                self._hits += 1
+                return set(cached[0])
+        peers = self._load(user_id)
+        with self._lock:
+            self._loads += 1
+            self._peers.pop(user_id, None)
+            while len(self._peers) >= self.max_users:
+                del self._peers[next(iter(self._peers))]
+            self._peers[user_id] = (peers, now + self.ttl)
+        return set(peers)
+
+    @staticmethod
+    def _load(user_id):
+        rows = Database.execute_query(
+            "SELECT user1_id, user2_id FROM private_conversations WHERE user1_id = %s OR user2_id = %s",
+            (user_id, user_id), fetch_all=True
+        ) or []
+        return {r['user2_id'] if r['user1_id'] == user_id else r['user1_id'] for r in rows}
+
+    def add(self, user1_id, user2_id):
+        """创建会话后加边（未缓存的用户下次加载时会查到）"""
+        with self._lock:
+            for a, b in ((user1_id, user2_id), (user2_id, user1_id)):
+                cached = self._peers.get(a)
+                if cached:
+                    cached[0].add(b)
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._peers.pop(user_id, None)
+
+    def stats(self):
+        with self._lock:
+            total = self._hits + self._loads
+            return {
+                'users': len(self._peers),
+                'hits': self._hits,
+                'loads': self._loads,
+                'hit_rate': round(self._hits / total, 4) if total else 0
+            }
+
+
+class AnnouncedSet:
+    """上次广播为在线的用户（进程内）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._users = set()
+
+    def mark(self, user_id, is_online):
+        """记录本次广播的状态，返回是否与上次不同"""
+        with self._lock:
+            if (user_id in self._users) == is_online:
+                return False
+            if is_online:
+                self._users.add(user_id)
+            else:
+                self._users.discard(user_id)
+            return True
+
+
+class SharedAnnouncedSet:
+    """上次广播为在线的用户（Redis 集合，SADD / SREM 的返回值保证多个进程中只有一个广播）"""
+
+    def __init__(self, redis_client, prefix='ws'):
+        self.redis = redis_client
+        self.key = f'{prefix}:presence:announced'
+
+    def mark(self, user_id, is_online):
+        if is_online:
+            return bool(self.redis.sadd(self.key, user_id))
+        return bool(self.redis.srem(self.key, user_id))
+
+
+class PresenceBroadcaster:
+    """
+    在线状态防抖广播
+
+    - emit: emit(user_id, is_online) 实际广播函数
+    - window: 防抖窗口（秒），窗口内同一用户的多次变化合并为一次
+    - is_online: is_online(user_id) 查询实际在线状态，未设置时使用最后登记的状态
+    - announced: 上次广播的状态，多进程部署时换成 SharedAnnouncedSet
+    """
+
+    def __init__(self, emit=None, window=None, is_online=None, announced=None):
+        self.emit = emit
+        self.window = Config.PRESENCE_DEBOUNCE if window is None else window
+        self.is_online = is_online
+        self.announced = announced or AnnouncedSet()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._pending = {}  # user_id -> 最新状态
+        self._heap = []  # (due_at, user_id)
+        self._thread = None
+
+        self._changes = 0
+        self._emitted = 0
+        self._suppressed = 0
+
+    def changed(self, user_id, is_online):
+        """登记在线状态变化，窗口结束后广播"""
+        if self.window <= 0:
+            self._deliver(user_id, is_online)
+            return
+        with self._lock:
+            self._changes += 1
+            first = user_id not in self._pending
+            self._pending[user_id] = is_online
+            if first:
+                heapq.heappush(self._heap, (time.monotonic() + self.window, user_id))
+        self._ensure_thread()
+        if first:
+            self._wake.set()
+
+    def _deliver(self, user_id, is_online):
+        try:
+            # 最后一次变化可能发生在其他进程上，以会话登记表为准
+            if self.is_online is not None:
+                is_online = bool(self.is_online(user_id))
+            changed = self.announced.mark(user_id, is_online)
+        except Exception as e:
+            print(f'[在线状态] 查询状态错误: {e}')
+            return
+        with self._lock:
+            if changed:
+                self._emitted += 1
+            else:
+                self._suppressed += 1
+        if not changed:
+            return
+        try:
+            self.emit(user_id, is_online)
+        except Exception as e:
+            print(f'[在线状态] 广播错误: {e}')
+
+    def flush(self, now=None):
+        """广播所有已到期的状态变化，返回下一个到期时间"""
+        now = time.monotonic() if now is None else now
+        due = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                _, user_id = heapq.heappop(self._heap)
+                due.append((user_id, self._pending.pop(user_id)))
+            next_due = self._heap[0][0] if self._heap else None
+        for user_id, is_online in due:
+            self._deliver(user_id, is_online)
+        return next_due
+
+    def _ensure_thread(self):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, daemon=True)
+                    self._thread.start()
+
+    def _run(self):
+        while True:
+            next_due = self.flush()
+            timeout = None if next_due is None else max(next_due - time.monotonic(), 0)
+            self._wake.wait(timeout)
+            self._wake.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'pending': len(self._pending),
+                'changes': self._changes,
+                'emitted': self._emitted,
+                'suppressed': self._suppressed
+            }
+
+
+contact_graph = ContactGraph()
+presence_broadcaster = PresenceBroadcaster()
@@ -0,0 +1,324 @@
+"""
+WebSocket 会话登记表
+原先 connected_users 只保存 {user_id: sid}：每个事件都要遍历整个字典按 sid 查用户，
+同一用户打开第二个标签页会覆盖第一个连接。这里维护双向索引：
+
+- sid -> 会话（user_id 和连接信息）
+- user_id -> 该用户的全部 sid
+
+按 sid 查用户、按用户查连接都是 O(1)。用户只要还有一个连接就算在线，
+第一个连接认证时上线、最后一个连接断开时下线。
+
+多进程部署（配置 SHARED_STATE_URL）时，在线状态和通话状态放在 Redis 中由所有进程共享：
+
+- ws:user:<user_id>    该用户在所有进程上的 sid 集合
+- ws:worker:<worker>   该进程登记的 "user_id:sid"，进程崩溃后由其他进程清理
+- ws:alive:<worker>    进程心跳（带过期时间）
+- ws:calls             进行中的通话 {caller_id: json}
+
+本进程的 sid -> 用户仍在内存中查询（事件总是由连接所在的进程处理），不需要访问 Redis。
+"""
+import json
+import time
+import atexit
+import uuid
+import threading
+from config import Config
+
+
+class SessionRegistry:
+    """已认证的 WebSocket 会话"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._sessions = {}  # sid -> {user_id, connected_at, last_seen, ...}
+        self._by_user = {}  # user_id -> {sid}
+
+    def register(self, sid, user_id, **meta):
+        """
+        登记已认证的连接（同一 sid 重新认证为其他用户时先解除原用户）
+
+        Returns:
+            bool: 是否为该用户的第一个连接（即用户由离线变为在线）
+        """
+        now = time.time()
+        with self._lock:
+            previous = self._sessions.get(sid)
+            if previous is not None and previous['user_id'] != user_id:
+                self._discard(sid, previous['user_id'])
+            sids = self._by_user.setdefault(user_id, set())
+            first = not sids
+            sids.add(sid)
+            self._sessions[sid] = {'user_id': user_id, 'connected_at': now, 'last_seen': now, **meta}
+        return first
+
+    def unregister(self, sid):
+        """
+        移除连接
+
+        Returns:
+            (user_id, last): 该连接的用户（未认证的连接为 None）、是否为该用户的最后一个连接
+        """
+        with self._lock:
+            session = self._sessions.pop(sid, None)
+            if session is None:
+                return None, False
+            return session['user_id'], self._discard(sid, session['user_id'])
+
+    def _discard(self, sid, user_id):
+        """从用户的连接集合中移除 sid，返回用户是否已没有连接"""
+        sids = self._by_user.get(user_id)
+        if sids is None:
+            return False
+        sids.discard(sid)
+        if sids:
+            return False
+        del self._by_user[user_id]
+        return True
+
+    def user_of(self, sid):
+        """sid 对应的用户，未认证返回 None"""
+        session = self._sessions.get(sid)
+        return session['user_id'] if session else None
+
+    def touch(self, sid):
+        """记录连接最近一次活动时间，返回对应用户"""
+        session = self._sessions.get(sid)
+        if session is None:
+            return None
+        session['last_seen'] = time.time()
+        return session['user_id']
+
+    def session(self, sid):
+        """连接信息副本"""
+        session = self._sessions.get(sid)
+        return dict(session) if session else None
+
+    def sids_of(self, user_id):
+        with self._lock:
+            return set(self._by_user.get(user_id, ()))
+
+    def is_online(self, user_id):
+        return user_id in self._by_user
+
+    def online_users(self):
+        with self._lock:
+            return list(self._by_user)
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'sessions': len(self._sessions),
+                'users': len(self._by_user),
+                'multi_device_users': sum(1 for sids in self._by_user.values() if len(sids) > 1)
+            }
+
+
+class SharedSessionRegistry(SessionRegistry):
+    """
+    多进程共享的会话登记表
+
+    - url: Redis 连接地址（开发和测试时可以使用 dev_broker.py）
+    - prefix: 键前缀
+    - heartbeat: 心跳间隔（秒），超过 3 个间隔没有心跳的进程视为已退出，其连接由其他进程清理
+    - on_offline: 清理已退出进程的连接后，对由此下线的用户调用 on_offline(user_id)
+    """
+
+    def __init__(self, url, prefix='ws', heartbeat=None, on_offline=None):
+        super().__init__()
+        import redis
+        self.redis = redis.Redis.from_url(url, decode_responses=True)
+        self.prefix = prefix
+        self.worker_id = uuid.uuid4().hex[:12]
+        self.heartbeat = heartbeat or Config.SOCKETIO_HEARTBEAT
+        self.on_offline = on_offline
+        self._thread = None
+        self._purged = 0
+
+    def _key(self, *parts):
+        return ':'.join((self.prefix, *map(str, parts)))
+
+    def register(self, sid, user_id, **meta):
+        previous = self.user_of(sid)
+        if previous is not None and previous != user_id:
+            self.unregister(sid)
+        super().register(sid, user_id, **meta)
+        pipe = self.redis.pipeline()
+        pipe.sadd(self._key('user', user_id), sid)
+        pipe.sadd(self._key('worker', self.worker_id), f'{user_id}:{sid}')
+        pipe.scard(self._key('user', user_id))
+        return pipe.execute()[-1] == 1
+
+    def unregister(self, sid):
+        user_id, _ = super().unregister(sid)
+        if user_id is None:
+            return None, False
+        pipe = self.redis.pipeline()
+        pipe.srem(self._key('user', user_id), sid)
+        pipe.srem(self._key('worker', self.worker_id), f'{user_id}:{sid}')
+        pipe.scard(self._key('user', user_id))
+        return user_id, pipe.execute()[-1] == 0
+
+    def sids_of(self, user_id):
+        return self.redis.smembers(self._key('user', user_id))
+
+    def is_online(self, user_id):
+        return bool(self.redis.exists(self._key('user', user_id)))
+
+    def online_users(self):
+        prefix = self._key('user', '')
+        return [int(key[len(prefix):]) for key in self.redis.scan_iter(match=f'{prefix}*', count=500)]
+
+    # ==================== 进程心跳 ====================
+
+    def start(self):
+        """启动心跳线程（进程启动时调用一次），进程正常退出时移除本进程的连接"""
+        if self._thread is None:
+            self._beat()
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+            atexit.register(self.shutdown)
+
+    def _run(self):
+        while True:
+            time.sleep(self.heartbeat)
+            try:
+                self._beat()
+                self.purge_dead_workers()
+            except Exception as e:
+                print(f'[会话登记] 心跳失败: {e}')
+
+    def _beat(self):
+        pipe = self.redis.pipeline()
+        pipe.set(self._key('alive', self.worker_id), int(time.time()), ex=int(self.heartbeat * 3))
+        pipe.sadd(self._key('workers'), self.worker_id)
+        pipe.execute()
+
+    def purge_dead_workers(self):
+        """清理心跳已过期的进程登记的连接，返回因此下线的用户"""
+        offline = []
+        for worker_id in self.redis.smembers(self._key('workers')):
+            if worker_id == self.worker_id or self.redis.exists(self._key('alive', worker_id)):
+                continue
+            # 只有一个进程能取走该进程的连接列表
+            pipe = self.redis.pipeline()
+            pipe.smembers(self._key('worker', worker_id))
+            pipe.delete(self._key('worker', worker_id))
+            pipe.srem(self._key('workers'), worker_id)
+            entries = pipe.execute()[0]
+            for entry in entries:
+                user_id, sid = entry.split(':', 1)
+                pipe = self.redis.pipeline()
+                pipe.srem(self._key('user', user_id), sid)
+                pipe.scard(self._key('user', user_id))
+                if pipe.execute()[-1] == 0:
+                    offline.append(int(user_id))
+            self._purged += len(entries)
+            print(f'[会话登记] 清理已退出进程 {worker_id} 的 {len(entries)} 个连接')
+        for user_id in set(offline):
+            if self.on_offline:
+                try:
+                    self.on_offline(user_id)
+                except Exception as e:
+                    print(f'[会话登记] 下线通知失败: {e}')
+        return offline
+
+    def shutdown(self):
+        """进程正常退出时移除本进程登记的连接和心跳"""
+        with self._lock:
+            sids = list(self._sessions)
+        for sid in sids:
+            user_id, last = self.unregister(sid)
+            if last and self.on_offline:
+                self.on_offline(user_id)
+        pipe = self.redis.pipeline()
+        pipe.delete(self._key('alive', self.worker_id), self._key('worker', self.worker_id))
+        pipe.srem(self._key('workers'), self.worker_id)
+        pipe.execute()
+
+    def stats(self):
+        result = super().stats()
+        result.update({'shared': True, 'worker_id': self.worker_id, 'purged': self._purged})
+        return result
+
+
+class CallRegistry:
+    """进行中的通话 {caller_id: {receiver_id, is_video, start_time, answered}}"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def start(self, caller_id, receiver_id, is_video):
+        with self._lock:
+            self._calls[caller_id] = {'receiver_id': receiver_id, 'is_video': is_video, 'start_time': time.time()}
+
+    def answer(self, caller_id):
+        """接听时重新开始计时"""
+        with self._lock:
+            call = self._calls.get(caller_id)
+            if call is not None:
+                call.update(start_time=time.time(), answered=True)
+
+    def pop(self, caller_id):
+        with self._lock:
+            return self._calls.pop(caller_id, None)
+
+    def pop_for(self, user_id):
+        """结束用户参与的通话（作为呼叫者或接听者）"""
+        with self._lock:
+            if user_id in self._calls:
+                return self._calls.pop(user_id)
+            for caller_id, call in self._calls.items():
+                if call['receiver_id'] == user_id:
+                    return self._calls.pop(caller_id)
+        return None
+
+
+class SharedCallRegistry(CallRegistry):
+    """多进程共享的通话状态，保存在 Redis 哈希中"""
+
+    def __init__(self, url, prefix='ws'):
+        super().__init__()
+        import redis
+        self.redis = redis.Redis.from_url(url, decode_responses=True)
+        self.key = f'{prefix}:calls'
+
+    def start(self, caller_id, receiver_id, is_video):
+        call = {'receiver_id': receiver_id, 'is_video': is_video, 'start_time': time.time()}
+        self.redis.hset(self.key, caller_id, json.dumps(call))
+
+    def answer(self, caller_id):
+        value = self.redis.hget(self.key, caller_id)
+        if value is not None:
+            call = json.loads(value)
+            call.update(start_time=time.time(), answered=True)
+            self.redis.hset(self.key, caller_id, json.dumps(call))
+
+    def pop(self, caller_id):
+        pipe = self.redis.pipeline()
+        pipe.hget(self.key, caller_id)
+        pipe.hdel(self.key, caller_id)
+        value, removed = pipe.execute()
+        # 其他进程同时取走时只有一方拿到
+        return json.loads(value) if value is not None and removed else None
+
+    def pop_for(self, user_id):
+        call = self.pop(user_id)
+        if call is not None:
+            return call
+        for caller_id, value in self.redis.hgetall(self.key).items():
+            if json.loads(value)['receiver_id'] == user_id:
+                return self.pop(int(caller_id))
+        return None
+
+
+if Config.SHARED_STATE_URL:
+    socket_sessions = SharedSessionRegistry(Config.SHARED_STATE_URL, prefix=Config.SHARED_STATE_PREFIX)
+    active_calls = SharedCallRegistry(Config.SHARED_STATE_URL, prefix=Config.SHARED_STATE_PREFIX)
+else:
+    socket_sessions = SessionRegistry()
+    active_calls = CallRegistry()
@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+"""更新签到表，添加多区域/多边形签到围栏字段"""
+from database import Database
+
+def update_schema():
+    conn = Database.get_connection()
+    cursor = conn.cursor()
+    
+    try:
+        print("=== 更新 checkins 表 ===")
+        # 添加 location_zones 字段：JSON 数组，为空时使用 location_lat/location_lng/location_range
+        try:
+            cursor.execute("""
+                ALTER TABLE checkins 
+                ADD COLUMN location_zones TEXT DEFAULT NULL COMMENT '签到允许区域（JSON，圆形/多边形）'
+            """)
+            print("✓ checkins.location_zones 已添加")
+        except Exception as e:
+            if "Duplicate column" in str(e):
+                print("- checkins.location_zones 已存在")
+            else:
+                print(f"添加失败: {e}")
+        
+        conn.commit()
+        print("\n数据库更新成功！")
+    except Exception as e:
+        print(f"更新失败: {e}")
+        conn.rollback()
+    finally:
+        cursor.close()
+        conn.close()
+
+if __name__ == '__main__':
+    update_schema()
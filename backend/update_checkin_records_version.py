@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+"""更新签到表，添加签到记录变更版本号（/records?since= 增量查询的游标）"""
+from database import Database
+
+def update_schema():
+    conn = Database.get_connection()
+    cursor = conn.cursor()
+
+    try:
+        print("=== 更新 checkins 表 ===")
+        try:
+            cursor.execute("""
+                ALTER TABLE checkins
+                ADD COLUMN records_version INT NOT NULL DEFAULT 0 COMMENT '签到记录变更版本号，写入签到记录的事务中加一'
+            """)
+            print("✓ checkins.records_version 已添加")
+        except Exception as e:
+            if "Duplicate column" in str(e):
+                print("- checkins.records_version 已存在")
+            else:
+                print(f"添加失败: {e}")
+
+        print("\n=== 更新 checkin_records 表 ===")
+        try:
+            cursor.execute("""
+                ALTER TABLE checkin_records
+                ADD COLUMN version INT NOT NULL DEFAULT 0 COMMENT '最后一次写入时签到的 records_version'
+            """)
+            print("✓ checkin_records.version 已添加")
+        except Exception as e:
+            if "Duplicate column" in str(e):
+                print("- checkin_records.version 已存在")
+            else:
+                print(f"添加失败: {e}")
+        try:
+            cursor.execute("ALTER TABLE checkin_records ADD INDEX idx_checkin_version (checkin_id, version)")
+            print("✓ checkin_records.idx_checkin_version 已添加")
+        except Exception as e:
+            if "Duplicate key name" in str(e):
+                print("- checkin_records.idx_checkin_version 已存在")
+            else:
+                print(f"添加失败: {e}")
+
+        conn.commit()
+        print("\n数据库更新成功！")
+    except Exception as e:
+        print(f"更新失败: {e}")
+        conn.rollback()
+    finally:
+        cursor.close()
+        conn.close()
+
+if __name__ == '__main__':
+    update_schema()
@@ -6,23 +6,37 @@ from flask_socketio import SocketIO, emit, join_room, leave_room
 from flask_jwt_extended import decode_token
 from flask import request
 from message_service import MessageService
+from session_registry import socket_sessions, active_calls, SharedSessionRegistry
+from config import Config
+from presence import contact_graph, presence_broadcaster, SharedAnnouncedSet
 
 socketio = SocketIO()
 
-# 存储用户连接信息 {user_id: sid}
-connected_users = {}
-
 
 def init_socketio(app):
-    """初始化 SocketIO - 使用 gevent 作为异步后端"""
+    """
+    初始化 SocketIO - 使用 gevent 作为异步后端
+
+    配置 SOCKETIO_MESSAGE_QUEUE 时可以运行多个进程（负载均衡需开启会话保持），
+    向房间发送的事件经消息队列送达连接在任一进程上的用户。
+    """
+    options = {}
+    if Config.SOCKETIO_MESSAGE_QUEUE:
+        options = {'message_queue': Config.SOCKETIO_MESSAGE_QUEUE, 'channel': Config.SOCKETIO_CHANNEL}
     socketio.init_app(
         app,
         cors_allowed_origins="*",
         async_mode='gevent',
         ping_timeout=60,
-        ping_interval=25
+        ping_interval=25,
+        **options
     )
-    print("WebSocket 服务器初始化完成 (async_mode=gevent)")
+    if isinstance(socket_sessions, SharedSessionRegistry):
+        socket_sessions.on_offline = mark_offline
+        presence_broadcaster.announced = SharedAnnouncedSet(socket_sessions.redis, Config.SHARED_STATE_PREFIX)
+        socket_sessions.start()
+    mode = f"消息队列 {Config.SOCKETIO_MESSAGE_QUEUE}" if options else "单进程"
+    print(f"WebSocket 服务器初始化完成 (async_mode=gevent, {mode})")
     return socketio
 
 
@@ -31,7 +45,7 @@ def handle_connect(auth=None):
     """处理连接"""
     sid = request.sid
     print(f'[WebSocket] 客户端连接: {sid}')
-    print(f'[WebSocket] 当前连接数: {len(connected_users)}')
+    print(f'[WebSocket] 当前已认证连接数: {len(socket_sessions)}')
 
 
 @socketio.on('authenticate')
@@ -49,23 +63,26 @@ def handle_authenticate(data):
         user_id = int(decoded['sub'])
         sid = request.sid
 
-        # 保存用户连接
-        connected_users[user_id] = sid
+        # 登记连接（同一用户可以有多个连接，例如多个标签页、手机和电脑）
+        first = socket_sessions.register(
+            sid, user_id,
+            remote_addr=request.remote_addr,
+            user_agent=request.headers.get('User-Agent')
+        )
 
         # 加入个人房间 - 这是接收消息和通话的关键
         room_name = f'user_{user_id}'
         join_room(room_name)
         print(f'[WebSocket] 用户 {user_id} 加入房间: {room_name}')
 
-        # 更新在线状态
-        MessageService.update_online_status(user_id, True, sid)
-
-        # 通知好友上线
-        broadcast_online_status(user_id, True)
+        # 第一个连接时更新在线状态并通知好友上线
+        if first:
+            MessageService.update_online_status(user_id, True, sid)
+            broadcast_online_status(user_id, True)
 
         emit('authenticated', {'user_id': user_id})
         print(f'[WebSocket] 用户 {user_id} 认证成功, sid: {sid}')
-        print(f'[WebSocket] 当前在线用户: {list(connected_users.keys())}')
+        print(f'[WebSocket] 用户 {user_id} 当前连接数: {len(socket_sessions.sids_of(user_id))}')
 
     except Exception as e:
         print(f'[WebSocket] 认证失败: {e}')
@@ -79,30 +96,23 @@ def handle_disconnect():
     """处理断开连接"""
     sid = request.sid
 
-    # 查找断开的用户
-    user_id = None
-    for uid, s in list(connected_users.items()):
-        if s == sid:
-            user_id = uid
-            del connected_users[uid]
-            break
+    user_id, last = socket_sessions.unregister(sid)
 
-    if user_id:
-        # 更新在线状态
-        MessageService.update_online_status(user_id, False)
+    # 用户的最后一个连接断开时才算下线
+    if user_id and last:
+        mark_offline(user_id)
+        print(f'用户 {user_id} 断开连接')
 
-        # 通知好友下线
-        broadcast_online_status(user_id, False)
 
-        print(f'用户 {user_id} 断开连接')
+def mark_offline(user_id):
+    """用户最后一个连接断开（或所在进程退出）后更新在线状态并通知好友下线"""
+    MessageService.update_online_status(user_id, False)
+    broadcast_online_status(user_id, False)
 
 
 def get_user_id_from_sid(sid):
-    """根据 sid 获取用户 ID"""
-    for uid, s in connected_users.items():
-        if s == sid:
-            return uid
-    return None
+    """根据 sid 获取用户 ID（同时记录连接最近活动时间）"""
+    return socket_sessions.touch(sid)
 
 
 @socketio.on('send_message')
@@ -207,10 +217,6 @@ def handle_mark_read(data):
 
 # ==================== WebRTC 视频通话信令 ====================
 
-# 存储当前通话信息 {caller_id: {receiver_id, is_video, start_time}}
-active_calls = {}
-
-
 def save_call_record(caller_id, receiver_id, is_video, status, duration=0):
     """保存通话记录到消息表"""
     try:
@@ -254,11 +260,10 @@ def handle_call_user(data):
     print(f'[通话] ========== 发起通话 ==========')
     print(f'[通话] 呼叫者: {caller_id} -> 接收者: {receiver_id}')
     print(f'[通话] 类型: {"视频" if is_video else "语音"}')
-    print(f'[通话] 当前在线用户: {list(connected_users.keys())}')
-    print(f'[通话] 接收者 {receiver_id} 在线: {int(receiver_id) in connected_users}')
+    print(f'[通话] 接收者 {receiver_id} 在线: {socket_sessions.is_online(int(receiver_id))}')
 
     # 检查接收者是否在线
-    if int(receiver_id) not in connected_users:
+    if not socket_sessions.is_online(int(receiver_id)):
         print(f'[通话] 失败: 接收者 {receiver_id} 不在线')
         # 保存未接来电记录
         save_call_record(caller_id, int(receiver_id), is_video, 'missed')
@@ -275,13 +280,8 @@ def handle_call_user(data):
         emit('error', {'message': '用户信息获取失败'})
         return
 
-    # 记录通话开始
-    import time
-    active_calls[caller_id] = {
-        'receiver_id': int(receiver_id),
-        'is_video': is_video,
-        'start_time': time.time()
-    }
+    # 记录通话开始（多进程部署时保存在共享存储中，接听和挂断可能由其他进程处理）
+    active_calls.start(caller_id, int(receiver_id), is_video)
 
     # 发送来电通知给接收者
     call_data = {
@@ -319,10 +319,8 @@ def handle_answer_call(data):
     print(f'[通话] 接听: 用户 {answerer_id} 接听 用户 {caller_id} 的通话')
     
     # 更新通话开始时间（从接听时开始计算）
-    if caller_id in active_calls:
-        import time
-        active_calls[caller_id]['start_time'] = time.time()
-        active_calls[caller_id]['answered'] = True
+    if caller_id:
+        active_calls.answer(int(caller_id))
     
     target_room = f'user_{caller_id}'
     print(f'[通话] 发送 call_answered 到房间: {target_room}')
@@ -339,8 +337,8 @@ def handle_reject_call(data):
     print(f'[通话] 拒绝: 用户 {rejecter_id} 拒绝 用户 {caller_id} 的通话')
     
     # 保存拒绝记录
-    if caller_id in active_calls:
-        call_info = active_calls.pop(caller_id)
+    call_info = active_calls.pop(int(caller_id)) if caller_id else None
+    if call_info:
         save_call_record(caller_id, call_info['receiver_id'], call_info['is_video'], 'rejected')
     
     target_room = f'user_{caller_id}'
@@ -357,19 +355,9 @@ def handle_end_call(data):
     
     print(f'[通话] 结束: 用户 {user_id} 结束与 用户 {other_user_id} 的通话')
     
-    # 计算通话时长并保存记录
+    # 计算通话时长并保存记录（呼叫者或接听者结束）
     import time
-    call_info = None
-    
-    # 检查是否是呼叫者结束
-    if user_id in active_calls:
-        call_info = active_calls.pop(user_id)
-    # 检查是否是接听者结束
-    else:
-        for cid, info in list(active_calls.items()):
-            if info['receiver_id'] == user_id:
-                call_info = active_calls.pop(cid)
-                break
+    call_info = active_calls.pop_for(user_id) if user_id else None
     
     if call_info:
         if call_info.get('answered'):
@@ -400,26 +388,28 @@ def handle_ice_candidate(data):
 # ==================== 辅助函数 ====================
 
 def broadcast_online_status(user_id, is_online):
-    """广播用户在线状态"""
-    try:
-        conversations = MessageService.get_user_conversations(user_id)
-        print(f'[在线状态] 用户 {user_id} {"上线" if is_online else "下线"}, 通知 {len(conversations)} 个会话')
-
-        for conv in conversations:
-            other_user_id = conv['other_user_id']
-            if other_user_id in connected_users:
-                target_room = f'user_{other_user_id}'
-                socketio.emit('user_status_changed', {
-                    'user_id': user_id,
-                    'is_online': is_online
-                }, room=target_room)
-    except Exception as e:
-        print(f'[在线状态] 广播错误: {e}')
+    """广播用户在线状态（防抖窗口内的多次变化只广播最终状态）"""
+    presence_broadcaster.changed(user_id, is_online)
+
+
+def emit_online_status(user_id, is_online):
+    """通知在线的私聊联系人"""
+    peers = [uid for uid in contact_graph.peers(user_id) if socket_sessions.is_online(uid)]
+    print(f'[在线状态] 用户 {user_id} {"上线" if is_online else "下线"}, 通知 {len(peers)} 个在线联系人')
+    for other_user_id in peers:
+        socketio.emit('user_status_changed', {
+            'user_id': user_id,
+            'is_online': is_online
+        }, room=f'user_{other_user_id}')
+
+
+presence_broadcaster.emit = emit_online_status
+presence_broadcaster.is_online = socket_sessions.is_online
 
 
 def send_to_user(user_id, event, data):
     """发送消息给指定用户"""
-    if user_id in connected_users:
+    if socket_sessions.is_online(user_id):
         socketio.emit(event, data, room=f'user_{user_id}')
         return True
     return False
@@ -427,7 +417,7 @@ def send_to_user(user_id, event, data):
 
 def get_online_users():
     """获取所有在线用户"""
-    return list(connected_users.keys())
+    return socket_sessions.online_users()
 
 
 # ==================== 群聊 WebSocket 事件 ====================
@@ -464,6 +454,49 @@ def handle_leave_group_room(data):
         print(f'[群聊] 用户离开群聊房间: {room_name}')
 
 
+# ==================== 签到实时名单 ====================
+
+@socketio.on('join_checkin')
+def handle_join_checkin(data):
+    """教师订阅签到实时名单：先发送完整快照，之后推送 checkin_delta 增量"""
+    from database import Database
+    from checkin_roster import roster_hub, room_name
+
+    user_id = get_user_id_from_sid(request.sid)
+    checkin_id = data.get('checkin_id')
+    if not user_id or not checkin_id:
+        return
+    checkin_id = int(checkin_id)
+
+    # 只有创建者或群主/管理员可以订阅
+    sql = "SELECT creator_id, group_id FROM checkins WHERE id = %s"
+    checkin = Database.execute_query(sql, (checkin_id,), fetch_one=True)
+    if not checkin:
+        emit('error', {'message': '签到不存在'})
+        return
+    if checkin['creator_id'] != user_id:
+        sql = "SELECT role FROM group_members WHERE group_id = %s AND user_id = %s"
+        member = Database.execute_query(sql, (checkin['group_id'], user_id), fetch_one=True)
+        if not member or member['role'] not in ('owner', 'admin'):
+            emit('error', {'message': '无权查看该签到名单'})
+            return
+
+    # 先加入房间再取快照，快照之后的增量不会遗漏（客户端按 user_id 合并，快照之前到达的增量先暂存）
+    join_room(room_name(checkin_id))
+    roster = roster_hub.get(checkin_id)
+    if roster:
+        emit('checkin_snapshot', roster.snapshot())
+
+
+@socketio.on('leave_checkin')
+def handle_leave_checkin(data):
+    """取消订阅签到实时名单"""
+    from checkin_roster import room_name
+    checkin_id = data.get('checkin_id')
+    if checkin_id:
+        leave_room(room_name(int(checkin_id)))
+
+
 @socketio.on('send_group_message')
 def handle_send_group_message(data):
     """发送群消息"""
@@ -482,93 +515,24 @@ def handle_send_group_message(data):
         emit('error', {'message': '缺少必要参数'})
         return
     
-    from database import Database
-    from datetime import datetime, timedelta
-    import hashlib
-    import uuid
-    
-    # 验证用户是否是群成员
-    sql = "SELECT role, is_muted FROM group_members WHERE group_id = %s AND user_id = %s"
-    member = Database.execute_query(sql, (group_id, sender_id), fetch_one=True)
-    
-    if not member:
-        emit('error', {'message': '您不是该群成员'})
-        return
-    
-    if member['is_muted']:
-        emit('error', {'message': '您已被禁言'})
-        return
-    
-    checkin_id = None
-    checkin_code = None
+    from group_messaging import group_messages, GroupMessageError
     
-    # 如果是签到消息，先创建签到记录
+    # 成员身份和发送者信息走缓存，签到和消息在同一个事务中插入
+    checkin = None
     if message_type == 'checkin':
-        # 验证是否是管理员或群主
-        if member['role'] not in ('owner', 'admin'):
-            emit('error', {'message': '只有群主或管理员可以发起签到'})
-            return
-        
-        checkin_type = data.get('checkin_type', 'qrcode')
-        duration = data.get('duration', 5)
-        gesture_number = data.get('gesture_number')
-        location_lat = data.get('location_lat')
-        location_lng = data.get('location_lng')
-        location_range = data.get('location_range', 50)
-        
-        # 生成签到码
-        checkin_code = hashlib.md5(f"{uuid.uuid4()}{datetime.now().timestamp()}".encode()).hexdigest()[:8].upper()
-        end_time = datetime.now() + timedelta(minutes=duration)
-        
-        # 创建签到记录
-        sql = """
-            INSERT INTO checkins (group_id, creator_id, title, type, checkin_code, 
-                                  duration, end_time, description, gesture_number,
-                                  location_lat, location_lng, location_range, status)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, 'active')
-        """
-        checkin_id = Database.execute_query(sql, (
-            group_id, sender_id, content, checkin_type, checkin_code,
-            duration, end_time, '', gesture_number,
-            location_lat, location_lng, location_range
-        ), commit=True)
-        
-        print(f'[群聊签到] 创建签到: ID={checkin_id}, 类型={checkin_type}, 时长={duration}分钟')
-    
-    # 保存消息
-    if checkin_id:
-        sql = """
-            INSERT INTO group_messages (group_id, sender_id, message_type, content, reference_id, reference_type)
-            VALUES (%s, %s, %s, %s, %s, 'checkin')
-        """
-        message_id = Database.execute_query(sql, (group_id, sender_id, message_type, content, checkin_id), commit=True)
-    else:
-        sql = """
-            INSERT INTO group_messages (group_id, sender_id, message_type, content)
-            VALUES (%s, %s, %s, %s)
-        """
-        message_id = Database.execute_query(sql, (group_id, sender_id, message_type, content), commit=True)
-    
-    # 获取发送者信息
-    sql = "SELECT real_name, photo_url FROM users WHERE user_id = %s"
-    sender = Database.execute_query(sql, (sender_id,), fetch_one=True)
-    
-    # 获取消息时间
-    sql = "SELECT created_at FROM group_messages WHERE id = %s"
-    msg = Database.execute_query(sql, (message_id,), fetch_one=True)
-    
-    message_data = {
-        'id': message_id,
-        'group_id': group_id,
-        'sender_id': sender_id,
-        'sender_name': sender['real_name'],
-        'sender_avatar': sender['photo_url'],
-        'message_type': message_type,
-        'content': content,
-        'created_at': msg['created_at'].isoformat() if msg else None,
-        'reference_id': checkin_id,
-        'checkin_code': checkin_code
-    }
+        checkin = {
+            'checkin_type': data.get('checkin_type', 'qrcode'),
+            'duration': data.get('duration', 5),
+            'gesture_number': data.get('gesture_number'),
+            'location_lat': data.get('location_lat'),
+            'location_lng': data.get('location_lng'),
+            'location_range': data.get('location_range', 50)
+        }
+    try:
+        message_data = group_messages.send(int(group_id), sender_id, message_type, content, checkin)
+    except GroupMessageError as e:
+        emit('error', {'message': str(e)})
+        return
     
     # 广播到群聊房间
     room_name = f'group_{group_id}'
@@ -590,5 +554,5 @@ def notify_group_members(group_id, event, data):
     
     for member in members:
         user_id = member['user_id']
-        if user_id in connected_users:
+        if socket_sessions.is_online(user_id):
             socketio.emit(event, data, room=f'user_{user_id}')
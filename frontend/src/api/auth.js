@@ -164,6 +164,15 @@ export const detectHeadPose = (frameBase64) => {
   })
 }
 
+// 单帧同时检测眨眼和头部姿态
+export const detectLivenessFrame = (frameBase64) => {
+  return request({
+    url: '/face/liveness-frame',
+    method: 'post',
+    data: { frame: frameBase64 }
+  })
+}
+
 // 人脸登录（带活体检测）
 export const faceLoginWithLiveness = (faceImageBase64, livenessData) => {
   return request({
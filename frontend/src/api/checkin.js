@@ -35,10 +35,11 @@ export const doCheckin = (data) => {
 }
 
 // 获取签到记录（已签到/未签到）
-export const getCheckinRecords = (checkinId) => {
+export const getCheckinRecords = (checkinId, since) => {
   return request({
     url: `/checkin/${checkinId}/records`,
-    method: 'get'
+    method: 'get',
+    params: since ? { since } : undefined
   })
 }
 
@@ -109,3 +110,28 @@ export const smartCheckin = (data) => {
     data
   })
 }
+
+// 群组考勤统计（每个学生的出勤率和每次签到人数）
+export const getGroupAttendance = (groupId) => {
+  return request({
+    url: `/checkin/stats/group/${groupId}`,
+    method: 'get'
+  })
+}
+
+// 我的考勤统计（按群组）
+export const getMyAttendance = () => {
+  return request({
+    url: '/checkin/stats/me',
+    method: 'get'
+  })
+}
+
+// 批量重新校验位置签到记录（可同时修正签到位置，apply 为 true 时更新记录状态）
+export const revalidateLocation = (checkinId, data) => {
+  return request({
+    url: `/checkin/${checkinId}/location/revalidate`,
+    method: 'post',
+    data
+  })
+}
@@ -212,6 +212,16 @@ class SocketService {
     return this.emit('leave_group_room', { group_id: groupId })
   }
 
+  // 订阅签到实时名单（教师端）
+  joinCheckin(checkinId) {
+    return this.emit('join_checkin', { checkin_id: checkinId })
+  }
+
+  // 取消订阅签到实时名单
+  leaveCheckin(checkinId) {
+    return this.emit('leave_checkin', { checkin_id: checkinId })
+  }
+
   // 发送群消息
   sendGroupMessage(groupId, messageType, content) {
     return this.emit('send_group_message', {